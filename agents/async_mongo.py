@@ -0,0 +1,51 @@
+# asyncio Mongo clients for the ASGI server, tuned like the sync pool
+
+import asyncio
+import os
+
+import certifi
+from agents.logger import get_logger  # type: ignore
+from agents.mongo_pool import (  # type: ignore
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_TLS
+)
+
+try:
+    # PyMongo 4.9+ ships a native asyncio client
+    from pymongo import AsyncMongoClient
+except ImportError:  # pragma: no cover - older PyMongo
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+    except ImportError:
+        AsyncMongoClient = None
+
+logger = get_logger("mongo_pool", "logs/mongo_pool.log")
+
+# Async clients are bound to the event loop that created them
+_clients = {}  # (pid, id(loop), uri) -> client
+
+
+def get_async_client(uri=None):
+    if AsyncMongoClient is None:
+        raise RuntimeError("Async mode needs PyMongo 4.9+ or Motor installed")
+    uri = uri or os.getenv("MONGO_URI")
+    key = (os.getpid(), id(asyncio.get_running_loop()), uri)
+    client = _clients.get(key)
+    if client is None:
+        options = {
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+            "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        }
+        if MONGO_TLS:
+            options.update(tls=True, tlsCAFile=certifi.where())
+        client = AsyncMongoClient(uri, **options)
+        _clients[key] = client
+        logger.info(f"✅ Created async Mongo client ({AsyncMongoClient.__name__}, pid {os.getpid()})")
+    return client
+
+
+def get_async_collection(db_name, collection_name, uri=None):
+    return get_async_client(uri)[db_name][collection_name]
@@ -0,0 +1,295 @@
+# In-memory index over the model catalog: names, attribute postings, numeric ranges
+
+import bisect
+import os
+import re
+import threading
+from collections import defaultdict
+
+from agents.logger import get_logger  # type: ignore
+from agents.model_catalog import get_model_catalog  # type: ignore
+from agents.pricing_index import normalize_model_name  # type: ignore
+
+logger = get_logger("catalog_index", "logs/catalog_index.log")
+
+# Attributes with inverted postings (normalized value -> model ids)
+POSTING_FIELDS = ("type", "cloud", "region")
+# Documents name their model under any of these fields
+NAME_FIELDS = ("model_name", "name", "key")
+
+_NUMBER = re.compile(r"(\d+(?:\.\d+)?)")
+
+
+def normalize_value(value):
+    return " ".join(str(value or "").lower().split())
+
+
+def parse_accuracy(value):
+    """Accuracy as a percentage: 0.997 -> 99.7, '98.5 %' -> 98.5"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number, percent = float(value), False
+    else:
+        match = _NUMBER.search(str(value))
+        if not match:
+            return None
+        number, percent = float(match.group(1)), "%" in str(value)
+    return number if percent or number > 1 else number * 100
+
+
+def parse_speed(value):
+    """
+    Latency in milliseconds (lower is faster): '15 ms per token' -> 15,
+    '2 s per image' -> 2000, '50 tokens/sec' -> 20. Units of work (token,
+    page, image) are not converted, only the time unit.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).lower()
+    match = _NUMBER.search(text)
+    if not match:
+        return None
+    number = float(match.group(1))
+    unit = text[match.end():].strip()
+    if re.match(r"(?:tokens?|pages?|images?|requests?)\s*(?:/|per)\s*s", unit):
+        return 1000.0 / number if number else None
+    if re.match(r"(?:µs|us|micro)", unit):
+        return number / 1000
+    if re.match(r"(?:ms|milli)", unit):
+        return number
+    if re.match(r"(?:s\b|sec|second)", unit):
+        return number * 1000
+    if re.match(r"(?:min|minute)", unit):
+        return number * 60000
+    return number
+
+
+class _SortedColumn:
+    """Values kept sorted alongside their ids, for bisect range lookups"""
+
+    def __init__(self):
+        self.values = []
+        self.ids = []
+
+    def add(self, value, doc_id):
+        i = bisect.bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.ids.insert(i, doc_id)
+
+    def remove(self, value, doc_id):
+        i = bisect.bisect_left(self.values, value)
+        while i < len(self.values) and self.values[i] == value:
+            if self.ids[i] == doc_id:
+                del self.values[i]
+                del self.ids[i]
+                return
+            i += 1
+
+    def range(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        start = 0 if low is None else (
+            bisect.bisect_left(self.values, low) if low_inclusive else bisect.bisect_right(self.values, low)
+        )
+        end = len(self.values) if high is None else (
+            bisect.bisect_right(self.values, high) if high_inclusive else bisect.bisect_left(self.values, high)
+        )
+        return self.ids[start:end]
+
+
+class CatalogIndex:
+    """
+    Lookups over the catalog without scanning it:
+
+    - `get(name)`: normalized model name -> document
+    - `query(type=..., cloud=..., region=..., min_accuracy=..., max_speed_ms=...)`:
+      postings intersected with bisect ranges on the accuracy/speed columns
+    - `parse_query("accuracy > 95%, Azure")` turns free text into those filters
+
+    Kept current by `ModelCatalog.subscribe`: single-document changes are
+    applied in place, full reloads rebuild the index.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._docs = {}                     # id -> document
+        self._names = {}                    # normalized name -> id
+        self._postings = {field: defaultdict(set) for field in POSTING_FIELDS}
+        self._accuracy = _SortedColumn()    # percent
+        self._speed = _SortedColumn()       # milliseconds
+        self._numeric = {}                  # id -> (accuracy, speed)
+
+    # ---------- maintenance ----------
+
+    def _add(self, doc_id, doc):
+        self._docs[doc_id] = doc
+        for field in NAME_FIELDS:
+            name = normalize_model_name(doc.get(field))
+            if name:
+                self._names.setdefault(name, doc_id)
+        for field in POSTING_FIELDS:
+            value = normalize_value(doc.get(field))
+            if value:
+                self._postings[field][value].add(doc_id)
+        accuracy, speed = parse_accuracy(doc.get("accuracy")), parse_speed(doc.get("speed"))
+        if accuracy is not None:
+            self._accuracy.add(accuracy, doc_id)
+        if speed is not None:
+            self._speed.add(speed, doc_id)
+        self._numeric[doc_id] = (accuracy, speed)
+
+    def _remove(self, doc_id):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        for field in NAME_FIELDS:
+            name = normalize_model_name(doc.get(field))
+            if name and self._names.get(name) == doc_id:
+                del self._names[name]
+        for field in POSTING_FIELDS:
+            value = normalize_value(doc.get(field))
+            ids = self._postings[field].get(value)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self._postings[field][value]
+        accuracy, speed = self._numeric.pop(doc_id, (None, None))
+        if accuracy is not None:
+            self._accuracy.remove(accuracy, doc_id)
+        if speed is not None:
+            self._speed.remove(speed, doc_id)
+
+    def rebuild(self, items):
+        with self._lock:
+            self._clear()
+            for doc_id, doc in items:
+                self._add(doc_id, doc)
+        logger.info(f"✅ Indexed {len(self._docs)} catalog models.")
+
+    def upsert(self, doc_id, doc):
+        with self._lock:
+            self._remove(doc_id)
+            self._add(doc_id, doc)
+
+    def delete(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    # ---------- reads ----------
+
+    def get(self, name):
+        """The catalog document for a model name (any spelling/casing), or None"""
+        with self._lock:
+            doc_id = self._names.get(normalize_model_name(name))
+            return self._docs.get(doc_id) if doc_id is not None else None
+
+    def values(self, field):
+        """Distinct normalized values of a postings field"""
+        with self._lock:
+            return list(self._postings[field])
+
+    def query(self, type=None, cloud=None, region=None, min_accuracy=None, max_accuracy=None,
+              min_speed_ms=None, max_speed_ms=None, limit=None):
+        """
+        Documents matching every given filter, most accurate first. Attribute
+        filters take one value or a list of alternatives; accuracy is in
+        percent, speed in milliseconds (lower is faster).
+        """
+        with self._lock:
+            candidates = None
+
+            for field, wanted in (("type", type), ("cloud", cloud), ("region", region)):
+                if wanted is None:
+                    continue
+                values = [wanted] if isinstance(wanted, str) else wanted
+                ids = set()
+                for value in values:
+                    ids |= self._postings[field].get(normalize_value(value), set())
+                candidates = ids if candidates is None else candidates & ids
+
+            if min_accuracy is not None or max_accuracy is not None:
+                ids = set(self._accuracy.range(min_accuracy, max_accuracy))
+                candidates = ids if candidates is None else candidates & ids
+            if min_speed_ms is not None or max_speed_ms is not None:
+                ids = set(self._speed.range(min_speed_ms, max_speed_ms))
+                candidates = ids if candidates is None else candidates & ids
+
+            if candidates is None:
+                candidates = self._docs.keys()
+            ordered = sorted(candidates, key=lambda i: -(self._numeric[i][0] or 0.0))
+            if limit is not None:
+                ordered = ordered[:limit]
+            return [self._docs[i] for i in ordered]
+
+    def parse_query(self, text):
+        """
+        Filters found in free text: "accuracy > 95%, Azure, under 20 ms" ->
+        {"min_accuracy": 95.0, "cloud": ["azure"], "max_speed_ms": 20.0}
+        """
+        text = normalize_value(text)
+        filters = {}
+
+        comparisons = re.findall(r"accura\w*\s*(?:of\s*)?(>=|<=|>|<|above|over|at least|below|under)\s*(\d+(?:\.\d+)?)", text)
+        comparisons += re.findall(r"(>=|<=|>|<|above|over|at least|below|under)\s*(\d+(?:\.\d+)?)\s*%\s*accura", text)
+        for op, number in comparisons:
+            value = parse_accuracy(number + "%") if float(number) > 1 else parse_accuracy(float(number))
+            if op in (">", ">=", "above", "over", "at least"):
+                filters["min_accuracy"] = value
+            else:
+                filters["max_accuracy"] = value
+
+        match = re.search(r"(?:speed|latency)?\s*(?:<=|<|under|below|within|faster than)\s*(\d+(?:\.\d+)?)\s*(ms|milliseconds?|s|sec|seconds?)\b", text)
+        if match:
+            filters["max_speed_ms"] = parse_speed(f"{match.group(1)} {match.group(2)}")
+
+        with self._lock:
+            for field in POSTING_FIELDS:
+                found = [value for value in self._postings[field]
+                         if re.search(r"(?<![\w-])" + re.escape(value) + r"(?![\w-])", text)]
+                if found:
+                    filters[field] = found
+        return filters
+
+    def __len__(self):
+        return len(self._docs)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _index, _index_lock
+    _index = None
+    _index_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_catalog_index():
+    """The shared index, built from the catalog and kept in step with it"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                catalog = get_model_catalog()
+                index = CatalogIndex()
+
+                def on_change(event, doc_id, doc):
+                    if event == "upsert":
+                        index.upsert(doc_id, doc)
+                    elif event == "delete":
+                        index.delete(doc_id)
+                    else:
+                        index.rebuild(catalog.items())
+
+                catalog.subscribe(on_change)
+                index.rebuild(catalog.items())
+                _index = index
+    return _index
@@ -0,0 +1,175 @@
+# Local relevance ranking of catalog models and prompt token budgeting
+
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+from agents.logger import get_logger  # type: ignore
+
+logger = get_logger("catalog_search", "logs/catalog_search.log")
+
+# Candidates the recommender prompt may list, and the token budget for that list
+RECOMMENDER_TOP_K = int(os.getenv("RECOMMENDER_TOP_K", "40"))
+RECOMMENDER_CATALOG_TOKEN_BUDGET = int(os.getenv("RECOMMENDER_CATALOG_TOKEN_BUDGET", "4000"))
+
+# Catalog fields that describe what a model is for
+SEARCH_FIELDS = ("model_name", "type", "cloud", "region", "provider", "description", "use_case", "tags")
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Requirement words that rarely appear verbatim in the catalog fields
+_SYNONYMS = {
+    "image": ["vision", "multimodal"], "photo": ["vision", "image"], "picture": ["vision", "image"],
+    "scan": ["ocr", "document"], "scanned": ["ocr", "document"], "invoice": ["ocr", "document"],
+    "receipt": ["ocr", "document"], "pdf": ["ocr", "document"], "handwriting": ["ocr"],
+    "chat": ["text", "generation", "conversational"], "chatbot": ["text", "generation", "conversational"],
+    "summarize": ["text", "summarization"], "summary": ["text", "summarization"],
+    "write": ["text", "generation"], "writing": ["text", "generation"],
+    "code": ["code", "generation"], "coding": ["code", "generation"],
+    "speech": ["audio", "speech"], "voice": ["audio", "speech"], "transcribe": ["audio", "speech", "transcription"],
+    "translate": ["translation", "text"], "video": ["vision", "multimodal", "video"],
+    "embedding": ["embedding", "embeddings"], "search": ["embedding", "embeddings"],
+    "aws": ["aws", "amazon"], "amazon": ["aws"], "gcp": ["gcp", "google"], "google": ["gcp"],
+    "azure": ["azure", "microsoft"], "microsoft": ["azure"],
+}
+
+
+def _tokenize(text):
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", str(text or "").lower()):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _model_text(model):
+    parts = []
+    for field in SEARCH_FIELDS:
+        value = model.get(field)
+        if isinstance(value, (list, tuple)):
+            parts.extend(str(v) for v in value)
+        elif value:
+            parts.append(str(value))
+    return " ".join(parts)
+
+
+def expand_query(text):
+    tokens = _tokenize(text)
+    expanded = list(tokens)
+    for token in tokens:
+        expanded.extend(_SYNONYMS.get(token, []))
+    return expanded
+
+
+class BM25Index:
+    """Okapi BM25 over the searchable fields of a list of catalog documents"""
+
+    def __init__(self, models):
+        self.models = list(models)
+        self.doc_terms = [Counter(_tokenize(_model_text(m))) for m in self.models]
+        self.doc_lengths = [sum(terms.values()) for terms in self.doc_terms]
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+        document_frequency = Counter()
+        for terms in self.doc_terms:
+            document_frequency.update(terms.keys())
+        n = len(self.models)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for term, df in document_frequency.items()
+        }
+
+    def scores(self, query_terms):
+        query = Counter(t for t in query_terms if t in self.idf)
+        results = []
+        for terms, length in zip(self.doc_terms, self.doc_lengths):
+            score = 0.0
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length) if self.avg_length else BM25_K1
+            for term, weight in query.items():
+                tf = terms.get(term)
+                if tf:
+                    score += weight * self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+            results.append(score)
+        return results
+
+    def search(self, text, top_k=None):
+        """Models ordered by relevance; unmatched models follow in catalog order"""
+        scores = self.scores(expand_query(text))
+        order = sorted(range(len(self.models)), key=lambda i: -scores[i])
+        if top_k is not None:
+            order = order[:top_k]
+        return [(self.models[i], scores[i]) for i in order]
+
+
+_index = None
+_index_source = None
+_index_lock = threading.Lock()
+
+
+def get_bm25_index(models):
+    """BM25 index for a catalog snapshot, rebuilt only when the snapshot changes"""
+    global _index, _index_source
+    with _index_lock:
+        if _index is None or _index_source is not models:
+            _index = BM25Index(models)
+            _index_source = models
+        return _index
+
+
+# ---------- token budgeting ----------
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            try:
+                _encoding = tiktoken.encoding_for_model("gpt-4o")
+            except KeyError:
+                _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # tiktoken downloads its BPE tables on first use; without them, estimate
+            logger.warning(f"⚠️ tiktoken unavailable, estimating tokens from length: {e}")
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text or "", disallowed_special=()))
+    return math.ceil(len(text or "") / 4)
+
+
+def count_message_tokens(messages):
+    # Each chat message carries a few tokens of framing on top of its content
+    return sum(count_tokens(m.get("content", "")) + 4 for m in messages) + 3
+
+
+def clip_text(text, max_tokens):
+    """(`text` cut to roughly `max_tokens` tokens keeping its beginning, its token count)"""
+    text = str(text or "")
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text, tokens
+    clipped = text[:max(1, len(text) * max_tokens // tokens)].rstrip() + " …"
+    return clipped, count_tokens(clipped)
+
+
+def fit_to_budget(lines, budget):
+    """The longest prefix of `lines` whose total token count fits in `budget`"""
+    kept, used = [], 0
+    for line in lines:
+        tokens = count_tokens(line)
+        if kept and used + tokens > budget:
+            break
+        kept.append(line)
+        used += tokens
+    return kept, used
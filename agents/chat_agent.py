@@ -1,16 +1,16 @@
 # Enhanced chat agent with clean, user-friendly output
 
+import asyncio
 import os
-import json
-import docx
-import csv
 import re
-import pandas as pd
-import pytesseract
-import speech_recognition as sr
-from PIL import Image
 from agents.logger import get_logger  # type: ignore
-from pymongo import MongoClient
+from agents.mongo_pool import LazyCollection  # type: ignore
+from agents.pipeline import StagePipeline  # type: ignore
+from agents.fast_classifier import FAST_CLASSIFIER_ENABLED, fast_classifier  # type: ignore
+from agents.classify_batcher import CLASSIFICATION_GUIDE, CLASSIFY_BATCH_ENABLED, get_classify_batcher  # type: ignore
+from agents.catalog_index import get_catalog_index  # type: ignore
+from agents.conversation_buffer import format_history, load_recent_chats, seed_history  # type: ignore
+from agents.file_extractors import extract_file  # type: ignore
 from dotenv import load_dotenv
 import random
 
@@ -18,94 +18,44 @@ logger = get_logger("chat_agent", "logs/chat_agent.log")
 
 # Load environment variables to connect to MongoDB
 load_dotenv()
-mongo_client = MongoClient(os.getenv("MONGO_URI"))
-user_db = mongo_client[os.getenv("USER_DB_NAME")]
-model_col = user_db["models"]
-final_model_col = user_db["final_models"]
-chats_col = user_db["chats"]
+user_db_name = os.getenv("USER_DB_NAME")
+final_model_col = LazyCollection(user_db_name, "final_models")
+
+# Greeting/Goodbye/OffTopic replies come from templates instead of gpt-4o
+CANNED_RESPONSES = os.getenv("CANNED_RESPONSES", "true").lower() in ("1", "true", "yes")
+
+CANNED_TEMPLATES = {
+    "greeting": [
+        "Hi there! What AI task can I help you find the right model for today?",
+        "Hello! Tell me what you'd like to build and I'll suggest the best AI models for it.",
+        "Hey! Which AI use-case are you working on? I can recommend models that fit.",
+        "Welcome! Describe your AI requirement and I'll find a model that matches it.",
+    ],
+    "goodbye": [
+        "Goodbye! Come back anytime you need help choosing an AI model.",
+        "Take care! I'm here whenever you want another model recommendation.",
+        "See you soon! Happy building with your AI models.",
+        "Bye for now! Drop by again when you have a new AI task in mind.",
+    ],
+    "off_topic": [
+        "I can only help with choosing AI models, so tell me about an AI task you have in mind.",
+        "That's outside what I can help with, but I'd love to recommend an AI model for your next project.",
+        "I'm focused on AI model recommendations. What AI use-case can I help you with?",
+    ],
+}
+
+# Labels answered with a short reply (canned or generated) and the reply's context type
+QUICK_REPLIES = {"Greeting": "greeting", "Goodbye": "goodbye", "OffTopic": "off_topic"}
 
 class ChatAgent:
-    def __init__(self, gpt_client):
+    def __init__(self, gpt_client, async_client=None):
         self.client = gpt_client
-
-    def _read_text_file(self, file_path):
-        try:
-            with open(file_path, 'r') as f:
-                return f.read()
-        except Exception as e:
-            logger.error(f"Error reading text file: {e}")
-            return ""
-
-    def _read_docx_file(self, file_path):
-        try:
-            doc = docx.Document(file_path)
-            return "\n".join([para.text for para in doc.paragraphs])
-        except Exception as e:
-            logger.error(f"Error reading DOCX: {e}")
-            return ""
-
-    def _read_csv_file(self, file_path):
-        try:
-            with open(file_path, 'r', encoding="utf-8") as f:
-                reader = csv.reader(f)
-                return "\n".join([", ".join(row) for row in reader])
-        except Exception as e:
-            logger.error(f"Error reading CSV: {e}")
-            return ""
-
-    def _read_xlsx_file(self, file_path):
-        try:
-            df = pd.read_excel(file_path)
-            return df.to_string(index=False)
-        except Exception as e:
-            logger.error(f"Error reading XLSX: {e}")
-            return ""
-
-    def _read_json_file(self, file_path):
-        try:
-            with open(file_path, 'r') as f:
-                return json.dumps(json.load(f), indent=2)
-        except Exception as e:
-            logger.error(f"Error reading JSON: {e}")
-            return ""
-
-    def _read_image_file(self, file_path):
-        try:
-            img = Image.open(file_path)
-            return pytesseract.image_to_string(img)
-        except Exception as e:
-            logger.error(f"Error reading image: {e}")
-            return ""
-
-    def _read_audio_file(self, file_path):
-        recognizer = sr.Recognizer()
-        try:
-            with sr.AudioFile(file_path) as source:
-                audio_data = recognizer.record(source)
-                return recognizer.recognize_google(audio_data)
-        except Exception as e:
-            logger.error(f"Error reading audio: {e}")
-            return ""
+        # AsyncAzureOpenAI, for the *_async methods used by the ASGI app
+        self.async_client = async_client
 
     def _handle_file_input(self, file_path):
-        ext = os.path.splitext(file_path)[-1].lower()
-        if ext == '.txt':
-            return self._read_text_file(file_path)
-        elif ext == '.docx':
-            return self._read_docx_file(file_path)
-        elif ext == '.csv':
-            return self._read_csv_file(file_path)
-        elif ext == '.xlsx':
-            return self._read_xlsx_file(file_path)
-        elif ext == '.json':
-            return self._read_json_file(file_path)
-        elif ext in ['.png', '.jpg', '.jpeg']:
-            return self._read_image_file(file_path)
-        elif ext in ['.mp3', '.wav']:
-            return self._read_audio_file(file_path)
-        else:
-            logger.warning(f"Unsupported file format: {ext}")
-            return ""
+        """Text of a file, read as a stream and capped at FILE_TOKEN_BUDGET tokens"""
+        return extract_file(file_path).text
 
     def _collect_user_input(self):
         print("\nEnter your requirement (You can enter text or file path. Type 'exit' to quit):")
@@ -127,28 +77,86 @@ class ChatAgent:
 
         return "\n".join(lines).strip()
 
+    def _fetch_chat_turns(self, username, limit=10):
+        """Fetch the most recent chat documents in chronological order"""
+        return load_recent_chats(username, limit)
+
+    def _format_chat_history(self, chats, summary=""):
+        return format_history(chats, summary)
+
     def _get_chat_history(self, username, limit=10):
         """Fetch recent chat history for context"""
+        return self._format_chat_history(self._fetch_chat_turns(username, limit))
+
+    def _load_final_entry(self, username):
         try:
-            chats = list(chats_col.find({"email": username}).sort("_id", -1).limit(limit))
-            history = []
-            for chat in reversed(chats):  # Reverse to get chronological order
-                history.append(f"User: {chat['message']}")
-                if 'response' in chat:
-                    history.append(f"Agent: {chat['response']}")
-            return "\n".join(history)
+            return final_model_col.find_one({"email": username})
         except Exception as e:
-            logger.error(f"Error fetching chat history: {e}")
-            return ""
+            logger.error(f"Error loading final model: {e}")
+            return None
 
-    def _classify_with_context(self, user_input, username, current_model=None):
+    def _classify_with_context(self, user_input, username, current_model=None, chat_history=None):
         """Classify user input using chat history for better context"""
         try:
+            # Obvious messages are labelled locally; only the rest go to the LLM
+            if FAST_CLASSIFIER_ENABLED:
+                label, confidence, tier = fast_classifier.classify(user_input, current_model)
+                if label:
+                    logger.info(f"Fast-classified '{user_input}' as: {label} ({tier}, {confidence:.2f})")
+                    return label
+
             # Get recent chat history
-            chat_history = self._get_chat_history(username)
-            
-            # Enhanced classification prompt with context
-            classification_prompt = f"""
+            if chat_history is None:
+                chat_history = self._get_chat_history(username)
+
+            # Bursts of messages share one gpt-4o call
+            if CLASSIFY_BATCH_ENABLED:
+                classification = get_classify_batcher(self.client).classify(
+                    user_input, current_model, chat_history, self._classify_llm
+                )
+            else:
+                classification = self._classify_llm(user_input, current_model, chat_history)
+            logger.info(f"Classified '{user_input}' as: {classification}")
+            return classification
+
+        except Exception as e:
+            logger.error(f"Classification error: {e}")
+            return "OffTopic"  # Default fallback
+
+    async def _classify_with_context_async(self, user_input, username, current_model=None, chat_history=None):
+        """_classify_with_context awaiting the async client; no thread waits on gpt-4o"""
+        try:
+            if FAST_CLASSIFIER_ENABLED:
+                label, confidence, tier = fast_classifier.classify(user_input, current_model)
+                if label:
+                    logger.info(f"Fast-classified '{user_input}' as: {label} ({tier}, {confidence:.2f})")
+                    return label
+
+            if chat_history is None:
+                chat_history = await asyncio.to_thread(self._get_chat_history, username)
+
+            # The batcher exists to spare blocked threads; here the call is simply awaited
+            response = await self.async_client.chat.completions.create(
+                model="gpt-4o", messages=self._classify_messages(user_input, current_model, chat_history)
+            )
+            classification = response.choices[0].message.content.strip()
+            logger.info(f"Classified '{user_input}' as: {classification}")
+            return classification
+
+        except Exception as e:
+            logger.error(f"Classification error: {e}")
+            return "OffTopic"  # Default fallback
+
+    def _classify_llm(self, user_input, current_model, chat_history):
+        """One gpt-4o call that classifies a single message"""
+        classify_response = self.client.chat.completions.create(
+            model="gpt-4o",
+            messages=self._classify_messages(user_input, current_model, chat_history)
+        )
+        return classify_response.choices[0].message.content.strip()
+
+    def _classify_messages(self, user_input, current_model, chat_history):
+        classification_prompt = f"""
 You are classifying user messages in an AI model recommendation chatbot. 
 
 CHAT HISTORY:
@@ -158,40 +166,14 @@ CURRENT MODEL: {current_model if current_model else "None"}
 
 USER'S LATEST MESSAGE: {user_input}
 
-Classify the user's message into one of these categories:
-
-1. **Greeting** - Simple greetings like "hi", "hello", "good morning"
-2. **NewRequirement** - User wants recommendation for a NEW AI task/use-case
-3. **FollowUp** - User is asking about the CURRENT recommended model (includes yes/no responses to agent questions)
-4. **ModelRejection** - User explicitly rejects the current model and wants alternatives
-5. **Goodbye** - Messages like "bye", "good night", "see you", "talk later"
-6. **OffTopic** - Questions completely unrelated to AI models (math, weather, personal advice, etc.)
-
-IMPORTANT RULES:
-- If user says "yes", "ok", "sure", "no", "not really" after agent asked about current model → **FollowUp**
-- If user asks details about current model → **FollowUp**  
-- If user describes a completely new AI task → **NewRequirement**
-- If user says "I don't like this model" or "suggest another" → **ModelRejection**
-- Only classify as **OffTopic** if completely unrelated to AI models AND not a continuation of current conversation
+{CLASSIFICATION_GUIDE}
 
 Reply with ONLY one word: Greeting, NewRequirement, FollowUp, ModelRejection, Goodbye, or OffTopic
 """
-
-            classify_response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": classification_prompt},
-                    {"role": "user", "content": user_input.strip()}
-                ]
-            )
-
-            classification = classify_response.choices[0].message.content.strip()
-            logger.info(f"Classified '{user_input}' as: {classification}")
-            return classification
-
-        except Exception as e:
-            logger.error(f"Classification error: {e}")
-            return "OffTopic"  # Default fallback
+        return [
+            {"role": "system", "content": classification_prompt},
+            {"role": "user", "content": user_input.strip()}
+        ]
 
     def _format_response(self, raw_response, response_type="general", model_name=None):
         """
@@ -250,127 +232,205 @@ Reply with ONLY one word: Greeting, NewRequirement, FollowUp, ModelRejection, Go
             logger.error(f"Error formatting response: {e}")
             return raw_response
 
-    def _generate_smart_response(self, user_input, context_type, current_model=None, chat_history=""):
+    def _quick_response(self, user_input, context_type):
+        """Canned reply for simple turns, falling back to the LLM when disabled"""
+        if CANNED_RESPONSES and context_type in CANNED_TEMPLATES:
+            return random.choice(CANNED_TEMPLATES[context_type])
+        return self._generate_smart_response(user_input, context_type)
+
+    def _format_stream(self, deltas, response_type="general", model_name=None):
         """
-        Generate contextually appropriate responses with proper formatting
+        _format_response for a stream of text deltas: each line is formatted
+        as soon as it is complete, so formatted text can be forwarded before
+        the whole response exists. Yields formatted chunks.
         """
+        prefix = {"recommendation": "💡 ", "follow_up": "📝 "}.get(response_type, "")
+        buffer = ""
+        breaks = 0       # line breaks owed before the next non-blank line
+        started = False
+
+        def format_line(line):
+            nonlocal breaks, started
+            formatted = self._format_response(line, "general", model_name)
+            if not formatted.strip():
+                breaks += 1
+                return ""
+            body = formatted.lstrip("\n")
+            # Never more than one blank line in a row, as in _format_response
+            lead = min(max(breaks, len(formatted) - len(body)), 2)
+            chunk = ("\n" * lead + body) if started else (prefix + body)
+            started = True
+            breaks = 1
+            return chunk
+
+        for delta in deltas:
+            buffer += delta
+            *lines, buffer = buffer.split("\n")
+            for line in lines:
+                chunk = format_line(line)
+                if chunk:
+                    yield chunk
+
+        chunk = format_line(buffer)
+        if chunk:
+            yield chunk
+
+    def _stream_deltas(self, stream):
+        """Text deltas of a chat.completions stream"""
+        streamed = False
         try:
-            if context_type == "greeting":
-                system_prompt = """
-                You are a friendly AI model advisor. Generate a warm, welcoming greeting that:
-                - Is brief and conversational (1-2 sentences max)
-                - Asks about their AI needs
-                - Uses simple, friendly language
-                - Sounds natural and engaging
-                
-                Do NOT use any markdown formatting, ** symbols, or ## symbols.
-                Keep it clean and simple.
-                """
-                
-            elif context_type == "follow_up":
-                system_prompt = f"""
-                You are helping a user with the AI model: {current_model}
-                
-                RECENT CHAT HISTORY:
-                {chat_history}
-                
-                Generate a helpful response that:
-                - Answers their question about {current_model}
-                - Uses clear, simple language
-                - Provides practical information
-                - Adapts response style based on question complexity
-                
-                RESPONSE FORMATTING RULES:
-                1. For SHORT/SIMPLE questions: Give a brief paragraph answer (2-3 sentences)
-                2. For COMPLEX questions: Structure with intro paragraph + key points
-                3. For DETAILED explanations: Use mix of paragraphs and organized points
-                
-                FORMATTING GUIDELINES:
-                - Use clear hierarchy: Main points with sub-explanations
-                - For main features/points: use bullet points (•)
-                - For sub-explanations: use different style or indentation
-                - For steps/processes: use numbers (1. 2. 3.)
-                - For simple lists: use dashes (-)
-                - Always mention the model name: {current_model}
-                - Do NOT use ** or ## symbols
-                - Use moderate spacing between points
-                - Make key points stand out from explanations
-                
-                EXAMPLES:
-                Simple question: "Does it work with images?"
-                Answer: "Yes, {current_model} can process and analyze images effectively. It handles various formats including PNG, JPEG, and supports both image recognition and text extraction from images."
-                
-                Complex question: "What are its key features?"
-                Answer: "{current_model} offers several powerful features:
-                
-                • Advanced Processing: Handles large documents and complex data efficiently
-                • Multi-Format Support: Works with text, images, PDFs, and more
-                • High Accuracy: Delivers reliable results with 95%+ accuracy rates
-                • Easy Integration: Simple APIs and SDKs for quick implementation
-                
-                These features make {current_model} ideal for enterprise applications!"
-                
-                Make it conversational, helpful, and visually appealing.
-                """
-                
-            elif context_type == "off_topic":
-                system_prompt = """
-                The user asked something unrelated to AI models. 
-                Generate a polite redirect that:
-                - Is friendly but firm
-                - Redirects to AI model topics
-                - Is brief (1 sentence)
-                - Sounds natural
-                
-                Do NOT use any markdown formatting or special symbols.
-                """
-                
-            elif context_type == "goodbye":
-                system_prompt = """
-                Generate a friendly goodbye message that:
-                - Is warm and positive
-                - Invites them to return
-                - Is brief (1-2 sentences)
-                - Sounds natural
-                
-                Do NOT use any markdown formatting or special symbols.
-                """
-                
-            else:  # general
-                system_prompt = """
-                You are a helpful AI model advisor. Generate a response that:
-                - Matches the complexity of the user's question
-                - Uses clear, simple language
-                - Is well-structured for complex topics
-                - Is brief for simple questions
-                - Uses varied formatting (paragraphs, bullets, numbers)
-                
-                FORMATTING RULES:
-                - Do NOT use ** for bold text
-                - Do NOT use ## symbols  
-                - Use different bullet styles: • for features, 1. for steps, - for simple lists
-                - Vary your formatting approach
-                - Use proper spacing between elements
-                
-                Make it helpful, conversational, and visually appealing.
-                """
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    streamed = True
+                    yield delta
+        except Exception as e:
+            logger.error(f"Error streaming smart response: {e}")
+            yield ("\n\n" if streamed else "") + "I'm having trouble processing that right now. Please try again."
 
+    def _generate_smart_response(self, user_input, context_type, current_model=None, chat_history="", stream=False):
+        """
+        Generate contextually appropriate responses with proper formatting.
+        With stream=True, returns an iterator of raw text deltas instead.
+        """
+        try:
             response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_input.strip()}
-                ],
-                temperature=0.7,
-                max_tokens=500
+                **self._smart_response_request(user_input, context_type, current_model, chat_history), stream=stream
             )
 
+            if stream:
+                return self._stream_deltas(response)
+            return response.choices[0].message.content.strip()
+
+        except Exception as e:
+            logger.error(f"Error generating smart response: {e}")
+            error_message = "I'm having trouble processing that right now. Please try again."
+            return iter([error_message]) if stream else error_message
+
+    async def _generate_smart_response_async(self, user_input, context_type, current_model=None, chat_history=""):
+        """_generate_smart_response (not streamed) on the async client"""
+        try:
+            response = await self.async_client.chat.completions.create(
+                **self._smart_response_request(user_input, context_type, current_model, chat_history)
+            )
             return response.choices[0].message.content.strip()
 
         except Exception as e:
             logger.error(f"Error generating smart response: {e}")
             return "I'm having trouble processing that right now. Please try again."
 
+    def _smart_response_request(self, user_input, context_type, current_model=None, chat_history=""):
+        """chat.completions.create arguments for a reply of `context_type`"""
+        if context_type == "greeting":
+            system_prompt = """
+            You are a friendly AI model advisor. Generate a warm, welcoming greeting that:
+            - Is brief and conversational (1-2 sentences max)
+            - Asks about their AI needs
+            - Uses simple, friendly language
+            - Sounds natural and engaging
+            
+            Do NOT use any markdown formatting, ** symbols, or ## symbols.
+            Keep it clean and simple.
+            """
+            
+        elif context_type == "follow_up":
+            system_prompt = f"""
+            You are helping a user with the AI model: {current_model}
+            
+            RECENT CHAT HISTORY:
+            {chat_history}
+            
+            Generate a helpful response that:
+            - Answers their question about {current_model}
+            - Uses clear, simple language
+            - Provides practical information
+            - Adapts response style based on question complexity
+            
+            RESPONSE FORMATTING RULES:
+            1. For SHORT/SIMPLE questions: Give a brief paragraph answer (2-3 sentences)
+            2. For COMPLEX questions: Structure with intro paragraph + key points
+            3. For DETAILED explanations: Use mix of paragraphs and organized points
+            
+            FORMATTING GUIDELINES:
+            - Use clear hierarchy: Main points with sub-explanations
+            - For main features/points: use bullet points (•)
+            - For sub-explanations: use different style or indentation
+            - For steps/processes: use numbers (1. 2. 3.)
+            - For simple lists: use dashes (-)
+            - Always mention the model name: {current_model}
+            - Do NOT use ** or ## symbols
+            - Use moderate spacing between points
+            - Make key points stand out from explanations
+            
+            EXAMPLES:
+            Simple question: "Does it work with images?"
+            Answer: "Yes, {current_model} can process and analyze images effectively. It handles various formats including PNG, JPEG, and supports both image recognition and text extraction from images."
+            
+            Complex question: "What are its key features?"
+            Answer: "{current_model} offers several powerful features:
+            
+            • Advanced Processing: Handles large documents and complex data efficiently
+            • Multi-Format Support: Works with text, images, PDFs, and more
+            • High Accuracy: Delivers reliable results with 95%+ accuracy rates
+            • Easy Integration: Simple APIs and SDKs for quick implementation
+            
+            These features make {current_model} ideal for enterprise applications!"
+            
+            Make it conversational, helpful, and visually appealing.
+            """
+            
+        elif context_type == "off_topic":
+            system_prompt = """
+            The user asked something unrelated to AI models. 
+            Generate a polite redirect that:
+            - Is friendly but firm
+            - Redirects to AI model topics
+            - Is brief (1 sentence)
+            - Sounds natural
+            
+            Do NOT use any markdown formatting or special symbols.
+            """
+            
+        elif context_type == "goodbye":
+            system_prompt = """
+            Generate a friendly goodbye message that:
+            - Is warm and positive
+            - Invites them to return
+            - Is brief (1-2 sentences)
+            - Sounds natural
+            
+            Do NOT use any markdown formatting or special symbols.
+            """
+            
+        else:  # general
+            system_prompt = """
+            You are a helpful AI model advisor. Generate a response that:
+            - Matches the complexity of the user's question
+            - Uses clear, simple language
+            - Is well-structured for complex topics
+            - Is brief for simple questions
+            - Uses varied formatting (paragraphs, bullets, numbers)
+            
+            FORMATTING RULES:
+            - Do NOT use ** for bold text
+            - Do NOT use ## symbols  
+            - Use different bullet styles: • for features, 1. for steps, - for simple lists
+            - Vary your formatting approach
+            - Use proper spacing between elements
+            
+            Make it helpful, conversational, and visually appealing.
+            """
+
+        return {
+            "model": "gpt-4o",
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_input.strip()}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 500,
+        }
+
     def run_chat_loop(self):
         """
         Console-based chat loop - uses main processing function
@@ -402,138 +462,232 @@ Reply with ONLY one word: Greeting, NewRequirement, FollowUp, ModelRejection, Go
             print(result["message"])
             return None
 
-    def process_web_input(self, user_input, session_data=None, username=None):
+    def process_web_input(self, user_input, session_data=None, username=None, stream=False):
         """
-        Main processing function - handles all input types and generates responses
+        Main processing function - handles all input types and generates responses.
+        With stream=True, follow-up answers are returned as an iterator of
+        formatted chunks under "stream" instead of a finished "message".
         """
         try:
             if not user_input or not user_input.strip():
-                return {
-                    "proceed": False,
-                    "message": "Please provide your requirement to get started! 🤖"
-                }
+                return self._empty_input()
 
-            if session_data is None:
-                logger.info("Session data was None – initializing new session.")
-                session_data = {
-                    "shortlisted_models": [],
-                    "current_model": None,
-                    "rejected_models": [],
-                    "original_requirement": "",
-                    "is_new_requirement": 1
-                }
-
-            # Get current model from database
-            current_model = None
-            if username:
-                final_entry = final_model_col.find_one({"email": username})
-                if final_entry:
-                    current_model = final_entry.get("final_model")
-                    session_data["current_model"] = current_model
-                    session_data["original_requirement"] = final_entry.get("analyzed_input", "")
-                    logger.info(f"Loaded final model from DB: {current_model}")
+            session_data = self._session(session_data)
+            pipeline = StagePipeline("chat_agent")
+            chat_turns, current_model = self._load_context(pipeline, session_data, username)
 
             # Use enhanced classification with context
-            input_type = self._classify_with_context(user_input, username, current_model)
-            chat_history = self._get_chat_history(username, limit=5)
+            input_type = pipeline.run(
+                "classify",
+                self._classify_with_context,
+                user_input, username, current_model,
+                self._format_chat_history(chat_turns, session_data.get("history_summary", ""))
+            )
+            chat_history = self._format_chat_history(chat_turns[-5:])
+            logger.info(f"Chat agent stage timings: {pipeline.timings()}")
+
+            reply = None
+            if input_type in QUICK_REPLIES:
+                reply = self._quick_response(user_input, QUICK_REPLIES[input_type])
+            elif input_type == "FollowUp" and current_model:
+                if stream:
+                    deltas = self._generate_smart_response(
+                        user_input, "follow_up", current_model, chat_history, stream=True
+                    )
+                    return {
+                        "proceed": False,
+                        "stream": self._format_stream(deltas, "follow_up", current_model)
+                    }
+                # Generate smart follow-up response
+                reply = self._generate_smart_response(user_input, "follow_up", current_model, chat_history)
 
-            if input_type == "Greeting":
-                greeting_message = self._generate_smart_response(user_input, "greeting")
-                formatted_message = self._format_response(greeting_message, "greeting")
-                return {
-                    "proceed": False,
-                    "message": formatted_message
-                }
+            return self._route(input_type, user_input, session_data, current_model, reply)
 
-            if input_type == "Goodbye":
-                goodbye_message = self._generate_smart_response(user_input, "goodbye")
-                formatted_message = self._format_response(goodbye_message, "goodbye")
-                return {
-                    "proceed": False,
-                    "message": formatted_message
-                }
+        except Exception as e:
+            logger.error(f"Web GPT error: {repr(e)}")
+            return self._failed()
 
-            if input_type == "OffTopic":
-                off_topic_message = self._generate_smart_response(user_input, "off_topic")
-                formatted_message = self._format_response(off_topic_message, "general")
-                return {
-                    "proceed": False,
-                    "message": formatted_message
-                }
+    async def process_web_input_async(self, user_input, session_data=None, username=None):
+        """
+        process_web_input for the ASGI app: classification and generated
+        replies await the async client instead of holding a thread
+        """
+        try:
+            if not user_input or not user_input.strip():
+                return self._empty_input()
+
+            session_data = self._session(session_data)
+            pipeline = StagePipeline("chat_agent")
+            if username and "history" not in session_data:
+                # Cold start reads Mongo; server-side sessions need no I/O
+                chat_turns, current_model = await asyncio.to_thread(
+                    self._load_context, pipeline, session_data, username
+                )
+            else:
+                chat_turns, current_model = self._load_context(pipeline, session_data, username)
+
+            input_type = await pipeline.run_async(
+                "classify",
+                self._classify_with_context_async,
+                user_input, username, current_model,
+                self._format_chat_history(chat_turns, session_data.get("history_summary", ""))
+            )
+            chat_history = self._format_chat_history(chat_turns[-5:])
+            logger.info(f"Chat agent stage timings: {pipeline.timings()}")
+
+            reply = None
+            if input_type in QUICK_REPLIES:
+                context_type = QUICK_REPLIES[input_type]
+                if CANNED_RESPONSES and context_type in CANNED_TEMPLATES:
+                    reply = random.choice(CANNED_TEMPLATES[context_type])
+                else:
+                    reply = await self._generate_smart_response_async(user_input, context_type)
+            elif input_type == "FollowUp" and current_model:
+                reply = await self._generate_smart_response_async(user_input, "follow_up", current_model, chat_history)
 
-            if input_type == "NewRequirement":
-                session_data["original_requirement"] = user_input
-                session_data["is_new_requirement"] = 1
-                return {
-                    "proceed": True,
-                    "action": "NewRequirement",
-                    "is_new_requirement": 1,
-                    "message": "💡 Perfect! Let me analyze your requirement and find the best AI models for you."
+            return self._route(input_type, user_input, session_data, current_model, reply)
+
+        except Exception as e:
+            logger.error(f"Web GPT error: {repr(e)}")
+            return self._failed()
+
+    def _empty_input(self):
+        return {
+            "proceed": False,
+            "message": "Please provide your requirement to get started! 🤖"
+        }
+
+    def _failed(self):
+        return {
+            "proceed": False,
+            "message": "⚠️ Something went wrong while processing your request. Please try again in a moment."
+        }
+
+    def _session(self, session_data):
+        if session_data is None:
+            logger.info("Session data was None – initializing new session.")
+            session_data = {
+                "shortlisted_models": [],
+                "current_model": None,
+                "rejected_models": [],
+                "original_requirement": "",
+                "is_new_requirement": 1
+            }
+        return session_data
+
+    def _load_context(self, pipeline, session_data, username):
+        """
+        (recent chat turns, current model). The current model and recent
+        history are loaded concurrently (cold start only); the short follow-up
+        history is a slice of the classification history.
+        """
+        chat_turns = []
+        current_model = None
+        final_entry = None
+        if username and "history" in session_data:
+            # Server-side session: the final model and recent turns came with it
+            chat_turns = session_data["history"]
+            if session_data.get("final_model"):
+                final_entry = {
+                    "final_model": session_data["final_model"],
+                    "analyzed_input": session_data.get("analyzed_input", "")
                 }
+        elif username:
+            pipeline.submit("history", self._fetch_chat_turns, username, 10)
+            final_entry = pipeline.run("final_model", self._load_final_entry, username)
+            chat_turns = pipeline.result("history")
+
+            # Seed the session so later turns need neither query
+            seed_history(session_data, chat_turns)
+            chat_turns = session_data["history"]
+            if final_entry:
+                session_data["final_model"] = final_entry.get("final_model")
+                session_data["analyzed_input"] = final_entry.get("analyzed_input", "")
+        if final_entry:
+            current_model = final_entry.get("final_model")
+            session_data["current_model"] = current_model
+            session_data["original_requirement"] = final_entry.get("analyzed_input", "")
+            logger.info(f"Loaded final model: {current_model}")
+        return chat_turns, current_model
+
+    def _route(self, input_type, user_input, session_data, current_model, reply=None):
+        """The response for a classified message; `reply` is the generated text for quick replies and follow-ups"""
+        if input_type == "Greeting":
+            return {
+                "proceed": False,
+                "message": self._format_response(reply, "greeting")
+            }
 
-            if input_type == "FollowUp":
-                if current_model:
-                    # Generate smart follow-up response
-                    follow_up_message = self._generate_smart_response(
-                        user_input, "follow_up", current_model, chat_history
-                    )
-                    
-                    # Clean and format the response with model name highlighting
-                    formatted_message = self._format_response(follow_up_message, "follow_up", current_model)
+        if input_type == "Goodbye":
+            return {
+                "proceed": False,
+                "message": self._format_response(reply, "goodbye")
+            }
 
-                    return {
-                        "proceed": False,
-                        "message": formatted_message
-                    }
-                else:
-                    return {
-                        "proceed": False,
-                        "message": "🤖 I haven't recommended any model yet. Please tell me what AI task you need help with!"
-                    }
+        if input_type == "OffTopic":
+            return {
+                "proceed": False,
+                "message": self._format_response(reply, "general")
+            }
 
-            if input_type == "ModelRejection":
-                if current_model:
-                    rejected = session_data.get("rejected_models", [])
-                    rejected.append(current_model)
-                    session_data["rejected_models"] = rejected
+        if input_type == "NewRequirement":
+            session_data["original_requirement"] = user_input
+            session_data["is_new_requirement"] = 1
+            return {
+                "proceed": True,
+                "action": "NewRequirement",
+                "is_new_requirement": 1,
+                "message": "💡 Perfect! Let me analyze your requirement and find the best AI models for you."
+            }
 
-                shortlisted = session_data.get("shortlisted_models", [])
-                rejected = session_data.get("rejected_models", [])
-                remaining = [m for m in shortlisted if m not in rejected]
+        if input_type == "FollowUp":
+            if current_model:
+                # Clean and format the response with model name highlighting
+                return {
+                    "proceed": False,
+                    "message": self._format_response(reply, "follow_up", current_model)
+                }
+            return {
+                "proceed": False,
+                "message": "🤖 I haven't recommended any model yet. Please tell me what AI task you need help with!"
+            }
 
-                if not remaining:
-                    return {
-                        "proceed": True,
-                        "action": "ModelRejection",
-                        "rejected_models": rejected,
-                        "requirement": session_data.get("original_requirement", ""),
-                        "is_new_requirement": 0,
-                        "message": "🔄 No problem! Let me search for more suitable alternatives that better match your needs."
-                    }
+        if input_type == "ModelRejection":
+            if current_model:
+                rejected = session_data.get("rejected_models", [])
+                rejected.append(current_model)
+                session_data["rejected_models"] = rejected
 
-                next_model = remaining[0]
-                doc = model_col.find_one({"key": next_model})
-                full_name = doc["name"] if doc else next_model
-                session_data["current_model"] = full_name
-                session_data["is_new_requirement"] = 0
+            shortlisted = session_data.get("shortlisted_models", [])
+            rejected = session_data.get("rejected_models", [])
+            remaining = [m for m in shortlisted if m not in rejected]
 
+            if not remaining:
                 return {
                     "proceed": True,
                     "action": "ModelRejection",
                     "rejected_models": rejected,
                     "requirement": session_data.get("original_requirement", ""),
                     "is_new_requirement": 0,
-                    "message": f"🎯 I understand! Let me recommend {full_name} as a better alternative for your needs."
+                    "message": "🔄 No problem! Let me search for more suitable alternatives that better match your needs."
                 }
-            
+
+            next_model = remaining[0]
+            doc = get_catalog_index().get(next_model)
+            full_name = (doc.get("model_name") or doc.get("name") or next_model) if doc else next_model
+            session_data["current_model"] = full_name
+            session_data["is_new_requirement"] = 0
+
             return {
-                "proceed": False,
-                "message": "🤔 I'm not sure how to help with that. Could you please tell me more about your AI model needs?"
+                "proceed": True,
+                "action": "ModelRejection",
+                "rejected_models": rejected,
+                "requirement": session_data.get("original_requirement", ""),
+                "is_new_requirement": 0,
+                "message": f"🎯 I understand! Let me recommend {full_name} as a better alternative for your needs."
             }
 
-        except Exception as e:
-            logger.error(f"Web GPT error: {repr(e)}")
-            return {
-                "proceed": False,
-                "message": "⚠️ Something went wrong while processing your request. Please try again in a moment."
-            }
\ No newline at end of file
+        return {
+            "proceed": False,
+            "message": "🤔 I'm not sure how to help with that. Could you please tell me more about your AI model needs?"
+        }
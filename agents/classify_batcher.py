@@ -0,0 +1,251 @@
+# Micro-batching of LLM message classification under bursty load
+
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from agents.logger import get_logger  # type: ignore
+from agents.fast_classifier import LABELS  # type: ignore
+from agents.schemas import parse_json_object  # type: ignore
+
+logger = get_logger("classify_batcher", "logs/classify_batcher.log")
+
+CLASSIFY_BATCH_ENABLED = os.getenv("CLASSIFY_BATCH_ENABLED", "true").lower() in ("1", "true", "yes")
+# A batch is sent when its first message has waited this long, or when it is full
+CLASSIFY_BATCH_WINDOW_MS = float(os.getenv("CLASSIFY_BATCH_WINDOW_MS", "50"))
+CLASSIFY_BATCH_MAX_ITEMS = int(os.getenv("CLASSIFY_BATCH_MAX_ITEMS", "8"))
+# Batches in flight at once; collection carries on while they wait for gpt-4o
+CLASSIFY_BATCH_WORKERS = int(os.getenv("CLASSIFY_BATCH_WORKERS", "4"))
+# Chat history kept per item in a batch prompt (the most recent end)
+CLASSIFY_BATCH_HISTORY_CHARS = int(os.getenv("CLASSIFY_BATCH_HISTORY_CHARS", "2000"))
+CLASSIFY_BATCH_TIMEOUT = float(os.getenv("CLASSIFY_BATCH_TIMEOUT", "60"))
+
+# Categories and rules shared by the single-message and batch prompts
+CLASSIFICATION_GUIDE = """Classify the user's message into one of these categories:
+
+1. **Greeting** - Simple greetings like "hi", "hello", "good morning"
+2. **NewRequirement** - User wants recommendation for a NEW AI task/use-case
+3. **FollowUp** - User is asking about the CURRENT recommended model (includes yes/no responses to agent questions)
+4. **ModelRejection** - User explicitly rejects the current model and wants alternatives
+5. **Goodbye** - Messages like "bye", "good night", "see you", "talk later"
+6. **OffTopic** - Questions completely unrelated to AI models (math, weather, personal advice, etc.)
+
+IMPORTANT RULES:
+- If user says "yes", "ok", "sure", "no", "not really" after agent asked about current model → **FollowUp**
+- If user asks details about current model → **FollowUp**
+- If user describes a completely new AI task → **NewRequirement**
+- If user says "I don't like this model" or "suggest another" → **ModelRejection**
+- Only classify as **OffTopic** if completely unrelated to AI models AND not a continuation of current conversation"""
+
+BATCH_PROMPT = f"""
+You are classifying user messages in an AI model recommendation chatbot.
+
+You will receive a JSON list of items. Each item is a message from a DIFFERENT conversation,
+with that conversation's own CHAT HISTORY and CURRENT MODEL. Classify every item on its own;
+never let one item's history influence another.
+
+{CLASSIFICATION_GUIDE}
+
+Reply only with a JSON object with one entry per item, in this format:
+{{"labels": [{{"id": <item id>, "label": "<Greeting, NewRequirement, FollowUp, ModelRejection, Goodbye, or OffTopic>"}}]}}
+"""
+
+_LABELS = {label.lower(): label for label in LABELS}
+
+
+def normalize_label(value):
+    """A known label from an LLM reply ('**FollowUp**.' -> 'FollowUp'), or None"""
+    return _LABELS.get(str(value or "").strip().strip("*.").strip().lower())
+
+
+class _PendingClassification:
+    __slots__ = ("message", "current_model", "chat_history", "single", "future", "queued_at")
+
+    def __init__(self, message, current_model, chat_history, single):
+        self.message = message
+        self.current_model = current_model
+        self.chat_history = chat_history
+        self.single = single
+        self.future = Future()
+        self.queued_at = time.monotonic()
+
+
+class ClassifyBatcher:
+    """
+    Collects messages that need an LLM label for up to `window` seconds (or
+    `max_items` messages) and classifies them with one gpt-4o call. A message
+    that arrives alone is classified with the single-message prompt, as
+    before; items the batch reply leaves out or mislabels fall back to it too.
+    """
+
+    def __init__(self, client, window=CLASSIFY_BATCH_WINDOW_MS / 1000, max_items=CLASSIFY_BATCH_MAX_ITEMS,
+                 workers=CLASSIFY_BATCH_WORKERS):
+        self.client = client
+        self.window = window
+        self.max_items = max(1, max_items)
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="classify-batch")
+        self._batch_ids = itertools.count(1)
+        self.batches = 0
+        self.items = 0
+        self.llm_calls = 0
+        self.fallbacks = 0
+
+    def classify(self, message, current_model, chat_history, single, timeout=CLASSIFY_BATCH_TIMEOUT):
+        """
+        Label for `message`, blocking until its batch is answered.
+        `single(message, current_model, chat_history)` classifies one message
+        on its own and is used when batching does not apply.
+        """
+        pending = _PendingClassification(message, current_model, chat_history, single)
+        with self._cond:
+            self._pending.append(pending)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="classify-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return pending.future.result(timeout=timeout)
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._pending)
+        return {
+            "enabled": True,
+            "window_ms": round(self.window * 1000, 1),
+            "max_items": self.max_items,
+            "queued": queued,
+            "batches": self.batches,
+            "items": self.items,
+            "llm_calls": self.llm_calls,
+            "calls_saved": self.items - self.llm_calls,
+            "fallbacks": self.fallbacks,
+        }
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._pending[0].queued_at + self.window
+                while len(self._pending) < self.max_items:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_items]
+                del self._pending[:self.max_items]
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        batch_id = next(self._batch_ids)
+        calls = 0
+
+        labels = {}
+        if len(batch) > 1:
+            try:
+                labels = self._classify_batch(batch)
+                calls += 1
+                logger.info(f"📦 Batch {batch_id}: {len(labels)} of {len(batch)} messages labelled in one call")
+            except Exception as e:
+                logger.error(f"❌ Batch {batch_id} classification failed, classifying one by one: {e}")
+
+        unlabelled = []
+        for i, pending in enumerate(batch, start=1):
+            if pending.future.cancelled():
+                continue
+            if i in labels:
+                pending.future.set_result(labels[i])
+            else:
+                unlabelled.append(pending)
+
+        with self._cond:
+            self.batches += 1
+            self.items += len(batch)
+            self.llm_calls += calls
+
+        # Single-message calls run side by side, not one after another
+        fallback = len(batch) > 1
+        for pending in unlabelled[1:]:
+            self._executor.submit(self._classify_one, pending, fallback)
+        if unlabelled:
+            self._classify_one(unlabelled[0], fallback)
+
+    def _classify_one(self, pending, fallback):
+        try:
+            pending.future.set_result(pending.single(pending.message, pending.current_model, pending.chat_history))
+        except Exception as e:
+            pending.future.set_exception(e)
+        with self._cond:
+            self.llm_calls += 1
+            self.fallbacks += fallback
+
+    def _classify_batch(self, batch):
+        items = [
+            {
+                "id": i,
+                "current_model": pending.current_model or "None",
+                "chat_history": str(pending.chat_history or "")[-CLASSIFY_BATCH_HISTORY_CHARS:],
+                "message": pending.message.strip(),
+            }
+            for i, pending in enumerate(batch, start=1)
+        ]
+        response = self.client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": BATCH_PROMPT},
+                {"role": "user", "content": json.dumps(items, ensure_ascii=False)}
+            ],
+            response_format={"type": "json_object"}
+        )
+        data = parse_json_object(response.choices[0].message.content) or {}
+
+        labels = {}
+        for entry in data.get("labels") or []:
+            if not isinstance(entry, dict):
+                continue
+            label = normalize_label(entry.get("label"))
+            try:
+                item_id = int(entry.get("id"))
+            except (TypeError, ValueError):
+                continue
+            if label and 1 <= item_id <= len(batch):
+                labels[item_id] = label
+        return labels
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Worker threads do not survive a fork; each child starts its own batchers
+    global _batchers_lock
+    _batchers.clear()
+    _batchers_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_classify_batcher(client):
+    """One shared batcher per API client"""
+    batcher = _batchers.get(id(client))
+    if batcher is None:
+        with _batchers_lock:
+            batcher = _batchers.get(id(client))
+            if batcher is None:
+                batcher = ClassifyBatcher(client)
+                _batchers[id(client)] = batcher
+    return batcher
+
+
+def classify_batcher_stats():
+    if not CLASSIFY_BATCH_ENABLED:
+        return {"enabled": False}
+    return {"clients": len(_batchers), "batchers": [b.stats() for b in list(_batchers.values())]}
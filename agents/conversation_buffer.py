@@ -0,0 +1,107 @@
+# Rolling per-user conversation context, capped by tokens rather than rows
+
+import os
+import re
+
+from dotenv import load_dotenv
+from agents.logger import get_logger  # type: ignore
+from agents.mongo_pool import LazyCollection  # type: ignore
+from agents.catalog_search import clip_text, count_tokens  # type: ignore
+from agents.session_store import SESSION_HISTORY_TURNS  # type: ignore
+
+load_dotenv()
+
+logger = get_logger("conversation_buffer", "logs/conversation_buffer.log")
+
+# Tokens of recent turns kept in the session for classification and follow-ups
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "3000"))
+# A single stored turn is clipped to this, so one long report can't push out the rest
+CONVERSATION_TURN_TOKENS = int(os.getenv("CONVERSATION_TURN_TOKENS", "600"))
+# Turns pushed out of the window are folded into a short running summary
+CONVERSATION_SUMMARY = os.getenv("CONVERSATION_SUMMARY", "true").lower() in ("1", "true", "yes")
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "300"))
+
+chats_col = LazyCollection(os.getenv("USER_DB_NAME"), os.getenv("CHATS_COLLECTION_NAME", "chats"))
+
+# Only the fields the context needs; stored responses can be several KB of report
+CHAT_CONTEXT_PROJECTION = {"_id": 0, "message": 1, "response": 1}
+
+_REPORTED_MODEL = re.compile(r"Model Name\s*:\s*(.+)")
+
+
+def _make_turn(message, response=None):
+    message, message_tokens = clip_text(message, CONVERSATION_TURN_TOKENS)
+    turn = {"message": message, "tokens": message_tokens}
+    if response is not None:
+        response, response_tokens = clip_text(response, max(CONVERSATION_TURN_TOKENS - message_tokens, 1))
+        turn.update(response=response, tokens=message_tokens + response_tokens)
+    return turn
+
+
+def _summary_line(turn):
+    """One line per dropped turn: what was asked and which model, if any, was picked"""
+    line = "- User: " + clip_text(turn.get("message", ""), 40)[0].replace("\n", " ")
+    model = _REPORTED_MODEL.search(turn.get("response") or "")
+    if model:
+        line += f" → recommended {model.group(1).strip()}"
+    return line
+
+
+def _trim(state):
+    history = state.setdefault("history", [])
+    for turn in history:
+        if "tokens" not in turn:
+            turn.update(_make_turn(turn.get("message", ""), turn.get("response")))
+
+    dropped = []
+    total = sum(turn["tokens"] for turn in history)
+    while len(history) > 1 and (len(history) > SESSION_HISTORY_TURNS or total > CONVERSATION_TOKEN_BUDGET):
+        turn = history.pop(0)
+        total -= turn["tokens"]
+        dropped.append(turn)
+
+    if dropped and CONVERSATION_SUMMARY:
+        lines = [line for line in state.get("history_summary", "").splitlines() if line]
+        lines += [_summary_line(turn) for turn in dropped]
+        # Keep the most recent summary lines that fit
+        kept, used = [], 0
+        for line in reversed(lines):
+            used += count_tokens(line)
+            if kept and used > CONVERSATION_SUMMARY_TOKENS:
+                break
+            kept.append(line)
+        state["history_summary"] = "\n".join(reversed(kept))
+
+
+def remember_turn(state, message, response):
+    """Append a finished turn to the session's rolling history"""
+    state.setdefault("history", []).append(_make_turn(message, response))
+    _trim(state)
+
+
+def seed_history(state, chats):
+    """Fill an empty session history from stored chat documents (oldest first)"""
+    state["history"] = [_make_turn(chat.get("message", ""), chat.get("response")) for chat in chats]
+    state.pop("history_summary", None)
+    _trim(state)
+
+
+def load_recent_chats(email, limit=SESSION_HISTORY_TURNS):
+    """The most recent chat documents for `email`, oldest first; cold starts only (uses the (email, _id) index)"""
+    try:
+        chats = list(
+            chats_col.find({"email": email}, CHAT_CONTEXT_PROJECTION).sort("_id", -1).limit(limit)
+        )
+        return list(reversed(chats))
+    except Exception as e:
+        logger.error(f"Error fetching chat history: {e}")
+        return []
+
+
+def format_history(turns, summary=""):
+    lines = [f"Earlier in this conversation:\n{summary}"] if summary else []
+    for turn in turns:
+        lines.append(f"User: {turn['message']}")
+        if "response" in turn:
+            lines.append(f"Agent: {turn['response']}")
+    return "\n".join(lines)
@@ -0,0 +1,196 @@
+# Index bootstrap for the user/chat/final_models collections, plus a query-plan check
+#
+#   python -m agents.db_indexes               # create missing indexes, then check plans
+#   python -m agents.db_indexes --check-only  # only check plans
+#
+# The check runs explain() on every hot query and exits non-zero if any of
+# them would scan a whole collection.
+
+import argparse
+import os
+import sys
+import threading
+
+from dotenv import load_dotenv
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from agents.logger import get_logger  # type: ignore
+from agents.mongo_pool import get_collection  # type: ignore
+
+load_dotenv()
+
+logger = get_logger("db_indexes", "logs/db_indexes.log")
+
+# Created in the background when the app starts
+DB_INDEXES_AUTO = os.getenv("DB_INDEXES_AUTO", "true").lower() in ("1", "true", "yes")
+
+# Placeholder values for explain(); plans don't depend on data existing
+_EMAIL = "index-check@example.com"
+
+# Option conflicts: an index on the same keys already exists with other options
+_CONFLICT_CODES = (85, 86)
+
+
+def _collections():
+    """Logical name -> (database, collection), resolved from the environment at call time"""
+    user_db = os.getenv("USER_DB_NAME")
+    collections = {
+        "users": (user_db, os.getenv("USERS_COLLECTION_NAME", "users")),
+        "chats": (user_db, os.getenv("CHATS_COLLECTION_NAME", "chats")),
+        "final_models": (user_db, "final_models"),
+        "uploads": (user_db, "uploads"),
+    }
+    if os.getenv("RECOMMENDER_DB_NAME") and os.getenv("RECOMMENDER_COLLECTION_NAME"):
+        collections["catalog"] = (os.getenv("RECOMMENDER_DB_NAME"), os.getenv("RECOMMENDER_COLLECTION_NAME"))
+    return collections
+
+
+# (collection, keys, options). Names follow MongoDB's default naming, so
+# indexes created elsewhere with the same keys are recognised as existing.
+INDEXES = (
+    ("users", [("email", 1)], {"unique": True}),                   # login / user lookup
+    ("users", [("platform", 1)], {}),                              # /platform-status counts
+    ("chats", [("email", 1), ("timestamp", 1)], {}),               # /history
+    ("chats", [("email", 1), ("_id", -1)], {}),                    # conversation cold start, clears
+    ("final_models", [("email", 1)], {"unique": True}),            # current model per user
+    ("uploads", [("email", 1), ("status", 1)], {}),                # upload quotas, abandoned uploads
+    ("catalog", [("updated_at", 1)], {}),                          # incremental catalog refresh
+)
+
+# (description, collection, kind, spec) for every query on a request path
+HOT_QUERIES = (
+    ("users.find_one(email)", "users", "find", {"filter": {"email": _EMAIL}, "limit": 1}),
+    ("users.count_documents(platform)", "users", "count", {"filter": {"platform": "web"}}),
+    ("chats.find(email).sort(timestamp)", "chats", "find",
+     {"filter": {"email": _EMAIL}, "sort": [("timestamp", 1)]}),
+    ("chats.find(email).sort(_id desc).limit", "chats", "find",
+     {"filter": {"email": _EMAIL}, "sort": [("_id", -1)], "limit": 10,
+      "projection": {"_id": 0, "message": 1, "response": 1}}),
+    ("chats.delete_many(email)", "chats", "find", {"filter": {"email": _EMAIL}}),
+    ("final_models.find_one(email)", "final_models", "find", {"filter": {"email": _EMAIL}, "limit": 1}),
+    ("uploads.aggregate(email) quota", "uploads", "find", {"filter": {"email": _EMAIL, "status": {"$ne": "failed"}}}),
+    ("catalog.find(updated_at > watermark)", "catalog", "find", {"filter": {"updated_at": {"$gt": 0}}}),
+)
+
+
+def index_name(keys):
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+def _create(collection, keys, options):
+    name = index_name(keys)
+    try:
+        collection.create_index(keys, name=name, **options)
+        return "ok"
+    except DuplicateKeyError:
+        if not options.get("unique"):
+            raise
+        # Existing duplicates block a unique index; still index the lookups
+        logger.warning(f"⚠️ {collection.name}.{name}: duplicate values, created without unique")
+        collection.create_index(keys, name=name, **{k: v for k, v in options.items() if k != "unique"})
+        return "ok (not unique: duplicates exist)"
+    except OperationFailure as e:
+        if e.code in _CONFLICT_CODES:
+            logger.warning(f"⚠️ {collection.name}.{name}: exists with other options ({e})")
+            return "exists (other options)"
+        raise
+
+
+def ensure_indexes():
+    """Create every declared index that is missing; safe to call repeatedly"""
+    collections = _collections()
+    results = []
+    for logical, keys, options in INDEXES:
+        if logical not in collections:
+            continue
+        name = index_name(keys)
+        try:
+            status = _create(get_collection(*collections[logical]), keys, options)
+        except Exception as e:
+            logger.error(f"❌ Could not create index {logical}.{name}: {e}")
+            status = f"error: {e}"
+        results.append({"collection": logical, "index": name, "status": status})
+    logger.info(f"✅ Index bootstrap: {sum(r['status'].startswith(('ok', 'exists')) for r in results)}"
+                f"/{len(results)} indexes in place.")
+    return results
+
+
+def ensure_indexes_in_background():
+    threading.Thread(target=ensure_indexes, name="db-indexes", daemon=True).start()
+
+
+# ---------- query plan verification ----------
+
+def _winning_stages(node, in_winning_plan=False):
+    """Stage names of the winning plan(s) anywhere in an explain document"""
+    stages = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "rejectedPlans":
+                continue
+            if key == "stage" and in_winning_plan and isinstance(value, str):
+                stages.append(value)
+            stages += _winning_stages(value, in_winning_plan or key == "winningPlan")
+    elif isinstance(node, list):
+        for item in node:
+            stages += _winning_stages(item, in_winning_plan)
+    return stages
+
+
+def explain_query(collection, kind, spec):
+    if kind == "count":
+        # count_documents runs this aggregation
+        pipeline = [{"$match": spec["filter"]}, {"$group": {"_id": 1, "n": {"$sum": 1}}}]
+        return collection.database.command(
+            "explain", {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}},
+            verbosity="queryPlanner"
+        )
+    cursor = collection.find(spec["filter"], spec.get("projection"))
+    if spec.get("sort"):
+        cursor = cursor.sort(spec["sort"])
+    if spec.get("limit"):
+        cursor = cursor.limit(spec["limit"])
+    return cursor.explain()
+
+
+def check_query_plans():
+    """[{query, stages, ok}] for every hot query; ok is False for a COLLSCAN or an error"""
+    collections = _collections()
+    results = []
+    for description, logical, kind, spec in HOT_QUERIES:
+        if logical not in collections:
+            continue
+        try:
+            stages = _winning_stages(explain_query(get_collection(*collections[logical]), kind, spec))
+            ok = bool(stages) and "COLLSCAN" not in stages
+            results.append({"query": description, "stages": stages, "ok": ok})
+        except Exception as e:
+            results.append({"query": description, "stages": [], "ok": False, "error": str(e)})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create MongoDB indexes and verify hot query plans")
+    parser.add_argument("--check-only", action="store_true", help="don't create indexes, only check plans")
+    args = parser.parse_args(argv)
+
+    if not args.check_only:
+        for result in ensure_indexes():
+            print(f"{result['collection']:>14}.{result['index']:<24} {result['status']}")
+        print()
+
+    failed = 0
+    for result in check_query_plans():
+        plan = " > ".join(result["stages"]) or result.get("error", "no plan")
+        print(f"{'OK  ' if result['ok'] else 'FAIL'} {result['query']:<42} {plan}")
+        failed += not result["ok"]
+
+    if failed:
+        print(f"\n❌ {failed} hot quer{'y' if failed == 1 else 'ies'} without a usable index.")
+        return 1
+    print("\n✅ Every hot query uses an index.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+# Idempotency store for webhook deliveries keyed on platform message IDs
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+from agents.logger import get_logger  # type: ignore
+from agents.mongo_pool import LazyCollection  # type: ignore
+
+load_dotenv()
+
+logger = get_logger("dedup_store", "logs/dedup_store.log")
+
+DEDUP_TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", str(3 * 24 * 3600)))
+DEDUP_MEMORY_ENTRIES = int(os.getenv("DEDUP_MEMORY_ENTRIES", "10000"))
+
+dedup_col = LazyCollection(os.getenv("USER_DB_NAME"), "webhook_dedup")
+
+
+def webhook_message_key(platform, data):
+    """Stable ID of an incoming webhook message, or None if the payload has none"""
+    if platform == "telegram":
+        message_id = data.get("update_id")
+        if message_id is None:
+            message = data.get("message", {})
+            chat_id = message.get("chat", {}).get("id")
+            if chat_id is not None and message.get("message_id") is not None:
+                message_id = f"{chat_id}:{message['message_id']}"
+    else:
+        message_id = next(
+            (data.get(k) for k in ("MessageSid", "SmsSid", "SmsMessageSid", "message_id", "messageId", "id", "wamid")
+             if data.get(k)),
+            None,
+        )
+    return f"{platform}:{message_id}" if message_id is not None else None
+
+
+class DedupStore:
+    """
+    A bounded in-memory LRU in front of a Mongo collection whose TTL index
+    expires old keys, so repeats are caught in microseconds while the
+    process is up and still caught after a restart.
+    """
+
+    def __init__(self, collection=dedup_col, ttl=DEDUP_TTL_SECONDS, max_entries=DEDUP_MEMORY_ENTRIES):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # key -> (response or None, expires_at)
+        self._index_ready = False
+        self.duplicates = 0
+
+    def _ensure_index(self):
+        if self._index_ready:
+            return
+        try:
+            self.collection.create_index("created_at", expireAfterSeconds=self.ttl)
+            self._index_ready = True
+        except Exception as e:
+            logger.error(f"❌ Could not create dedup TTL index: {e}")
+
+    def _remember(self, key, response):
+        with self._lock:
+            self._memory[key] = (response, time.time() + self.ttl)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _recall(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return False, None
+            if entry[1] < time.time():
+                del self._memory[key]
+                return False, None
+            self._memory.move_to_end(key)
+            return True, entry[0]
+
+    def claim(self, key):
+        """
+        (True, None) if this is the first delivery of `key`, otherwise
+        (False, cached_response); the response is None while the first
+        delivery is still being processed.
+        """
+        seen, response = self._recall(key)
+        if seen:
+            self.duplicates += 1
+            return False, response
+
+        self._ensure_index()
+        try:
+            self.collection.insert_one({"_id": key, "status": "pending", "created_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            doc = self.collection.find_one({"_id": key}) or {}
+            response = doc.get("response")
+            self._remember(key, response)
+            self.duplicates += 1
+            logger.info(f"🔁 Duplicate delivery {key} (status: {doc.get('status', 'unknown')})")
+            return False, response
+        except Exception as e:
+            # Never drop a message because the dedup store is unavailable
+            logger.error(f"❌ Dedup claim failed for {key}: {e}")
+            return True, None
+
+        self._remember(key, None)
+        return True, None
+
+    def complete(self, key, response):
+        self._remember(key, response)
+        try:
+            # Upserted, so keys that were never claimed (queued turns) are
+            # stored too. The TTL restarts here: a key claimed long ago must
+            # not expire while its reply is still waiting to be delivered.
+            self.collection.update_one(
+                {"_id": key},
+                {"$set": {"status": "done", "response": response, "created_at": datetime.utcnow()}},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.error(f"❌ Dedup completion failed for {key}: {e}")
+
+    def response(self, key):
+        """The stored reply for a completed `key`, or None"""
+        seen, response = self._recall(key)
+        if seen and response is not None:
+            return response
+        try:
+            doc = self.collection.find_one({"_id": key, "status": "done"})
+        except Exception as e:
+            logger.error(f"❌ Dedup lookup failed for {key}: {e}")
+            return None
+        if doc is None:
+            return None
+        self._remember(key, doc.get("response"))
+        return doc.get("response")
+
+    def release(self, key):
+        """Forget a claim whose processing failed so a redelivery can retry it"""
+        with self._lock:
+            self._memory.pop(key, None)
+        try:
+            self.collection.delete_one({"_id": key, "status": "pending"})
+        except Exception as e:
+            logger.error(f"❌ Dedup release failed for {key}: {e}")
+
+    def stats(self):
+        return {"memory_entries": len(self._memory), "duplicates": self.duplicates}
+
+
+dedup_store = DedupStore()
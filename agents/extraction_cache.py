@@ -0,0 +1,232 @@
+# Content-addressed (SHA-256) store for uploads and the text extracted from them
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from agents.logger import get_logger  # type: ignore
+
+logger = get_logger("extraction_cache", "logs/extraction_cache.log")
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+# One copy of each distinct upload, named by its hash; uploads/<filename> links to it
+UPLOAD_OBJECTS_DIR = os.path.join(UPLOAD_DIR, ".objects")
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", os.path.join(UPLOAD_DIR, ".extracted"))
+# Least recently used entries are deleted once the cache grows past this
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Bump when extractors change output, so older entries stop matching
+EXTRACTION_CACHE_VERSION = 1
+
+_HASH_CHUNK = 1024 * 1024
+# Paths whose hash is remembered (by size and mtime) so a hit doesn't re-read the file
+_DIGEST_MEMO_ENTRIES = 1024
+
+
+def sha256_stream(stream):
+    """Hex SHA-256 of a binary stream, read in chunks"""
+    digest = hashlib.sha256()
+    for block in iter(lambda: stream.read(_HASH_CHUNK), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Extracted text keyed by the SHA-256 of the file's bytes and the token
+    budget it was extracted under, so the same content is parsed or OCR'd
+    once no matter who uploaded it or what it is called.
+
+    Entries are small JSON files in `directory`. Each process keeps an LRU
+    index of them (rebuilt from modification times on first use) and deletes
+    the oldest when the total passes `max_bytes`. Writes are atomic renames,
+    so processes sharing the directory never see a partial entry; an entry
+    evicted by another process simply reads as a miss.
+    """
+
+    def __init__(self, directory=EXTRACTION_CACHE_DIR, max_bytes=EXTRACTION_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._index = None              # entry file name -> size, oldest first
+        self._bytes = 0
+        self._digests = OrderedDict()   # path -> (size, mtime_ns, sha256)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    # ---------- hashing ----------
+
+    def digest(self, path):
+        st = os.stat(path)
+        with self._lock:
+            memo = self._digests.get(path)
+            if memo and memo[:2] == (st.st_size, st.st_mtime_ns):
+                self._digests.move_to_end(path)
+                return memo[2]
+        with open(path, "rb") as f:
+            sha = sha256_stream(f)
+        with self._lock:
+            self._digests[path] = (st.st_size, st.st_mtime_ns, sha)
+            while len(self._digests) > _DIGEST_MEMO_ENTRIES:
+                self._digests.popitem(last=False)
+        return sha
+
+    # ---------- index ----------
+
+    def _load_index(self):
+        # Called with the lock held
+        if self._index is not None:
+            return
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(".json"):
+                        st = entry.stat()
+                        entries.append((st.st_mtime, entry.name, st.st_size))
+        except FileNotFoundError:
+            pass
+        self._index = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self._bytes = sum(self._index.values())
+
+    def _entry_name(self, sha, max_tokens):
+        return f"{sha}-{max_tokens}-v{EXTRACTION_CACHE_VERSION}.json"
+
+    # ---------- reads / writes ----------
+
+    def get(self, sha, max_tokens):
+        """The stored extraction fields for this content and budget, or None"""
+        name = self._entry_name(sha, max_tokens)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+                if self._index is not None and self._index.pop(name, None) is not None:
+                    self._bytes = sum(self._index.values())
+            return None
+        with self._lock:
+            self.hits += 1
+            self._load_index()
+            if name in self._index:
+                self._index.move_to_end(name)
+        return entry
+
+    def put(self, sha, max_tokens, fields):
+        name = self._entry_name(sha, max_tokens)
+        data = json.dumps(fields, ensure_ascii=False).encode("utf-8")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.directory, name))
+        except OSError as e:
+            logger.error(f"❌ Could not store extraction {name}: {e}")
+            return
+        with self._lock:
+            self._load_index()
+            self._bytes += len(data) - self._index.pop(name, 0)
+            self._index[name] = len(data)
+            self.stores += 1
+            evicted = []
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                old, size = self._index.popitem(last=False)
+                self._bytes -= size
+                evicted.append(old)
+            self.evictions += len(evicted)
+        for old in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "enabled": EXTRACTION_CACHE_ENABLED,
+            "entries": len(self._index) if self._index is not None else None,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+extraction_cache = ExtractionCache()
+
+
+def _reset_after_fork():
+    extraction_cache._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# ---------- upload deduplication ----------
+
+def object_path(sha, ext):
+    return os.path.join(UPLOAD_OBJECTS_DIR, sha + ext.lower())
+
+
+def store_object(tmp, sha, ext):
+    """
+    Move a fully written file into uploads/.objects/<sha256><ext>, or drop
+    it if that content is already stored. Returns (path, deduplicated).
+    """
+    obj = object_path(sha, ext)
+    deduplicated = os.path.exists(obj)
+    if deduplicated:
+        os.remove(tmp)
+    else:
+        os.makedirs(UPLOAD_OBJECTS_DIR, exist_ok=True)
+        os.replace(tmp, obj)
+    return obj, deduplicated
+
+
+def save_upload(stream, filename):
+    """
+    Store an uploaded file as uploads/<filename>, hashing it while it is
+    written. Identical content is kept once under uploads/.objects/ and
+    every filename for it is a hard link to that copy (a plain copy where
+    links aren't supported). Returns (path, sha256, deduplicated).
+    """
+    os.makedirs(UPLOAD_OBJECTS_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp = tempfile.mkstemp(dir=UPLOAD_OBJECTS_DIR, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for block in iter(lambda: stream.read(_HASH_CHUNK), b""):
+                digest.update(block)
+                f.write(block)
+        sha = digest.hexdigest()
+        obj, deduplicated = store_object(tmp, sha, os.path.splitext(filename)[-1])
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    path = os.path.join(UPLOAD_DIR, filename)
+    if os.path.lexists(path):
+        os.remove(path)
+    try:
+        os.link(obj, path)
+    except OSError:
+        shutil.copyfile(obj, path)
+    if deduplicated:
+        logger.info(f"♻️ Upload {filename} is a duplicate of {sha[:12]}; stored once.")
+    return path, sha, deduplicated
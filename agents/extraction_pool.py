@@ -0,0 +1,325 @@
+# Bounded process pool for CPU-heavy or slow extraction (OCR, speech transcription)
+
+import functools
+import io
+import itertools
+import math
+import mmap
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pytesseract
+import speech_recognition as sr
+from PIL import Image, ImageSequence
+from pypdf import PdfReader
+
+from agents.logger import get_logger  # type: ignore
+
+logger = get_logger("extraction_pool", "logs/extraction_pool.log")
+
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Files being extracted at once; more are rejected instead of queued behind them
+EXTRACTION_MAX_PENDING = int(os.getenv("EXTRACTION_MAX_PENDING", "8"))
+# Seconds one page or audio chunk may take, counted from when it starts
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "60"))
+# Extra seconds before a job that ignored its deadline gets the pool killed
+EXTRACTION_KILL_GRACE = float(os.getenv("EXTRACTION_KILL_GRACE", "30"))
+EXTRACTION_MAX_PAGES = int(os.getenv("EXTRACTION_MAX_PAGES", "50"))
+# A PDF page with less text than this is treated as scanned and its images are OCR'd
+PDF_OCR_MIN_CHARS = int(os.getenv("PDF_OCR_MIN_CHARS", "20"))
+EXTRACTION_AUDIO_CHUNK_SECONDS = float(os.getenv("EXTRACTION_AUDIO_CHUNK_SECONDS", "60"))
+
+
+class ExtractionRejected(Exception):
+    """The pool is at EXTRACTION_MAX_PENDING files; try again later"""
+
+
+# ---------- worker functions (run in the pool's processes) ----------
+
+_in_worker = False
+
+
+def _init_worker():
+    """Runs first in each pool process"""
+    global _in_worker
+    _in_worker = True
+    # Handlers inherited from the server (gunicorn, uvicorn, Flask's reloader)
+    # must not run here; the parent owns shutdown and Ctrl-C
+    for name in ("SIGTERM", "SIGHUP", "SIGQUIT", "SIGUSR1", "SIGUSR2", "SIGCHLD", "SIGWINCH"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _on_alarm(signum, frame):
+    raise TimeoutError("job deadline reached")
+
+
+def _run_job(func, args, timeout):
+    """
+    func(*args) with a deadline counted from when the job starts in this
+    worker. SIGALRM interrupts pure-Python work (pypdf) and blocking reads;
+    tesseract is a subprocess with its own timeout.
+    """
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _portable_errors(func):
+    # Some library exceptions (e.g. pytesseract's) can't be unpickled in the
+    # parent, which would break the whole pool; send them back as plain errors
+    @functools.wraps(func)
+    def wrapper(*args):
+        try:
+            return func(*args)
+        except TimeoutError:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"{type(e).__name__}: {e}") from None
+    return wrapper
+
+
+@_portable_errors
+def ocr_page(path, frame, timeout):
+    """Text of one frame of an image; tesseract is killed after `timeout` seconds"""
+    with Image.open(path) as img:
+        img.seek(frame)
+        return pytesseract.image_to_string(img.copy(), timeout=timeout)
+
+
+@_portable_errors
+def transcribe_segment(path, offset, duration, timeout):
+    """Transcript of `duration` seconds of audio starting at `offset`"""
+    recognizer = sr.Recognizer()
+    recognizer.operation_timeout = timeout
+    with sr.AudioFile(path) as source:
+        audio = recognizer.record(source, offset=offset, duration=duration)
+    try:
+        return recognizer.recognize_google(audio)
+    except sr.UnknownValueError:
+        # Silence or unintelligible speech in this chunk
+        return ""
+
+
+def _open_pdf(path):
+    """A PdfReader over a read-only memory map: pages are paged in as they are parsed"""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    reader = PdfReader(mapped)
+    if reader.is_encrypted and not reader.decrypt(""):
+        raise ValueError("PDF is password protected")
+    return reader
+
+
+@_portable_errors
+def pdf_page(path, index, timeout):
+    """Text of one PDF page; image-only (scanned) pages are OCR'd from their embedded images"""
+    page = _open_pdf(path).pages[index]
+    text = page.extract_text() or ""
+    if len(text.strip()) >= PDF_OCR_MIN_CHARS:
+        return text
+    scanned = []
+    for image in page.images:
+        try:
+            with Image.open(io.BytesIO(image.data)) as img:
+                scanned.append(pytesseract.image_to_string(img, timeout=timeout))
+        except Exception as e:
+            # One unreadable image shouldn't lose the rest of the document
+            logger.warning(f"⚠️ OCR failed on page {index + 1} of {os.path.basename(path)}: {e}")
+    return "\n".join([text] + scanned) if scanned else text
+
+
+# ---------- planning (parent process) ----------
+
+def image_pages(path):
+    """[(path, frame, timeout)] for each page of a (possibly multi-page) image"""
+    with Image.open(path) as img:
+        frames = sum(1 for _ in ImageSequence.Iterator(img))
+    if frames > EXTRACTION_MAX_PAGES:
+        logger.warning(f"⚠️ {os.path.basename(path)}: OCR limited to {EXTRACTION_MAX_PAGES} of {frames} pages")
+    return [(path, frame, EXTRACTION_TIMEOUT) for frame in range(min(frames, EXTRACTION_MAX_PAGES))]
+
+
+def pdf_pages(path):
+    """[(path, page index, timeout)] for every page of a PDF"""
+    count = len(_open_pdf(path).pages)
+    return [(path, index, EXTRACTION_TIMEOUT) for index in range(count)]
+
+
+def audio_segments(path):
+    """[(path, offset, duration, timeout)] covering the audio in EXTRACTION_AUDIO_CHUNK_SECONDS pieces"""
+    with sr.AudioFile(path) as source:
+        total = source.DURATION
+    step = EXTRACTION_AUDIO_CHUNK_SECONDS
+    count = max(1, math.ceil(total / step))
+    return [(path, i * step, min(step, total - i * step) or None, EXTRACTION_TIMEOUT) for i in range(count)]
+
+
+class ExtractionPool:
+    """
+    Runs extraction jobs in worker processes so a large scan or recording
+    can't stall a request thread. A file's pages or audio chunks are
+    submitted together and run in parallel; results come back in order.
+
+    - At most `max_pending` files are in flight; `map` raises
+      ExtractionRejected beyond that.
+    - Every job has its own deadline, counted from when it starts and
+      enforced inside the worker, so a slow page fails only its own file.
+    - Only a job stuck past its deadline (in C code that ignores signals)
+      gets the pool's processes killed. Other files' jobs lost with them
+      are resubmitted to the new pool once.
+    """
+
+    def __init__(self, workers=EXTRACTION_WORKERS, max_pending=EXTRACTION_MAX_PENDING, timeout=EXTRACTION_TIMEOUT):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self.files = 0
+        self.jobs = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # fork, not spawn/forkserver: those re-import the entry script
+                # (python main_flask.py) in every worker. Forked workers only
+                # run the functions above; the app's own at-fork hooks reset
+                # its threads and clients, and _init_worker its signal handlers.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("fork"),
+                    initializer=_init_worker,
+                )
+            return self._executor
+
+    def _restart(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self.restarts += 1
+        # ProcessPoolExecutor can't cancel a running job; stop its workers instead
+        for process in list(getattr(executor, "_processes", {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning("♻️ Extraction pool restarted after a stuck job.")
+
+    def map(self, func, jobs, window=None):
+        """
+        Generator of func(*job) results in job order. At most `window` jobs
+        (default: all) are submitted ahead of the one being waited on, so
+        closing the generator early (for example when a token budget is
+        reached) leaves the rest unsubmitted or cancels them.
+        """
+        if _in_worker:
+            raise RuntimeError("extraction pool used from inside an extraction worker")
+        jobs = iter(jobs)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise ExtractionRejected(f"{self._pending} files are already being extracted")
+            self._pending += 1
+            self.files += 1
+
+        entries = deque()   # [future, job, attempts, first seen running]
+        try:
+            executor = self._get_executor()
+
+            def submit(count):
+                for job in itertools.islice(jobs, count):
+                    entries.append([executor.submit(_run_job, func, job, self.timeout), job, 1, None])
+                    self.jobs += 1
+
+            submit(window or sys.maxsize)
+            while entries:
+                entry = entries[0]
+                try:
+                    result = self._wait(entry, executor)
+                except BrokenProcessPool:
+                    # The pool was killed (by another file's stuck job) or a worker crashed
+                    if entry[2] > 1:
+                        raise
+                    self._restart(executor)
+                    executor = self._resubmit(entries, func)
+                    continue
+                except TimeoutError:
+                    self.timeouts += 1
+                    raise TimeoutError(f"extraction job took longer than {self.timeout:.0f}s") from None
+                entries.popleft()
+                if window:
+                    submit(1)
+                yield result
+        finally:
+            for entry in entries:
+                entry[0].cancel()
+            with self._lock:
+                self._pending -= 1
+
+    def _wait(self, entry, executor):
+        future = entry[0]
+        while True:
+            done, _ = wait([future], timeout=1.0)
+            if done:
+                return future.result()
+            if not future.running():
+                continue    # still queued behind other jobs
+            entry[3] = entry[3] or time.monotonic()
+            # "running" starts when the job enters the call queue, which can be
+            # one job ahead of a worker picking it up
+            if time.monotonic() - entry[3] > 2 * self.timeout + EXTRACTION_KILL_GRACE:
+                self._restart(executor)
+                raise TimeoutError(f"extraction job stuck past {self.timeout:.0f}s; pool restarted")
+
+    def _resubmit(self, entries, func):
+        executor = self._get_executor()
+        for entry in entries:
+            future = entry[0]
+            if future.done() and not future.cancelled() and future.exception() is None:
+                continue
+            future.cancel()
+            entry[0] = executor.submit(_run_job, func, entry[1], self.timeout)
+            entry[2] += 1
+            entry[3] = None
+        return executor
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending_files": self._pending,
+            "max_pending": self.max_pending,
+            "files": self.files,
+            "jobs": self.jobs,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "restarts": self.restarts,
+        }
+
+
+extraction_pool = ExtractionPool()
+
+
+def _reset_after_fork():
+    # A forked child must not share the parent's workers
+    extraction_pool._lock = threading.Lock()
+    extraction_pool._executor = None
+    extraction_pool._pending = 0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
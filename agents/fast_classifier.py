@@ -0,0 +1,210 @@
+# Local tiered classifier that answers the easy messages before gpt-4o is asked
+
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+from agents.logger import get_logger  # type: ignore
+
+logger = get_logger("fast_classifier", "logs/fast_classifier.log")
+
+FAST_CLASSIFIER_ENABLED = os.getenv("FAST_CLASSIFIER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Minimum confidence for a rule label to be used instead of the LLM
+FAST_CLASSIFIER_THRESHOLD = float(os.getenv("FAST_CLASSIFIER_THRESHOLD", "0.9"))
+# The learned model is far less calibrated than the rules (on today's ~100
+# logged examples it is wrong about 1 in 6 times even above 0.99), so it is
+# off by default and has its own, stricter bar
+FAST_CLASSIFIER_MODEL = os.getenv("FAST_CLASSIFIER_MODEL", "false").lower() in ("1", "true", "yes")
+FAST_CLASSIFIER_MODEL_THRESHOLD = float(os.getenv("FAST_CLASSIFIER_MODEL_THRESHOLD", "0.99"))
+CLASSIFIER_TRAINING_LOG = os.getenv("CLASSIFIER_TRAINING_LOG", "logs/chat_agent.log")
+CLASSIFIER_MIN_EXAMPLES = int(os.getenv("CLASSIFIER_MIN_EXAMPLES", "300"))
+
+LABELS = ("Greeting", "NewRequirement", "FollowUp", "ModelRejection", "Goodbye", "OffTopic")
+
+_TRAINING_LINE = re.compile(r"Classified '(.+)' as: (\w+)\s*$")
+
+
+def _compile(*patterns):
+    return re.compile(r"^\s*(?:" + "|".join(patterns) + r")\s*[!.?,😊👋🙂]*\s*$", re.IGNORECASE)
+
+
+# Words pointing back at the model already being discussed: "this model",
+# "the current one", "it"
+_BACK_REFERENCE = re.compile(
+    r"\b(?:this|that|it|the\s+(?:current|recommended|suggested|same)(?:\s+(?:one|model))?"
+    r"|the\s+model|current\s+one)\b",
+    re.IGNORECASE,
+)
+
+# When a rule applies: "always", "model" (only once a model has been
+# recommended) or "fresh" (only while nothing is recommended and the message
+# doesn't point back at an earlier one)
+# (label, confidence, pattern, context). Checked in order.
+_RULES = [
+    ("Greeting", 0.97, _compile(
+        r"(?:hi|hii+|hello+|hey+|hiya|yo|namaste|greetings)(?:\s+(?:there|bot|agent|again))?",
+        r"good\s+(?:morning|afternoon|evening|day)(?:\s+(?:there|bot))?",
+    ), "always"),
+    ("Goodbye", 0.97, _compile(
+        r"(?:ok(?:ay)?\s+)?(?:bye+|goodbye|bye\s+bye|good\s*night|gn|cya|see\s+y(?:ou|a)(?:\s+later|\s+soon)?|ttyl)",
+        r"talk\s+(?:to\s+you\s+)?later",
+        r"(?:thanks|thank\s+you)[, ]+(?:bye|goodbye|good\s*night|see\s+you)",
+    ), "always"),
+    # The whole (short) message asks for something else: "another one please"
+    ("ModelRejection", 0.93, _compile(
+        r"(?:(?:can|could)\s+you\s+|please\s+)?(?:(?:show|give|suggest|recommend|try|find)\s+(?:me\s+)?)?"
+        r"(?:another|some\s+other|any\s+other|a\s+different|an?\s+alternative|something\s+else)"
+        r"(?:\s+(?:model|option|one|recommendation)s?)?(?:\s+please)?",
+        r"(?:i\s+)?(?:don'?t|do\s+not)\s+(?:like|want)\s+(?:this|that|it)(?:\s+(?:one|model))?",
+        r"(?:i'?m\s+)?not\s+(?:satisfied|happy)\s+with\s+(?:this|that|it)(?:\s+(?:one|model))?",
+        r"(?:next|skip)(?:\s+(?:one|model|option))?(?:\s+please)?",
+    ), "model"),
+    # Anywhere in a longer message, but only pointing back at the current model
+    ("ModelRejection", 0.93, re.compile(
+        r"\b(?:another|other|different|alternative)\s+(?:model|option|one|recommendation)s?\s+"
+        r"(?:instead\b|than\s+(?:this|that|it)\b|than\s+the\s+(?:current|recommended|suggested)\b)"
+        r"|\binstead\s+of\s+(?:this|that|it|the\s+(?:current|recommended|suggested)\s+(?:one|model))\b"
+        r"|\b(?:this|that|it)\s+(?:one\s+|model\s+)?(?:doesn'?t|does\s+not|won'?t|will\s+not|isn'?t|is\s+not)"
+        r"\s+(?:work|fit|suit|good|right|enough)",
+        re.IGNORECASE,
+    ), "model"),
+    # "I need a different model for OCR" may be a new requirement: leave it to the LLM
+    ("ModelRejection", 0.6, re.compile(
+        r"\b(?:another|other|different|alternative|else)\s+(?:model|option|one|recommendation)s?\b"
+        r"|\b(?:don'?t|do\s+not|doesn'?t)\s+(?:like|want|need)\s+(?:this|that|it)\b"
+        r"|\bnot\s+(?:satisfied|happy)\s+with\b",
+        re.IGNORECASE,
+    ), "model"),
+    ("FollowUp", 0.95, _compile(
+        r"y(?:es|eah|ep|up)?",
+        r"ok(?:ay)?|sure|of\s+course|go\s+ahead|please\s+do|tell\s+me\s+more|more\s+details?",
+        r"no+|nope|nah|not\s+really|no\s+thanks",
+    ), "model"),
+    ("NewRequirement", 0.92, re.compile(
+        r"^\s*(?:i\s+(?:need|want)|suggest|recommend|looking\s+for|what(?:'s|\s+is)\s+the\s+best)\b"
+        r".*\b(?:model|ai|llm)\b.*\b(?:for|to|that|which)\b",
+        re.IGNORECASE,
+    ), "fresh"),
+]
+
+
+def _tokens(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+class NaiveBayesClassifier:
+    """Multinomial naive Bayes over unigrams and bigrams with Laplace smoothing"""
+
+    def __init__(self):
+        self.label_counts = Counter()
+        self.feature_counts = defaultdict(Counter)
+        self.feature_totals = Counter()
+        self.vocabulary = set()
+
+    @staticmethod
+    def _features(text):
+        tokens = _tokens(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])] + [f"__len{min(len(tokens), 8)}"]
+
+    def fit(self, examples):
+        for text, label in examples:
+            features = self._features(text)
+            self.label_counts[label] += 1
+            self.feature_counts[label].update(features)
+            self.feature_totals[label] += len(features)
+            self.vocabulary.update(features)
+        return self
+
+    def __len__(self):
+        return sum(self.label_counts.values())
+
+    def predict(self, text):
+        """(label, posterior probability)"""
+        if not self.label_counts:
+            return None, 0.0
+        features = self._features(text)
+        total = sum(self.label_counts.values())
+        vocab = len(self.vocabulary) + 1
+        scores = {}
+        for label, count in self.label_counts.items():
+            score = math.log(count / total)
+            denom = self.feature_totals[label] + vocab
+            counts = self.feature_counts[label]
+            for feature in features:
+                score += math.log((counts[feature] + 1) / denom)
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        peak = scores[best]
+        norm = sum(math.exp(s - peak) for s in scores.values())
+        return best, 1.0 / norm
+
+
+def load_training_examples(path=CLASSIFIER_TRAINING_LOG):
+    """(message, label) pairs from logged "Classified '...' as: X" lines"""
+    examples = []
+    try:
+        with open(path, encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                match = _TRAINING_LINE.search(line)
+                if match and match.group(2) in LABELS:
+                    examples.append((match.group(1), match.group(2)))
+    except OSError as e:
+        logger.warning(f"⚠️ No classifier training data at {path}: {e}")
+    return examples
+
+
+class FastClassifier:
+    """
+    Tier 1: compiled keyword/regex rules.
+    Tier 2: naive Bayes trained on logged LLM classifications (optional).
+    Returns (label, confidence, tier); the label is None whenever the
+    confidence is below that tier's threshold and the LLM should decide.
+    """
+
+    def __init__(self, use_model=FAST_CLASSIFIER_MODEL):
+        self.use_model = use_model
+        self._model = None
+        self._model_lock = threading.Lock()
+
+    def _get_model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    examples = load_training_examples()
+                    model = NaiveBayesClassifier().fit(examples)
+                    logger.info(f"✅ Trained local classifier on {len(model)} logged classifications")
+                    self._model = model
+        return self._model
+
+    def classify(self, text, current_model=None):
+        text = (text or "").strip()
+        if not text:
+            return None, 0.0, "none"
+
+        for label, confidence, pattern, context in _RULES:
+            if context == "model" and not current_model:
+                continue
+            # "I need to know the price of this model for 1M tokens" is a
+            # question about the current model, not a new requirement
+            if context == "fresh" and (current_model or _BACK_REFERENCE.search(text)):
+                continue
+            if pattern.search(text):
+                # A rule that matches without being sure stops here too: the
+                # message is ambiguous, so the LLM decides
+                return (label if confidence >= FAST_CLASSIFIER_THRESHOLD else None), confidence, "rule"
+
+        if self.use_model:
+            model = self._get_model()
+            if len(model) >= CLASSIFIER_MIN_EXAMPLES:
+                label, confidence = model.predict(text)
+                # Context-dependent labels only make sense with a current model
+                if label in ("FollowUp", "ModelRejection") and not current_model:
+                    return None, confidence, "model"
+                return (label if confidence >= FAST_CLASSIFIER_MODEL_THRESHOLD else None), confidence, "model"
+
+        return None, 0.0, "none"
+
+
+fast_classifier = FastClassifier()
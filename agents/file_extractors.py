@@ -0,0 +1,368 @@
+# Streaming text extraction from user files, bounded by a prompt token budget
+
+import csv
+import io
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import docx
+import openpyxl
+
+from agents.logger import get_logger  # type: ignore
+from agents.catalog_search import clip_text, count_tokens  # type: ignore
+from agents.extraction_cache import EXTRACTION_CACHE_ENABLED, extraction_cache  # type: ignore
+from agents.extraction_pool import (  # type: ignore
+    audio_segments, extraction_pool, image_pages, ocr_page, pdf_page, pdf_pages, transcribe_segment
+)
+
+logger = get_logger("file_extractors", "logs/file_extractors.log")
+
+# Tokens of extracted text one file may contribute to a prompt
+FILE_TOKEN_BUDGET = int(os.getenv("FILE_TOKEN_BUDGET", "6000"))
+FILE_READ_CHUNK_CHARS = 64 * 1024
+# Tables longer than this are summarized (schema, stats, first rows) instead of dumped
+FILE_TABLE_SAMPLE_ROWS = int(os.getenv("FILE_TABLE_SAMPLE_ROWS", "20"))
+# Rows scanned for table statistics; the rest of a huge sheet is not read
+FILE_TABLE_SCAN_ROWS = int(os.getenv("FILE_TABLE_SCAN_ROWS", "200000"))
+# PDF pages submitted to the extraction pool ahead of the one being read
+FILE_PDF_PAGE_WINDOW = int(os.getenv("FILE_PDF_PAGE_WINDOW", "4"))
+# Larger JSON files are streamed as plain text instead of parsed. json.load
+# builds the whole document in memory (several times the file size) before
+# it is sampled, so keep this small
+FILE_JSON_MAX_BYTES = int(os.getenv("FILE_JSON_MAX_BYTES", str(2 * 1024 * 1024)))
+FILE_JSON_LIST_ITEMS = int(os.getenv("FILE_JSON_LIST_ITEMS", "20"))
+
+# Distinct values tracked per table column before it counts as free text
+_DISTINCT_LIMIT = 20
+
+
+@dataclass(slots=True)
+class ExtractionResult:
+    path: str
+    kind: str
+    text: str = ""
+    size: int = 0            # bytes on disk
+    bytes_read: int = 0      # bytes actually read before the budget stopped extraction
+    tokens: int = 0
+    seconds: float = 0.0
+    truncated: bool = False
+    error: str = ""
+
+    def stats(self):
+        return {
+            "file": os.path.basename(self.path), "kind": self.kind, "size": self.size,
+            "bytes_read": self.bytes_read, "tokens": self.tokens,
+            "ms": round(self.seconds * 1000, 1), "truncated": self.truncated,
+        }
+
+
+class _CountingFile(io.FileIO):
+    """A raw file that counts the bytes read through it"""
+    bytes_read = 0
+
+    def readinto(self, buffer):
+        n = super().readinto(buffer)
+        self.bytes_read += n or 0
+        return n
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data or b"")
+        return data
+
+    def readall(self):
+        data = super().readall()
+        self.bytes_read += len(data)
+        return data
+
+
+@contextmanager
+def _open_text(path, encoding="utf-8"):
+    raw = _CountingFile(path, "r")
+    stream = io.TextIOWrapper(io.BufferedReader(raw), encoding=encoding, errors="replace", newline="")
+    try:
+        yield stream, raw
+    finally:
+        stream.close()
+
+
+# ---------- tables ----------
+
+class _ColumnProfile:
+    __slots__ = ("name", "filled", "numeric", "low", "high", "total", "distinct")
+
+    def __init__(self, name):
+        self.name = name
+        self.filled = 0
+        self.numeric = 0
+        self.low = self.high = None
+        self.total = 0.0
+        self.distinct = {}
+
+    def add(self, value):
+        if value is None or str(value).strip() == "":
+            return
+        self.filled += 1
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            number = None
+        if number is not None and number == number:
+            self.numeric += 1
+            self.total += number
+            self.low = number if self.low is None else min(self.low, number)
+            self.high = number if self.high is None else max(self.high, number)
+        if self.distinct is not None:
+            key = str(value).strip()
+            self.distinct[key] = self.distinct.get(key, 0) + 1
+            if len(self.distinct) > _DISTINCT_LIMIT:
+                self.distinct = None
+
+    def describe(self, rows):
+        empty = rows - self.filled
+        suffix = f" ({empty} empty)" if empty else ""
+        if self.filled and self.numeric == self.filled:
+            return (f"- {self.name}: numeric, min {self.low:g}, max {self.high:g}, "
+                    f"mean {self.total / self.numeric:g}{suffix}")
+        if self.distinct is None:
+            return f"- {self.name}: text, more than {_DISTINCT_LIMIT} distinct values{suffix}"
+        common = sorted(self.distinct, key=lambda k: -self.distinct[k])[:5]
+        return f"- {self.name}: text, {len(self.distinct)} distinct, e.g. {', '.join(common)}{suffix}"
+
+
+def _format_row(row):
+    return ", ".join("" if value is None else str(value) for value in row)
+
+
+def _iter_table(rows, title=""):
+    """
+    Small tables are returned row by row as before; larger ones as a profile
+    (row count, per-column type and stats) plus their first rows, computed in
+    one streaming pass without holding the table in memory.
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return
+    head = [header]
+    for row in rows:
+        head.append(row)
+        if len(head) > FILE_TABLE_SAMPLE_ROWS + 1:
+            break
+    else:
+        yield "\n".join(_format_row(row) for row in head)
+        return
+
+    columns = [_ColumnProfile(str(name) if name is not None else f"column {i + 1}") for i, name in enumerate(header)]
+    count, complete = 0, True
+    for row in itertools.chain(head[1:], rows):
+        if count >= FILE_TABLE_SCAN_ROWS:
+            complete = False
+            break
+        count += 1
+        for column, value in zip(columns, row):
+            column.add(value)
+
+    scanned = "" if complete else f" (statistics from the first {count} rows)"
+    yield (
+        f"{title}Table: {count if complete else f'more than {count}'} rows x {len(columns)} columns{scanned}\n"
+        "Columns:\n" + "\n".join(column.describe(count) for column in columns) + "\n"
+        f"First {FILE_TABLE_SAMPLE_ROWS} rows:\n"
+        + "\n".join(_format_row(row) for row in head[:FILE_TABLE_SAMPLE_ROWS + 1])
+    )
+
+
+# ---------- extractors: generators of text chunks ----------
+
+def _iter_text(path, result):
+    with _open_text(path) as (stream, raw):
+        while True:
+            chunk = stream.read(FILE_READ_CHUNK_CHARS)
+            result.bytes_read = raw.bytes_read
+            if not chunk:
+                return
+            yield chunk
+
+
+def _iter_csv(path, result):
+    with _open_text(path) as (stream, raw):
+        def rows():
+            for row in csv.reader(stream):
+                result.bytes_read = raw.bytes_read
+                yield row
+        yield from _iter_table(rows())
+
+
+def _iter_xlsx(path, result):
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        result.bytes_read = result.size
+        for sheet in workbook.worksheets:
+            title = f"Sheet '{sheet.title}' - " if len(workbook.worksheets) > 1 else ""
+            for part in _iter_table(sheet.iter_rows(values_only=True), title):
+                yield part + "\n\n"
+    finally:
+        workbook.close()
+
+
+def _sample_json(value):
+    """Long lists cut to their first items, recursively"""
+    if isinstance(value, dict):
+        return {key: _sample_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        sample = [_sample_json(item) for item in value[:FILE_JSON_LIST_ITEMS]]
+        if len(value) > FILE_JSON_LIST_ITEMS:
+            sample.append(f"... {len(value) - FILE_JSON_LIST_ITEMS} more items")
+        return sample
+    return value
+
+
+def _iter_json(path, result):
+    if result.size > FILE_JSON_MAX_BYTES:
+        logger.info(f"Streaming {os.path.basename(path)} as text ({result.size} bytes of JSON)")
+        yield from _iter_text(path, result)
+        return
+    with _open_text(path) as (stream, raw):
+        value = json.load(stream)
+        result.bytes_read = raw.bytes_read
+    # iterencode yields small pieces; hand them out in larger chunks
+    buffer, size = [], 0
+    for piece in json.JSONEncoder(indent=2, ensure_ascii=False).iterencode(_sample_json(value)):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= 4096:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def _iter_docx(path, result):
+    document = docx.Document(path)
+    result.bytes_read = result.size
+    for paragraph in document.paragraphs:
+        yield paragraph.text + "\n"
+
+
+def _iter_image(path, result):
+    # OCR runs in the extraction pool, one job per page of a multi-page image
+    pages = image_pages(path)
+    result.bytes_read = result.size
+    for text in extraction_pool.map(ocr_page, pages):
+        yield text + "\n"
+
+
+def _iter_pdf(path, result):
+    # Pages are extracted in the pool a few at a time, so a long document
+    # stops being read once the token budget is used up
+    pages = pdf_pages(path)
+    result.bytes_read = result.size
+    for number, text in enumerate(extraction_pool.map(pdf_page, pages, window=FILE_PDF_PAGE_WINDOW), 1):
+        if text.strip():
+            yield f"[Page {number}/{len(pages)}]\n{text.strip()}\n\n"
+
+
+def _iter_audio(path, result):
+    # Transcribed in the extraction pool, in fixed-length chunks
+    segments = audio_segments(path)
+    result.bytes_read = result.size
+    for text in extraction_pool.map(transcribe_segment, segments):
+        if text:
+            yield text + " "
+
+
+# extension -> (kind, extractor)
+EXTRACTORS = {
+    ".txt": ("text", _iter_text),
+    ".docx": ("docx", _iter_docx),
+    ".pdf": ("pdf", _iter_pdf),
+    ".csv": ("csv", _iter_csv),
+    ".xlsx": ("xlsx", _iter_xlsx),
+    ".json": ("json", _iter_json),
+    ".png": ("image", _iter_image),
+    ".jpg": ("image", _iter_image),
+    ".jpeg": ("image", _iter_image),
+    ".tif": ("image", _iter_image),
+    ".tiff": ("image", _iter_image),
+    ".mp3": ("audio", _iter_audio),
+    ".wav": ("audio", _iter_audio),
+}
+
+
+# ExtractionResult fields kept in the extraction cache
+_CACHED_FIELDS = ("kind", "text", "size", "bytes_read", "tokens", "truncated")
+
+
+def extract_file(path, max_tokens=FILE_TOKEN_BUDGET):
+    """
+    Text of `path` for a prompt. Extraction stops (and the file is read no
+    further) once `max_tokens` is reached; errors are logged and leave
+    whatever was extracted so far.
+
+    Results are cached by the SHA-256 of the file's content, so a file that
+    was extracted before, under any name, is not parsed or OCR'd again.
+    """
+    ext = os.path.splitext(path)[-1].lower()
+    kind, extractor = EXTRACTORS.get(ext, ("unsupported", None))
+    result = ExtractionResult(path, kind)
+    if extractor is None:
+        logger.warning(f"Unsupported file format: {ext}")
+        result.error = f"unsupported file format: {ext}"
+        return result
+
+    started = time.perf_counter()
+    sha = None
+    if EXTRACTION_CACHE_ENABLED:
+        try:
+            sha = extraction_cache.digest(path)
+            cached = extraction_cache.get(sha, max_tokens)
+        except OSError as e:
+            logger.error(f"Could not hash {os.path.basename(path)}: {e}")
+            cached = None
+        if cached is not None:
+            for field in _CACHED_FIELDS:
+                setattr(result, field, cached[field])
+            result.bytes_read = 0
+            result.seconds = time.perf_counter() - started
+            logger.info(f"📄 Extraction cache hit {result.stats()}")
+            return result
+
+    parts = []
+    chunks = None
+    try:
+        result.size = os.path.getsize(path)
+        chunks = extractor(path, result)
+        for chunk in chunks:
+            tokens = count_tokens(chunk)
+            if result.tokens + tokens > max_tokens:
+                remaining = max_tokens - result.tokens
+                if remaining > 0:
+                    chunk, tokens = clip_text(chunk, remaining)
+                    parts.append(chunk)
+                    result.tokens += tokens
+                result.truncated = True
+                break
+            parts.append(chunk)
+            result.tokens += tokens
+    except Exception as e:
+        logger.error(f"Error reading {kind} file {os.path.basename(path)}: {e}")
+        result.error = str(e)
+    finally:
+        if chunks is not None:
+            chunks.close()
+
+    result.text = "".join(parts).strip()
+    if result.truncated:
+        result.text += (
+            f"\n[... truncated: {max_tokens}-token limit reached after "
+            f"{result.bytes_read} of {result.size} bytes]"
+        )
+    result.seconds = time.perf_counter() - started
+    logger.info(f"📄 Extracted {result.stats()}")
+    if sha is not None and not result.error:
+        extraction_cache.put(sha, max_tokens, {field: getattr(result, field) for field in _CACHED_FIELDS})
+    return result
@@ -0,0 +1,287 @@
+# Durable local job queue (SQLite) with a worker pool and per-user ordering
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from agents.logger import get_logger  # type: ignore
+
+logger = get_logger("job_queue", "logs/job_queue.log")
+
+JOB_QUEUE_ENABLED = os.getenv("JOB_QUEUE_ENABLED", "true").lower() in ("1", "true", "yes")
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "data/job_queue.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# A running job whose lease expires (worker died) becomes claimable again;
+# live workers renew their jobs' leases every third of this
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+# Finished jobs are kept this long for inspection, then purged
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_key, status, id);
+"""
+
+# Oldest claimable job whose user has nothing running and nothing older queued
+_CLAIM_SQL = """
+SELECT j.id, j.kind, j.user_key, j.payload, j.attempts FROM jobs j
+WHERE (
+        (j.status = 'pending' AND j.available_at <= :now)
+     OR (j.status = 'running' AND j.lease_until < :now)
+  )
+  AND NOT EXISTS (
+        SELECT 1 FROM jobs r
+        WHERE r.user_key = j.user_key AND r.id != j.id
+          AND r.status = 'running' AND r.lease_until >= :now
+  )
+  AND NOT EXISTS (
+        SELECT 1 FROM jobs e
+        WHERE e.user_key = j.user_key AND e.id < j.id AND e.status IN ('pending', 'running')
+  )
+ORDER BY j.id
+LIMIT 1
+"""
+
+
+class JobQueue:
+    """
+    Jobs are rows in a SQLite file, so they survive restarts and can be
+    shared by several worker processes on one machine. Jobs with the same
+    `user_key` run strictly one at a time in enqueue order; failures are
+    retried with exponential backoff up to `max_attempts`, after which the
+    kind's failure handler (if any) runs once. While a handler runs, its
+    lease is renewed, so a slow job is never claimed by a second worker.
+    """
+
+    def __init__(self, path=JOB_QUEUE_PATH, workers=JOB_WORKERS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+
+        self._handlers = {}
+        self._failure_handlers = {}
+        self._running = set()           # ids of jobs this process is running
+        self._running_lock = threading.Lock()
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._keeper = None
+        self._stop = threading.Event()
+        self._last_purge = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    # ---------- storage ----------
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def enqueue(self, kind, user_key, payload, delay=0.0):
+        now = time.time()
+        cursor = self._conn().execute(
+            "INSERT INTO jobs (kind, user_key, payload, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, user_key, json.dumps(payload, default=str), now + delay, now, now),
+        )
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify()
+        return cursor.lastrowid
+
+    def _claim(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(_CLAIM_SQL, {"now": now}).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                "WHERE id = ?",
+                (now + JOB_LEASE_SECONDS, now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        job_id, kind, user_key, payload, attempts = row
+        return {"id": job_id, "kind": kind, "user_key": user_key,
+                "payload": json.loads(payload), "attempts": attempts + 1}
+
+    def _finish(self, job, error=None):
+        now = time.time()
+        if error is None:
+            self._conn().execute(
+                "UPDATE jobs SET status = 'done', lease_until = NULL, updated_at = ? WHERE id = ?",
+                (now, job["id"]),
+            )
+        elif job["attempts"] >= self.max_attempts:
+            self._conn().execute(
+                "UPDATE jobs SET status = 'failed', lease_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                (error, now, job["id"]),
+            )
+            logger.error(f"❌ Job {job['id']} ({job['kind']}) failed permanently: {error}")
+            on_failure = self._failure_handlers.get(job["kind"])
+            if on_failure is not None:
+                try:
+                    on_failure(job["payload"], error)
+                except Exception as e:
+                    logger.error(f"❌ Failure handler for job {job['id']} ({job['kind']}) failed: {e}")
+        else:
+            delay = min(2 ** job["attempts"], 300)
+            self._conn().execute(
+                "UPDATE jobs SET status = 'pending', lease_until = NULL, available_at = ?, last_error = ?, "
+                "updated_at = ? WHERE id = ?",
+                (now + delay, error, now, job["id"]),
+            )
+            logger.warning(f"⚠️ Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed, retry in {delay}s: {error}")
+
+    def _purge(self):
+        if time.time() - self._last_purge < 600:
+            return
+        self._last_purge = time.time()
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - JOB_RETENTION_SECONDS,),
+        )
+
+    # ---------- workers ----------
+
+    def register(self, kind, handler, on_failure=None):
+        """
+        `handler(payload)` runs in a worker thread; raising schedules a retry.
+        `on_failure(payload, error)` runs once the last attempt has failed.
+        """
+        self._handlers[kind] = handler
+        if on_failure is not None:
+            self._failure_handlers[kind] = on_failure
+
+    def _renew_leases(self):
+        """Push out the leases of the jobs this process is running"""
+        while not self._stop.wait(JOB_LEASE_SECONDS / 3):
+            with self._running_lock:
+                running = list(self._running)
+            if not running:
+                continue
+            now = time.time()
+            try:
+                self._conn().execute(
+                    "UPDATE jobs SET lease_until = ?, updated_at = ? "
+                    f"WHERE status = 'running' AND id IN ({', '.join('?' * len(running))})",
+                    (now + JOB_LEASE_SECONDS, now, *running),
+                )
+            except sqlite3.Error as e:
+                logger.error(f"❌ Job lease renewal failed: {e}")
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"❌ Job claim failed: {e}")
+                job = None
+
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(1.0)
+                self._purge()
+                continue
+
+            handler = self._handlers.get(job["kind"])
+            started = time.perf_counter()
+            with self._running_lock:
+                self._running.add(job["id"])
+            try:
+                if handler is None:
+                    raise LookupError(f"no handler registered for '{job['kind']}'")
+                handler(job["payload"])
+                self._finish(job)
+                logger.info(f"✅ Job {job['id']} ({job['kind']}) done in {(time.perf_counter() - started) * 1000:.0f} ms")
+            except Exception as e:
+                self._finish(job, repr(e))
+            finally:
+                with self._running_lock:
+                    self._running.discard(job["id"])
+            # Another worker may be waiting for this user's next job
+            with self._wakeup:
+                self._wakeup.notify_all()
+
+    def start(self):
+        """Start the worker threads (once per process)"""
+        if self._threads and all(t.is_alive() for t in self._threads):
+            return
+        with self._wakeup:
+            if self.workers and (self._keeper is None or not self._keeper.is_alive()):
+                self._keeper = threading.Thread(target=self._renew_leases, name="job-lease-keeper", daemon=True)
+                self._keeper.start()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(len(self._threads), self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def stats(self):
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {"workers": self.workers, **{status: count for status, count in rows}}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """Worker threads don't survive a fork; they are restarted on the next enqueue"""
+    global _queue_lock
+    if _queue is not None:
+        _queue._threads = []
+        _queue._keeper = None
+        _queue._running = set()
+        _queue._running_lock = threading.Lock()
+        _queue._wakeup = threading.Condition()
+    _queue_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_job_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue()
+    return _queue
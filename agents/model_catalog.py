@@ -0,0 +1,285 @@
+# Process-wide, read-only cache of the model catalog used by the recommender
+
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from pymongo.errors import OperationFailure, PyMongoError
+from dotenv import load_dotenv
+from agents.logger import get_logger  # type: ignore
+from agents.mongo_pool import get_collection  # type: ignore
+
+load_dotenv()
+
+logger = get_logger("model_catalog", "logs/model_catalog.log")
+
+# Seconds between `updated_at` polls when change streams are unavailable
+CATALOG_POLL_INTERVAL = float(os.getenv("CATALOG_POLL_INTERVAL", "30"))
+# Seconds between full reloads in polling mode (picks up deletions)
+CATALOG_FULL_RESYNC_INTERVAL = float(os.getenv("CATALOG_FULL_RESYNC_INTERVAL", "900"))
+# "auto" tries a change stream first, "poll" forces watermark polling, "off" loads once
+CATALOG_REFRESH_MODE = os.getenv("CATALOG_REFRESH_MODE", "auto").lower()
+
+# Server errors meaning a change stream can't resume where it left off
+# (ChangeStreamFatalError, ChangeStreamHistoryLost): only a reload recovers
+_STREAM_LOST_CODES = (280, 286)
+
+
+def _freeze(doc):
+    """Return a read-only view of a catalog document without its `_id`"""
+    return MappingProxyType({k: v for k, v in doc.items() if k != "_id"})
+
+
+class ModelCatalog:
+    """
+    Holds the catalog in memory and keeps it fresh in a background thread.
+
+    Readers call `snapshot()` and get an immutable tuple of read-only
+    mappings, so recommendation turns never touch the database.
+    """
+
+    def __init__(self, mongo_uri, db_name, collection_name):
+        self.mongo_uri = mongo_uri
+        self.db_name = db_name
+        self.collection_name = collection_name
+
+        self._lock = threading.Lock()
+        self._docs = {}                 # _id -> read-only document
+        self._snapshot = ()
+        self._watermark = None          # highest `updated_at` seen
+        self._loaded_at = None          # cluster time just before the last full load
+        self._resume_token = None       # position of the last change applied
+        self._stream_opened = False
+        self._loaded = threading.Event()
+        self._watcher = None
+        self._stop = threading.Event()
+        self._subscribers = []
+
+    # ---------- collection access ----------
+
+    def _collection(self):
+        return get_collection(self.db_name, self.collection_name, self.mongo_uri)
+
+    # ---------- loading ----------
+
+    def _rebuild_snapshot(self):
+        self._snapshot = tuple(self._docs.values())
+
+    def _notify(self, event, doc_id=None, doc=None):
+        for callback in list(self._subscribers):
+            try:
+                callback(event, doc_id, doc)
+            except Exception as e:
+                logger.error(f"❌ Catalog subscriber failed on `{event}`: {e}")
+
+    def _track_watermark(self, doc):
+        updated_at = doc.get("updated_at")
+        if updated_at is not None and (self._watermark is None or updated_at > self._watermark):
+            self._watermark = updated_at
+
+    def _operation_time(self):
+        """The cluster's current operation time (None on standalone servers)"""
+        try:
+            return self._collection().database.command("ping").get("operationTime")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read the cluster time: {e}")
+            return None
+
+    def load(self):
+        """Full load of the catalog, replacing whatever is cached"""
+        started = time.time()
+        # Taken before reading, so a change stream opened afterwards starts
+        # here and misses nothing written while the load ran
+        loaded_at = self._operation_time()
+        docs = {}
+        watermark = None
+        for doc in self._collection().find({}):
+            docs[doc["_id"]] = _freeze(doc)
+            updated_at = doc.get("updated_at")
+            if updated_at is not None and (watermark is None or updated_at > watermark):
+                watermark = updated_at
+
+        with self._lock:
+            self._docs = docs
+            self._watermark = watermark
+            self._loaded_at = loaded_at
+            self._resume_token = None
+            self._rebuild_snapshot()
+        self._loaded.set()
+        self._notify("reload")
+
+        logger.info(
+            f"✅ Loaded {len(docs)} models from `{self.collection_name}` "
+            f"in {(time.time() - started) * 1000:.0f} ms."
+        )
+
+    def _apply_upsert(self, doc):
+        frozen = _freeze(doc)
+        with self._lock:
+            self._docs[doc["_id"]] = frozen
+            self._track_watermark(doc)
+            self._rebuild_snapshot()
+        self._notify("upsert", doc["_id"], frozen)
+
+    def _apply_delete(self, doc_id):
+        with self._lock:
+            removed = self._docs.pop(doc_id, None) is not None
+            if removed:
+                self._rebuild_snapshot()
+        if removed:
+            self._notify("delete", doc_id)
+
+    # ---------- refresh strategies ----------
+
+    def _watch_change_stream(self):
+        """
+        Apply change events until stopped, starting after the last change
+        applied or, after a load, at the cluster time the load began.
+        Raises OperationFailure if unsupported.
+        """
+        options = {"full_document": "updateLookup"}
+        if self._resume_token is not None:
+            options["resume_after"] = self._resume_token
+        elif self._loaded_at is not None:
+            options["start_at_operation_time"] = self._loaded_at
+        with self._collection().watch(**options) as stream:
+            self._stream_opened = True
+            logger.info(f"🔔 Catalog change stream opened ({'resumed' if 'resume_after' in options else 'from load'}).")
+            while not self._stop.is_set():
+                change = stream.try_next()
+                if change is None:
+                    # Empty batches still advance the resume position
+                    self._resume_token = stream.resume_token or self._resume_token
+                    self._stop.wait(1)
+                    continue
+
+                op = change.get("operationType")
+                if op in ("insert", "update", "replace"):
+                    doc = change.get("fullDocument")
+                    if doc is not None:
+                        self._apply_upsert(doc)
+                    else:
+                        # Document vanished between the change and the lookup
+                        self._apply_delete(change["documentKey"]["_id"])
+                elif op == "delete":
+                    self._apply_delete(change["documentKey"]["_id"])
+                elif op in ("drop", "rename", "dropDatabase", "invalidate"):
+                    logger.warning(f"⚠️ Catalog stream invalidated by `{op}`; reloading.")
+                    self.load()
+                    return
+                self._resume_token = stream.resume_token
+                logger.info(f"🔄 Applied catalog change `{op}`.")
+
+    def _poll_watermark(self):
+        """Fetch documents modified since the last seen `updated_at`"""
+        last_full = time.time()
+        while not self._stop.wait(CATALOG_POLL_INTERVAL):
+            try:
+                if time.time() - last_full >= CATALOG_FULL_RESYNC_INTERVAL:
+                    self.load()
+                    last_full = time.time()
+                    continue
+
+                if self._watermark is None:
+                    continue
+
+                changed = list(self._collection().find({"updated_at": {"$gt": self._watermark}}))
+                for doc in changed:
+                    self._apply_upsert(doc)
+                if changed:
+                    logger.info(f"🔄 Applied {len(changed)} catalog update(s) from watermark poll.")
+            except PyMongoError as e:
+                logger.error(f"❌ Catalog poll failed: {e}")
+
+    def _run_watcher(self):
+        if CATALOG_REFRESH_MODE == "auto":
+            while not self._stop.is_set():
+                try:
+                    self._watch_change_stream()
+                    continue
+                except OperationFailure as e:
+                    if not self._stream_opened:
+                        # Standalone servers and some tiers do not support change streams
+                        logger.warning(f"⚠️ Change streams unavailable ({e}); falling back to polling.")
+                        break
+                    lost = e.code in _STREAM_LOST_CODES
+                    logger.error(f"❌ Catalog change stream error: {e}; "
+                                 f"{'reloading' if lost else 'resuming'}.")
+                except PyMongoError as e:
+                    lost = False
+                    logger.error(f"❌ Catalog change stream error: {e}; resuming.")
+                if self._stop.wait(5):
+                    return
+                if lost:
+                    # The stream can't resume from its position; start over from a fresh load
+                    try:
+                        self.load()
+                    except PyMongoError as load_err:
+                        logger.error(f"❌ Catalog reload failed: {load_err}")
+        if not self._stop.is_set():
+            self._poll_watermark()
+
+    def start(self):
+        """Load the catalog (once) and start the background refresher"""
+        if self._loaded.is_set():
+            return
+        self.load()
+        if CATALOG_REFRESH_MODE in ("auto", "poll") and self._watcher is None:
+            self._watcher = threading.Thread(target=self._run_watcher, name="catalog-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # ---------- read API ----------
+
+    def snapshot(self):
+        """Immutable tuple of read-only model documents"""
+        return self._snapshot
+
+    def items(self):
+        """(_id, document) pairs of the current catalog"""
+        with self._lock:
+            return tuple(self._docs.items())
+
+    def subscribe(self, callback):
+        """
+        `callback(event, doc_id, doc)` runs after every change: "upsert" and
+        "delete" for single documents, "reload" (no id) after a full load.
+        """
+        self._subscribers.append(callback)
+
+    def __len__(self):
+        return len(self._snapshot)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """The watcher thread does not survive a fork; let each worker load its own"""
+    global _catalog, _catalog_lock
+    _catalog = None
+    _catalog_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_model_catalog():
+    """Return the shared catalog, loading it on first use"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                catalog = ModelCatalog(
+                    os.getenv("MONGO_URI"),
+                    os.getenv("RECOMMENDER_DB_NAME"),
+                    os.getenv("RECOMMENDER_COLLECTION_NAME"),
+                )
+                catalog.start()
+                _catalog = catalog
+    return _catalog
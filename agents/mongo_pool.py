@@ -0,0 +1,175 @@
+# Shared MongoDB connection registry: one tuned pool per URI for the whole process
+
+import os
+import threading
+
+import certifi
+from pymongo import MongoClient, monitoring
+from dotenv import load_dotenv
+from agents.logger import get_logger  # type: ignore
+
+load_dotenv()
+
+logger = get_logger("mongo_pool", "logs/mongo_pool.log")
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "20000"))
+MONGO_TLS = os.getenv("MONGO_TLS", "true").lower() in ("1", "true", "yes")
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Counts connection pool events for one client"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "open_connections": self.created - self.closed,
+                "in_use": self.checked_out,
+                "peak_in_use": self.peak_checked_out,
+                "utilization": round(self.checked_out / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else None,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "connections_created": self.created,
+                "connections_closed": self.closed,
+                "pool_clears": self.pool_clears,
+            }
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    # Remaining events are not needed for utilization
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+_clients = {}  # uri -> (MongoClient, PoolMetrics)
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """Drop clients inherited from the parent; each worker builds its own lazily"""
+    global _lock
+    _clients.clear()
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client(uri=None):
+    """Return the process-wide MongoClient for `uri` (defaults to MONGO_URI)"""
+    uri = uri or os.getenv("MONGO_URI")
+    entry = _clients.get(uri)
+    if entry is None:
+        with _lock:
+            entry = _clients.get(uri)
+            if entry is None:
+                metrics = PoolMetrics()
+                options = {
+                    "maxPoolSize": MONGO_MAX_POOL_SIZE,
+                    "minPoolSize": MONGO_MIN_POOL_SIZE,
+                    "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+                    "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    "event_listeners": [metrics],
+                    # Don't open sockets or start monitors until the first operation,
+                    # so creating a client before a pre-fork server forks is safe
+                    "connect": False,
+                }
+                if MONGO_TLS:
+                    options.update(tls=True, tlsCAFile=certifi.where())
+                entry = (MongoClient(uri, **options), metrics)
+                _clients[uri] = entry
+                logger.info(
+                    f"✅ Created Mongo pool (pid {os.getpid()}, maxPoolSize={MONGO_MAX_POOL_SIZE}, "
+                    f"minPoolSize={MONGO_MIN_POOL_SIZE})"
+                )
+    return entry[0]
+
+
+def get_collection(db_name, collection_name, uri=None):
+    """Resolve a collection on the shared client"""
+    return get_client(uri)[db_name][collection_name]
+
+
+class LazyCollection:
+    """
+    Module-level stand-in for a pymongo Collection.
+
+    Every attribute access goes through the registry, so modules can keep
+    `chats_col = ...` globals without binding to a client at import time
+    (which would be shared across forked workers).
+    """
+
+    def __init__(self, db_name, collection_name, uri=None):
+        self._db_name = db_name
+        self._collection_name = collection_name
+        self._uri = uri
+
+    def resolve(self):
+        return get_collection(self._db_name, self._collection_name, self._uri)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        return f"LazyCollection({self._db_name!r}, {self._collection_name!r})"
+
+
+def pool_stats():
+    """Utilization metrics for every pool owned by this process"""
+    stats = {"pid": os.getpid(), "max_pool_size": MONGO_MAX_POOL_SIZE, "pools": []}
+    for index, (client, metrics) in enumerate(list(_clients.values())):
+        pool = metrics.snapshot()
+        pool["pool"] = index
+        stats["pools"].append(pool)
+    return stats
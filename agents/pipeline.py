@@ -0,0 +1,134 @@
+# Small stage executor used to overlap independent steps of a chat turn
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agents.logger import get_logger  # type: ignore
+
+logger = get_logger("pipeline", "logs/pipeline.log")
+
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "16"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_executor():
+    """Shared thread pool for pipeline stages (I/O-bound: LLM and Mongo calls)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix="pipeline")
+    return _executor
+
+
+class StagePipeline:
+    """
+    Runs named stages inline or in the background and records how long each took.
+
+    `submit()` starts a stage on the shared pool and `result()` joins it;
+    `run()` executes a stage on the calling thread. `run_async()` and
+    `result_async()` are the same for coroutines on an event loop.
+    `discard()` drops a stage that turned out not to be needed (e.g. a
+    speculative stage whose guess was wrong), cancelling it if it hasn't
+    started, and returns whether it was cancelled in time. `on_stage`, if
+    given, is called with a stage's name when the caller starts running or
+    waiting on it.
+    """
+
+    def __init__(self, name, on_stage=None):
+        self.name = name
+        self.on_stage = on_stage
+        self.started = time.perf_counter()
+        self._futures = {}
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    async def _timed_async(self, stage, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._timings[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+    def _timed(self, stage, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._timings[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+    def submit(self, stage, fn, *args, **kwargs):
+        future = get_executor().submit(self._timed, stage, fn, *args, **kwargs)
+        self._futures[stage] = future
+        return future
+
+    def _notify(self, stage):
+        if self.on_stage is not None:
+            try:
+                self.on_stage(stage)
+            except Exception as e:
+                logger.warning(f"⚠️ {self.name}: stage callback failed for {stage}: {e}")
+
+    def run(self, stage, fn, *args, **kwargs):
+        self._notify(stage)
+        return self._timed(stage, fn, *args, **kwargs)
+
+    async def run_async(self, stage, fn, *args, **kwargs):
+        """run() for a coroutine function, awaited on the calling event loop"""
+        self._notify(stage)
+        return await self._timed_async(stage, fn, *args, **kwargs)
+
+    def has(self, stage):
+        return stage in self._futures
+
+    def result(self, stage, timeout=None):
+        """Wait for a submitted stage; the wait itself is recorded as `<stage>.wait`"""
+        self._notify(stage)
+        started = time.perf_counter()
+        try:
+            return self._futures[stage].result(timeout=timeout)
+        finally:
+            with self._lock:
+                self._timings[f"{stage}.wait"] = round((time.perf_counter() - started) * 1000, 1)
+
+    async def result_async(self, stage):
+        """result() without blocking the event loop or a thread"""
+        self._notify(stage)
+        started = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(self._futures[stage])
+        finally:
+            with self._lock:
+                self._timings[f"{stage}.wait"] = round((time.perf_counter() - started) * 1000, 1)
+
+    def discard(self, stage):
+        future = self._futures.pop(stage, None)
+        return future is not None and future.cancel()
+
+    def timings(self):
+        with self._lock:
+            timings = dict(self._timings)
+        timings["total"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return timings
+
+    def log_timings(self):
+        timings = self.timings()
+        logger.info(f"⏱️ {self.name}: " + ", ".join(f"{k}={v}ms" for k, v in timings.items()))
+        return timings
@@ -0,0 +1,287 @@
+# Per-platform user and chat totals, kept incrementally instead of counted per request
+
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from agents.logger import get_logger  # type: ignore
+from agents.mongo_pool import LazyCollection  # type: ignore
+
+load_dotenv()
+
+logger = get_logger("platform_counters", "logs/platform_counters.log")
+
+# Local increments are pushed to the shared snapshot (and other workers'
+# increments pulled in) this often
+PLATFORM_COUNTERS_FLUSH_SECONDS = float(os.getenv("PLATFORM_COUNTERS_FLUSH_SECONDS", "30"))
+# Full recount from the users/chats collections, to correct any drift
+PLATFORM_COUNTERS_RECONCILE_SECONDS = float(os.getenv("PLATFORM_COUNTERS_RECONCILE_SECONDS", str(24 * 3600)))
+# One process recounts at a time; a crashed recount's lease lapses after this
+PLATFORM_COUNTERS_LEASE_SECONDS = float(os.getenv("PLATFORM_COUNTERS_LEASE_SECONDS", "600"))
+
+PLATFORMS = ("web", "whatsapp", "telegram", "sms")
+KINDS = ("users", "chats")
+SNAPSHOT_ID = "platform_totals"
+LEASE_ID = "platform_totals_reconcile"
+
+counters_col = LazyCollection(os.getenv("USER_DB_NAME"), "platform_counters")
+_users_col = LazyCollection(os.getenv("USER_DB_NAME"), os.getenv("USERS_COLLECTION_NAME", "users"))
+_chats_col = LazyCollection(os.getenv("USER_DB_NAME"), os.getenv("CHATS_COLLECTION_NAME", "chats"))
+
+
+class PlatformCounters:
+    """
+    Totals live in memory and are updated by `incr` as users and chats are
+    inserted or deleted, so reads cost nothing. A background thread adds the
+    local increments to one Mongo snapshot document with `$inc` and reloads
+    it, which keeps several worker processes in step.
+
+    A recount replaces the snapshot and bumps its `generation`, recording
+    when counting started (`counted_at`). Flushes only apply to the
+    generation they were computed against. On a mismatch, increments
+    recorded before `counted_at` are dropped, because the recount already
+    includes them, and the rest are re-applied. Recounts take a lease
+    document, so only one process runs them at a time.
+    """
+
+    def __init__(self, flush_interval=PLATFORM_COUNTERS_FLUSH_SECONDS,
+                 reconcile_interval=PLATFORM_COUNTERS_RECONCILE_SECONDS):
+        self.flush_interval = flush_interval
+        self.reconcile_interval = reconcile_interval
+        self._reset()
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._owner = uuid.uuid4().hex           # this process, for the recount lease
+        self._totals = None                      # kind -> Counter
+        self._events = []                        # (recorded_at, kind, platform, amount) not yet in the snapshot
+        self._generation = None                  # snapshot generation our increments target
+        self._reconciled = None                  # when the snapshot was last recounted
+        self._thread = None
+        self.flushed_at = None
+        self.flushes = 0
+        self.reconciles = 0
+
+    # ---------- writes ----------
+
+    def incr(self, kind, platform, amount=1):
+        if not amount:
+            return
+        platform = platform or "unknown"
+        with self._lock:
+            self._events.append((datetime.utcnow(), kind, platform, amount))
+            if self._totals is not None:
+                self._totals[kind][platform] += amount
+        self._start()
+
+    # ---------- reads ----------
+
+    def totals(self):
+        """{"users": {platform: n}, "chats": {platform: n}}"""
+        if self._totals is None:
+            self._load()
+        self._start()
+        with self._lock:
+            return {kind: dict(self._totals[kind]) for kind in KINDS}
+
+    def stats(self):
+        return {
+            "flushed_at": self.flushed_at,
+            "reconciled_at": self._reconciled.isoformat() if self._reconciled else None,
+            "generation": self._generation,
+            "flushes": self.flushes,
+            "reconciles": self.reconciles,
+            "pending_increments": sum(abs(event[3]) for event in self._events),
+        }
+
+    # ---------- snapshot ----------
+
+    @staticmethod
+    def _sum(events):
+        sums = {kind: Counter() for kind in KINDS}
+        for _, kind, platform, amount in events:
+            sums[kind][platform] += amount
+        return sums
+
+    def _apply_snapshot(self, doc):
+        with self._lock:
+            pending = self._sum(self._events)
+            self._totals = {kind: Counter((doc or {}).get(kind) or {}) for kind in KINDS}
+            for kind in KINDS:
+                self._totals[kind].update(pending[kind])
+            if doc is not None:
+                self._generation = doc.get("generation")
+                self._reconciled = doc.get("reconciled_at")
+
+    def _stale(self, doc):
+        reconciled = (doc or {}).get("reconciled_at")
+        return doc is None or "generation" not in doc or reconciled is None or \
+            (datetime.utcnow() - reconciled).total_seconds() > self.reconcile_interval
+
+    def _load(self):
+        # Concurrent first reads wait for one load instead of each recounting
+        with self._load_lock:
+            if self._totals is not None:
+                return
+            try:
+                doc = counters_col.find_one({"_id": SNAPSHOT_ID})
+            except Exception as e:
+                logger.error(f"❌ Could not load platform counters: {e}")
+                doc = None
+            if self._stale(doc) and self.reconcile():
+                return
+            # Another process is recounting (or Mongo is down): use what there is
+            self._apply_snapshot(doc if doc is not None and "generation" in doc else None)
+
+    def _count(self, collection):
+        pipeline = [{"$group": {"_id": "$platform", "n": {"$sum": 1}}}]
+        return {(row["_id"] or "unknown"): row["n"] for row in collection.aggregate(pipeline)}
+
+    def _take_lease(self):
+        now = datetime.utcnow()
+        try:
+            doc = counters_col.find_one_and_update(
+                {"_id": LEASE_ID, "$or": [{"until": {"$lte": now}}, {"owner": self._owner}]},
+                {"$set": {"owner": self._owner,
+                          "until": now + timedelta(seconds=PLATFORM_COUNTERS_LEASE_SECONDS)}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return False    # held by another process
+        return doc is not None
+
+    def _release_lease(self):
+        try:
+            counters_col.update_one({"_id": LEASE_ID, "owner": self._owner}, {"$set": {"until": datetime.utcnow()}})
+        except Exception as e:
+            logger.error(f"❌ Could not release platform counter lease: {e}")
+
+    def reconcile(self):
+        """
+        Recount both collections (one aggregation each) and replace the
+        snapshot as a new generation. Returns False if another process holds
+        the recount lease or the recount failed.
+        """
+        try:
+            if not self._take_lease():
+                return False
+        except Exception as e:
+            logger.error(f"❌ Platform counter lease failed: {e}")
+            return False
+        try:
+            counted_at = datetime.utcnow()
+            counts = {"users": self._count(_users_col), "chats": self._count(_chats_col)}
+            now = datetime.utcnow()
+            doc = counters_col.find_one_and_update(
+                {"_id": SNAPSHOT_ID},
+                {"$set": {**counts, "counted_at": counted_at, "reconciled_at": now, "updated_at": now},
+                 "$inc": {"generation": 1}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            logger.error(f"❌ Platform counter recount failed: {e}")
+            return False
+        finally:
+            self._release_lease()
+
+        with self._lock:
+            # Our increments from before the count started are in it already
+            self._events = [event for event in self._events if event[0] >= counted_at]
+        self._apply_snapshot(doc)
+        self.reconciles += 1
+        logger.info(f"✅ Platform counters recounted (generation {doc.get('generation')}): {counts}")
+        return True
+
+    def flush(self):
+        """Push local increments to the snapshot and pull in everyone else's"""
+        with self._lock:
+            events, self._events = self._events, []
+        try:
+            doc = self._push(events)
+        except Exception as e:
+            logger.error(f"❌ Platform counter flush failed: {e}")
+            with self._lock:
+                self._events = events + self._events
+            return
+        if doc is None:
+            return
+        self._apply_snapshot(doc)
+        self.flushed_at = datetime.utcnow().isoformat()
+        self.flushes += 1
+        return doc
+
+    def _push(self, events):
+        for _ in range(3):
+            sums = self._sum(events)
+            increments = {f"{kind}.{platform}": n for kind in KINDS for platform, n in sums[kind].items() if n}
+            update = {"$set": {"updated_at": datetime.utcnow()}}
+            if increments:
+                update["$inc"] = increments
+            doc = counters_col.find_one_and_update(
+                {"_id": SNAPSHOT_ID, "generation": self._generation}, update,
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is not None:
+                return doc
+            # A recount replaced the snapshot: drop what it already counted
+            current = counters_col.find_one({"_id": SNAPSHOT_ID})
+            if current is None or "generation" not in current:
+                with self._lock:
+                    self._events = events + self._events
+                return None
+            counted_at = current.get("counted_at") or datetime.min
+            events = [event for event in events if event[0] >= counted_at]
+            self._generation = current.get("generation")
+        raise RuntimeError("snapshot generation kept changing")
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="platform-counters", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            if self._totals is None:
+                # A flush on top of an unloaded snapshot would start from zero
+                self._load()
+                continue
+            doc = self.flush()
+            if doc is not None and self._stale(doc):
+                # Only the process holding the lease actually recounts
+                self.reconcile()
+
+
+platform_counters = PlatformCounters()
+
+
+def _reset_after_fork():
+    # The flush thread does not survive a fork; the child reloads its totals
+    # (and drops the parent's unflushed increments, which the parent owns)
+    platform_counters._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def prometheus_metrics(totals):
+    """The counters in Prometheus text exposition format"""
+    lines = []
+    for kind in KINDS:
+        name = f"ai_selector_{kind}_total"
+        lines.append(f"# HELP {name} Stored {kind} by platform")
+        lines.append(f"# TYPE {name} gauge")
+        for platform in sorted(set(PLATFORMS) | set(totals[kind])):
+            lines.append(f'{name}{{platform="{platform}"}} {totals[kind].get(platform, 0)}')
+    return "\n".join(lines) + "\n"
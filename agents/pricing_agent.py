@@ -1,68 +1,159 @@
-import time
+import os
+import threading
+import httpx
 import openai
 from openai import AzureOpenAI
 from agents.logger import get_logger # type: ignore
+from agents.run_waiter import ( # type: ignore
+    RUN_STREAM_IDLE_TIMEOUT, RUN_TIMEOUT, RunError, RunStreamLost, consume_run_stream, get_run_waiter
+)
+from agents.pricing_index import ( # type: ignore
+    PRICING_CACHE_TTL, extract_model_names, get_pricing_index, parse_pricing_table, split_model_provider
+)
+from agents.schemas import PriceQuote, PricingResult, Recommendation, parse_json_object  # type: ignore
 
 logger = get_logger("pricing_agent", "logs/pricing_agent.log")
 
+# "stream" follows run events as they happen; "poll" uses the shared RunWaiter
+PRICING_RUN_MODE = os.getenv("PRICING_RUN_MODE", "stream").lower()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(azure_api_key, azure_endpoint, api_version):
+    """Reuse one AzureOpenAI client (and its HTTP pool) per credential set"""
+    key = (azure_api_key, azure_endpoint, api_version)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = AzureOpenAI(
+                    api_key=azure_api_key,
+                    azure_endpoint=azure_endpoint,
+                    api_version=api_version
+                )
+                _clients[key] = client
+    return client
+
+
 class PricingAgent:
     def __init__(self, assistant_id, azure_api_key, azure_endpoint, api_version="2024-05-01-preview"):
         self.assistant_id = assistant_id
-        self.client = AzureOpenAI(
-            api_key=azure_api_key,
-            azure_endpoint=azure_endpoint,
-            api_version=api_version
+        self.client = _get_client(azure_api_key, azure_endpoint, api_version)
+
+    def _run_streaming(self, question):
+        stream = self.client.beta.threads.create_and_run(
+            assistant_id=self.assistant_id,
+            thread={"messages": [{"role": "user", "content": question}]},
+            stream=True,
+            # A read that waits longer than this between events fails instead of hanging
+            timeout=httpx.Timeout(RUN_TIMEOUT, read=RUN_STREAM_IDLE_TIMEOUT)
+        )
+        run, response = consume_run_stream(self.client, stream, timeout=RUN_TIMEOUT)
+        return response
+
+    def _run_polling(self, question):
+        run = self.client.beta.threads.create_and_run(
+            assistant_id=self.assistant_id,
+            thread={"messages": [{"role": "user", "content": question}]}
         )
+        return self._await_run(run.thread_id, run.id)
+
+    def _await_run(self, thread_id, run_id, timeout=RUN_TIMEOUT):
+        get_run_waiter(self.client).wait(thread_id, run_id, timeout=timeout).result()
+
+        messages = self.client.beta.threads.messages.list(thread_id=thread_id)
+        response = ""
+        for msg in messages.data:
+            if msg.role == "assistant":
+                response += msg.content[0].text.value
+        return response
 
-    def analyze_pricing(self, model_list):
+    def _parse_quotes(self, response):
+        """Quotes from the assistant's JSON reply, or from a markdown table if it sent one"""
+        data = parse_json_object(response) or {}
+        rows = data.get("prices") if isinstance(data.get("prices"), list) else None
+        if rows is None:
+            rows = parse_pricing_table(response)
+        quotes = [PriceQuote.from_dict({**row, "source": "assistant"}) for row in rows if isinstance(row, dict)]
+        return [q for q in quotes if q.model and q.price]
+
+    def analyze_pricing(self, model_list) -> PricingResult:
         logger.info("===== Step 3: Pricing Analysis Started =====")
+        if isinstance(model_list, Recommendation):
+            # Provider in parentheses lets the index tell cloud-specific prices apart
+            model_names = [f"{m.name} ({m.cloud})" if m.cloud else m.name for m in model_list.models]
+        else:
+            model_names = extract_model_names(model_list)
         logger.info("Received model list for pricing:")
-        for model in model_list:
+        for model in model_names:
             logger.info(f"   - {model}")
 
+        # Answer what we can from the local index; only misses go to the assistant
+        index = get_pricing_index()
+        known, missing = [], []
+        for model in model_names:
+            entry = index.lookup(*split_model_provider(model))
+            if entry:
+                known.append(PriceQuote.from_dict(entry))
+            else:
+                missing.append(model)
+        logger.info(f"Pricing index: {len(known)} hit(s), {len(missing)} miss(es)")
+
+        if not missing:
+            result = PricingResult(known)
+            logger.info("\nIndexed Pricing Response:\n" + result.to_table())
+            return result
+
+        # The assistant's file_search tool can't be combined with JSON mode,
+        # so the format is requested in the prompt and parsed leniently
         question = (
             "Here is a list of shortlisted AI models:\n\n"
-            + "\n".join(f"- {model}" for model in model_list) +
+            + "\n".join(f"- {model}" for model in missing) +
             "\n\nFor each model, check the uploaded file for pricing. "
             "If the file has pricing info, use it. If not, estimate the price based on your knowledge.\n"
-            "Return the response as a table in this format:\n\n"
-            "| Model | Estimated Price | Price Unit | Provider | Region |\n"
-            "|-------|------------------|------------|----------|--------|"
+            "Reply only with a JSON object in this format:\n"
+            '{"prices": [{"model": "<name>", "price": "<estimated price>", "unit": "<price unit>", '
+            '"provider": "<provider>", "region": "<region>"}]}'
         )
 
         logger.info("Asking assistant: %s", question)
 
-        # Create thread
-        thread = self.client.beta.threads.create()
-
-        # Post message
-        self.client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=question
-        )
-
-        # Run assistant
-        run = self.client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=self.assistant_id
-        )
-
         # Wait for assistant response
         logger.info("Waiting for assistant response...")
-        while run.status not in ["completed", "failed"]:
-            time.sleep(2)
-            run = self.client.beta.threads.runs.retrieve(
-                thread_id=thread.id,
-                run_id=run.id
+        try:
+            if PRICING_RUN_MODE == "stream":
+                try:
+                    response = self._run_streaming(question)
+                except RunStreamLost as e:
+                    # The run exists; wait for it rather than starting a second one
+                    logger.warning(f"⚠️ {e}; polling run {e.run.id} instead.")
+                    response = self._await_run(e.run.thread_id, e.run.id, timeout=e.remaining)
+                except RunError:
+                    raise
+                except openai.APIError as e:
+                    # Endpoints without run streaming: fall back to polling
+                    logger.warning(f"⚠️ Run streaming unavailable ({e}); polling instead.")
+                    response = self._run_polling(question)
+            else:
+                response = self._run_polling(question)
+        except Exception as e:
+            logger.error(f"Pricing run failed: {e}")
+            return PricingResult(
+                known, note="Pricing details are currently unavailable; estimate prices from your own knowledge."
             )
 
-        # Get assistant response
-        messages = self.client.beta.threads.messages.list(thread_id=thread.id)
-        response = ""
-        for msg in messages.data:
-            if msg.role == "assistant":
-                response += msg.content[0].text.value
-
         logger.info("\nAssistant Pricing Response:\n" + response)
-        return response
+
+        # Remember the assistant's answers so the next turn is served locally
+        learned = self._parse_quotes(response)
+        for quote in learned:
+            index.put(quote.model, quote.price, quote.unit, quote.provider, quote.region,
+                      source="assistant", ttl=PRICING_CACHE_TTL)
+
+        if not learned:
+            logger.warning("⚠️ Could not read prices from the assistant response.")
+            return PricingResult(known, note=response.strip())
+        return PricingResult(known + learned)
@@ -0,0 +1,239 @@
+# In-memory pricing index so known models never need an Assistants API run
+
+import csv
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+from agents.logger import get_logger  # type: ignore
+
+logger = get_logger("pricing_index", "logs/pricing_index.log")
+
+# Comma-separated files or directories holding CSV/XLSX/JSON price sheets
+PRICING_SHEETS = os.getenv("PRICING_SHEETS", "pricing")
+# Lifetime of prices learned from the assistant (sheet prices never expire)
+PRICING_CACHE_TTL = float(os.getenv("PRICING_CACHE_TTL", str(7 * 24 * 3600)))
+
+PRICE_COLUMNS = ["Model", "Estimated Price", "Price Unit", "Provider", "Region"]
+
+_COLUMN_ALIASES = {
+    "model": "model", "model name": "model", "model_name": "model", "name": "model",
+    "price": "price", "estimated price": "price", "cost": "price", "pricing": "price",
+    "unit": "unit", "price unit": "unit", "price_unit": "unit",
+    "provider": "provider", "cloud": "provider", "vendor": "provider",
+    "region": "region",
+}
+
+_PROVIDER_ALIASES = {
+    "azure openai": "azure", "microsoft azure": "azure", "microsoft": "azure",
+    "google cloud": "gcp", "google": "gcp", "vertex ai": "gcp", "google cloud platform": "gcp",
+    "amazon": "aws", "amazon web services": "aws", "aws bedrock": "aws", "bedrock": "aws",
+}
+
+
+def normalize_model_name(name):
+    """'**Command R+ (AWS)**' -> 'command r+'"""
+    name = str(name or "").lower().replace("*", "")
+    name = re.sub(r"\(.*?\)", " ", name)
+    name = re.sub(r"[^a-z0-9+.]+", " ", name)
+    return " ".join(name.split())
+
+
+def normalize_provider(provider):
+    provider = " ".join(str(provider or "").lower().split())
+    return _PROVIDER_ALIASES.get(provider, provider)
+
+
+def split_model_provider(name):
+    """Pull a trailing '(Provider)' out of a model name, if present"""
+    match = re.search(r"\(([^)]+)\)\s*$", str(name or ""))
+    return (name, match.group(1)) if match else (name, None)
+
+
+def extract_model_names(model_list):
+    """Model names from a recommender bullet list string or an iterable of names"""
+    if isinstance(model_list, str):
+        names = []
+        for line in model_list.splitlines():
+            match = re.match(r"\s*(?:[-*•]|\d+\.)\s+(.+)", line)
+            if not match:
+                continue
+            name = match.group(1).replace("**", "").split(":")[0].strip()
+            if name and name.lower() not in [n.lower() for n in names]:
+                names.append(name)
+        return names
+    return [str(m) for m in (model_list or []) if str(m).strip()]
+
+
+def parse_pricing_table(text):
+    """Rows of a markdown table in the PRICE_COLUMNS layout, as dicts"""
+    rows = []
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line.startswith("|"):
+            continue
+        cells = [c.strip() for c in line.strip("|").split("|")]
+        if len(cells) < 2 or set("".join(cells)) <= set("-: "):
+            continue
+        if cells[0].lower() == "model":
+            continue
+        cells += [""] * (len(PRICE_COLUMNS) - len(cells))
+        rows.append({"model": cells[0], "price": cells[1], "unit": cells[2],
+                     "provider": cells[3], "region": cells[4]})
+    return rows
+
+
+def format_pricing_table(entries):
+    lines = [
+        "| " + " | ".join(PRICE_COLUMNS) + " |",
+        "|-------|------------------|------------|----------|--------|",
+    ]
+    for e in entries:
+        lines.append(f"| {e['model']} | {e['price']} | {e['unit']} | {e['provider']} | {e['region']} |")
+    return "\n".join(lines)
+
+
+class PricingIndex:
+    """
+    Prices keyed by (normalized model name, normalized provider).
+
+    A second map from name alone lets callers that don't know the provider
+    still get an O(1) hit; a caller that names a provider never gets another
+    provider's price (a price listed without one still applies). Entries learned at runtime carry an expiry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._by_name = {}
+
+    def __len__(self):
+        return len(self._by_key)
+
+    def put(self, model, price, unit="", provider="", region="", source="sheet", ttl=None):
+        name = normalize_model_name(model)
+        if not name or not str(price).strip():
+            return
+        key = (name, normalize_provider(provider))
+        entry = {
+            "model": str(model).replace("**", "").strip(),
+            "price": str(price).strip(),
+            "unit": str(unit or "").strip(),
+            "provider": str(provider or "").strip(),
+            "region": str(region or "").strip(),
+            "source": source,
+            "expires_at": time.time() + ttl if ttl else None,
+        }
+        with self._lock:
+            self._by_key[key] = entry
+            self._by_name[name] = key
+
+    def lookup(self, model, provider=None):
+        """
+        The entry for `model` from `provider`, or a price listed without a
+        provider. Only when no provider is given does any provider's price
+        for the model do.
+        """
+        name = normalize_model_name(model)
+        if provider:
+            keys = [(name, normalize_provider(provider)), (name, "")]
+        else:
+            keys = [self._by_name.get(name)]
+        for key in keys:
+            entry = self._by_key.get(key) if key else None
+            if entry and entry["expires_at"] and entry["expires_at"] < time.time():
+                self._expire(key)
+                entry = self._by_key.get(self._by_name.get(name)) if not provider else None
+            if entry:
+                return entry
+        return None
+
+    def _expire(self, key):
+        """Drop an expired entry; its name points to another provider's entry if one is left"""
+        name = key[0]
+        with self._lock:
+            self._by_key.pop(key, None)
+            if self._by_name.get(name) == key:
+                others = [other for other in self._by_key if other[0] == name]
+                if others:
+                    self._by_name[name] = others[-1]
+                else:
+                    del self._by_name[name]
+
+    # ---------- loading ----------
+
+    def _put_row(self, row, source):
+        fields = {}
+        for column, value in row.items():
+            field = _COLUMN_ALIASES.get(str(column).strip().lower())
+            if field and value is not None and str(value).strip() not in ("", "nan"):
+                fields.setdefault(field, value)
+        if "model" in fields and "price" in fields:
+            self.put(source=source, **fields)
+            return True
+        return False
+
+    def load_file(self, path):
+        ext = os.path.splitext(path)[-1].lower()
+        try:
+            if ext == ".csv":
+                with open(path, newline="", encoding="utf-8") as f:
+                    rows = list(csv.DictReader(f))
+            elif ext in (".xlsx", ".xls"):
+                import pandas as pd
+                rows = pd.read_excel(path).to_dict(orient="records")
+            elif ext == ".json":
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                rows = data if isinstance(data, list) else data.get("models", [])
+            else:
+                return 0
+        except Exception as e:
+            logger.error(f"❌ Could not read price sheet {path}: {e}")
+            return 0
+
+        loaded = sum(1 for row in rows if isinstance(row, dict) and self._put_row(row, os.path.basename(path)))
+        logger.info(f"✅ Loaded {loaded} prices from {path}")
+        return loaded
+
+    def load_catalog(self, models):
+        """Seed from catalog documents that carry a `pricing` field"""
+        loaded = 0
+        for model in models:
+            if model.get("pricing") and model.get("model_name"):
+                self.put(model["model_name"], model["pricing"], model.get("price_unit", ""),
+                         model.get("cloud", ""), model.get("region", ""), source="catalog")
+                loaded += 1
+        logger.info(f"✅ Loaded {loaded} prices from the model catalog")
+        return loaded
+
+    def load_sheets(self, sources=PRICING_SHEETS):
+        for source in [s.strip() for s in sources.split(",") if s.strip()]:
+            paths = sorted(glob.glob(os.path.join(source, "*"))) if os.path.isdir(source) else [source]
+            for path in paths:
+                if os.path.isfile(path):
+                    self.load_file(path)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_pricing_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = PricingIndex()
+                try:
+                    from agents.model_catalog import get_model_catalog  # type: ignore
+                    index.load_catalog(get_model_catalog().snapshot())
+                except Exception as e:
+                    logger.warning(f"⚠️ Catalog prices unavailable: {e}")
+                # Sheets are loaded last so they override catalog prices
+                index.load_sheets()
+                _index = index
+    return _index
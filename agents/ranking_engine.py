@@ -0,0 +1,207 @@
+# Deterministic, vectorized pre-scoring of catalog models for a requirement
+
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from agents.logger import get_logger  # type: ignore
+from agents.catalog_index import get_catalog_index, parse_accuracy, parse_speed, normalize_value  # type: ignore
+from agents.catalog_search import get_bm25_index, expand_query  # type: ignore
+from agents.pricing_index import get_pricing_index  # type: ignore
+
+logger = get_logger("ranking_engine", "logs/ranking_engine.log")
+
+# Base weights of the score terms; the requirement text shifts them (see requirement_weights)
+RANKING_WEIGHTS = {
+    "relevance": float(os.getenv("RANKING_WEIGHT_RELEVANCE", "0.5")),
+    "accuracy": float(os.getenv("RANKING_WEIGHT_ACCURACY", "0.25")),
+    "speed": float(os.getenv("RANKING_WEIGHT_SPEED", "0.15")),
+    "price": float(os.getenv("RANKING_WEIGHT_PRICE", "0.1")),
+}
+# Prices come from the pricing index, which changes independently of the catalog
+RANKING_REFRESH_SECONDS = float(os.getenv("RANKING_REFRESH_SECONDS", "600"))
+# Added to the score of models matching a cloud or region the requirement
+# mentions without making it a constraint
+RANKING_MENTION_BOOST = float(os.getenv("RANKING_MENTION_BOOST", "0.15"))
+
+FEATURES = ("relevance", "accuracy", "speed", "price")
+
+# Requirement phrases that make one attribute matter more
+_EMPHASIS = {
+    "accuracy": re.compile(r"\b(?:accura\w*|precis\w*|reliab\w*|correct\w*|critical|medical|legal|financ\w*|quality)\b"),
+    "speed": re.compile(r"\b(?:fast\w*|quick\w*|real[- ]?time|low[- ]latency|latency|instant\w*|speed|live|stream\w*)\b"),
+    "price": re.compile(r"\b(?:cheap\w*|budget|low[- ]cost|cost\w*|afford\w*|inexpensive|price|pricing|free|startup|scale)\b"),
+}
+
+
+# Only these phrasings turn a cloud or region into a hard filter: "deployed in
+# Azure", "must run on AWS", "only on GCP". A plain mention ("better than
+# Azure's OCR") just boosts matching models.
+_CONSTRAINT_LEAD = (
+    r"(?:(?:deployed|hosted)\s+(?:only\s+)?(?:in|on|to)"
+    r"|(?:must|has to|have to|needs? to|should)\s+(?:run|be deployed|be hosted|stay|be)\s+(?:only\s+)?(?:in|on|within)"
+    r"|only\s+(?:in|on)|restricted to|limited to)"
+    r"\s+(?:the\s+)?(?:[\w-]+\s+){0,2}?"
+)
+# "under $5", "below $0.50", "max $10", "no more than $2"
+_PRICE_LIMIT = re.compile(r"(?:under|below|less than|at most|max(?:imum)?|no more than|cheaper than|within)\s*\$\s*(\d+(?:\.\d+)?)")
+
+
+def constrained(text, value):
+    """True if `value` follows one of the explicit constraint phrasings in normalized `text`"""
+    return re.search(_CONSTRAINT_LEAD + re.escape(value) + r"(?![\w-])", text) is not None
+
+
+def requirement_weights(requirement, base=None):
+    """Base weights, doubled for every attribute the requirement emphasises, normalized to sum 1"""
+    weights = dict(base or RANKING_WEIGHTS)
+    text = normalize_value(requirement)
+    for feature, pattern in _EMPHASIS.items():
+        if pattern.search(text):
+            weights[feature] *= 2
+    total = sum(weights.values()) or 1.0
+    return np.array([weights[f] / total for f in FEATURES])
+
+
+def parse_price(entry):
+    """Comparable price (per 1K units where the unit says so) from a pricing entry"""
+    if not entry:
+        return None
+    match = re.search(r"(\d+(?:\.\d+)?)", entry.get("price", "").replace(",", ""))
+    if not match:
+        return None
+    price = float(match.group(1))
+    unit = f"{entry.get('price', '')} {entry.get('unit', '')}".lower()
+    if re.search(r"\b(?:1m|1,000,000|million)\b", unit):
+        price /= 1000
+    return price
+
+
+def _scale(column, higher_is_better=True):
+    """Min-max scale to [0, 1] with 1 = best; missing values score 0.5"""
+    scaled = np.full(column.shape, 0.5)
+    known = ~np.isnan(column)
+    if known.any():
+        low, high = column[known].min(), column[known].max()
+        if high > low:
+            scaled[known] = (column[known] - low) / (high - low)
+            if not higher_is_better:
+                scaled[known] = 1 - scaled[known]
+        else:
+            scaled[known] = 1.0
+    return scaled
+
+
+class RankingEngine:
+    """
+    Attribute matrix of one catalog snapshot: accuracy, speed (log-latency,
+    lower is better) and price, each scaled to [0, 1]. Ranking a requirement
+    adds its BM25 relevance column and takes a weighted sum. Explicit
+    constraints ("deployed in Azure", "accuracy > 95%", "under $5") are hard
+    filters; a cloud or region that is only mentioned boosts the models
+    that match it.
+    """
+
+    def __init__(self, models):
+        self.models = models
+        self.names = [m.get("model_name") or m.get("name") or "Unknown" for m in models]
+        pricing = get_pricing_index()
+
+        accuracy = np.array([parse_accuracy(m.get("accuracy")) for m in models], dtype=float)
+        speed = np.array([parse_speed(m.get("speed")) for m in models], dtype=float)
+        price = np.array(
+            [parse_price(pricing.lookup(name, m.get("cloud"))) for name, m in zip(self.names, models)],
+            dtype=float,
+        )
+        log_speed = np.log1p(speed)
+
+        self.accuracy = accuracy
+        self.speed = speed
+        self.price = price
+        self.attributes = np.column_stack([
+            _scale(accuracy),
+            _scale(log_speed, higher_is_better=False),
+            _scale(price, higher_is_better=False),
+        ]) if models else np.empty((0, 3))
+        self.built_at = time.time()
+
+    def _filter_mask(self, requirement):
+        """(mask of models passing the hard filters, boost per model, filters applied)"""
+        mask = np.ones(len(self.models), dtype=bool)
+        boost = np.zeros(len(self.models))
+        text = normalize_value(requirement)
+        # Task types only steer relevance
+        parsed = {k: v for k, v in get_catalog_index().parse_query(requirement).items() if k != "type"}
+
+        # Accuracy and latency limits are always stated as comparisons, so they are explicit
+        hard = {k: v for k, v in parsed.items() if k not in ("cloud", "region")}
+        for field in ("cloud", "region"):
+            values = parsed.get(field) or []
+            required = [v for v in values if constrained(text, v)]
+            if required:
+                hard[field] = required
+            mentioned = [v for v in values if v not in required]
+            if mentioned:
+                allowed = {id(m) for m in get_catalog_index().query(**{field: mentioned})}
+                boost += RANKING_MENTION_BOOST * np.array([id(m) in allowed for m in self.models], dtype=float)
+
+        matched = mask.copy()
+        if hard:
+            allowed = {id(m) for m in get_catalog_index().query(**hard)}
+            matched &= np.array([id(m) in allowed for m in self.models], dtype=bool)
+        price_limit = _PRICE_LIMIT.search(text)
+        if price_limit:
+            hard["max_price"] = float(price_limit.group(1))
+            # Models without a known price are kept
+            matched &= ~(self.price > hard["max_price"])
+        if not hard:
+            return mask, boost, hard
+        # A filter that excludes everything is more likely a misparse than a real constraint
+        return (matched if matched.any() else mask), boost, hard
+
+    def rank(self, requirement, top_n=5, exclude=(), weights=None):
+        """[(model, score, {feature: value})] best first, deterministic for equal input"""
+        if not self.models:
+            return []
+        bm25 = get_bm25_index(self.models)
+        relevance = np.array(bm25.scores(expand_query(requirement)), dtype=float)
+        relevance = relevance / relevance.max() if relevance.max() > 0 else relevance
+
+        features = np.column_stack([relevance, self.attributes])
+        weights = requirement_weights(requirement) if weights is None else weights
+        mask, boost, filters = self._filter_mask(requirement)
+        scores = features @ weights + boost
+
+        excluded = {normalize_value(name) for name in exclude if name}
+        if excluded:
+            mask &= np.array([normalize_value(n) not in excluded for n in self.names], dtype=bool)
+        scores = np.where(mask, scores, -np.inf)
+
+        # Stable order: score, then catalog position
+        order = np.argsort(-scores, kind="stable")[:top_n]
+        order = [i for i in order if np.isfinite(scores[i])]
+        logger.info(
+            f"📊 Ranked {int(mask.sum())} of {len(self.models)} models "
+            f"(weights {dict(zip(FEATURES, np.round(weights, 2)))}, filters {filters})"
+        )
+        return [
+            (self.models[i], float(scores[i]), dict(zip(FEATURES, np.round(features[i], 3))))
+            for i in order
+        ]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_ranking_engine(models):
+    """Engine for a catalog snapshot, rebuilt when the snapshot or prices may have changed"""
+    global _engine
+    with _engine_lock:
+        if (_engine is None or _engine.models is not models
+                or time.time() - _engine.built_at > RANKING_REFRESH_SECONDS):
+            _engine = RankingEngine(models)
+        return _engine
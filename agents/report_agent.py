@@ -1,7 +1,11 @@
+import asyncio
 import json
 from openai import AzureOpenAI  # or from openai import OpenAI if not using Azure
 from agents.logger import get_logger  # type: ignore
-from pymongo import MongoClient
+from agents.mongo_pool import LazyCollection  # type: ignore
+from agents.catalog_index import get_catalog_index, parse_accuracy  # type: ignore
+from agents.pricing_index import normalize_model_name  # type: ignore
+from agents.schemas import REPORT_FIELDS, FinalReport, parse_json_object  # type: ignore
 import os
 from dotenv import load_dotenv
 import re
@@ -10,106 +14,282 @@ logger = get_logger("report_agent", "logs/report_agent.log")
 
 # Load MongoDB credentials
 load_dotenv()
-mongo_client = MongoClient(os.getenv("MONGO_URI"))
-user_db = mongo_client[os.getenv("USER_DB_NAME")]
-model_col = user_db["models"]
-final_model_col = user_db["final_models"]
+user_db_name = os.getenv("USER_DB_NAME")
+final_model_col = LazyCollection(user_db_name, "final_models")
+
+
+# "4. Accuracy : 98.7 %" in a streamed plain-text report
+_REPORT_LINE = re.compile(r"^\s*(\d+)\s*[.)]\s*([^:]*?)\s*:\s*(.*?)\s*$")
+_FIELD_BY_LABEL = {label.strip().lower(): name for name, label in REPORT_FIELDS}
 
 
 class ReportAgent:
-    def __init__(self, gpt_client):
+    def __init__(self, gpt_client, async_client=None):
         self.client = gpt_client
+        # AsyncAzureOpenAI, for generate_report_async
+        self.async_client = async_client
         logger.info("Report Agent initialized using GPT directly (no assistant)")
 
-    def generate_report(self, username, analyzed_input, recommended_models, pricing_table):
-        logger.info("Sending all inputs to GPT for final analysis...")
+    def _report_input(self, recommended, pricing):
+        """Compact JSON of the shortlist: only the fields the report needs, with prices merged in"""
+        candidates = []
+        for model in recommended.models:
+            quote = pricing.quote_for(model.name)
+            candidate = {
+                "name": model.name, "type": model.type, "accuracy": model.accuracy, "speed": model.speed,
+                "cloud": model.cloud, "region": model.region, "reason": model.reason,
+                "price": quote.price if quote else "", "price_unit": quote.unit if quote else "",
+            }
+            candidates.append({k: v for k, v in candidate.items() if v})
+        data = {"candidates": candidates}
+        if pricing.note:
+            data["pricing_note"] = pricing.note
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    def _report_messages(self, analyzed_input, recommended, pricing, json_output=False):
+        if json_output:
+            output_format = (
+                "Output Format (a JSON object with exactly these keys):\n"
+                '{"model_name": "<model_name>", "price": "<price with unit>", '
+                '"speed": "<speed - always write something, even if approximate or inferred>", '
+                '"accuracy": "<percentage, e.g. 98.7 %>", "cloud": "<cloud provider>", '
+                '"region": "<region or deployment area>", '
+                '"reason": "<Short one-liner reason showing why this model fits best>"}\n\n'
+            )
+            style = "- model_name must be one of the candidate names, exactly as given.\n"
+            system = "You are a smart assistant helping select the best AI model. You reply in JSON."
+        else:
+            output_format = (
+                "Output Format (strictly follow this format):\n\n"
+                "Final Best Model Recommended:\n"
+                "1. Model Name      : <model_name>\n"
+                "2. Price           : <price with unit>\n"
+                "3. Speed           : <speed - always write something, even if approximate or inferred>\n"
+                "4. Accuracy        : <convert to percentage if decimal (e.g., 0.987 → 98.7 %)>\n"
+                "5. Cloud           : <cloud provider>\n"
+                "6. Region          : <region or deployment area>\n"
+                "7. Reason for Selection : <Short one-liner reason showing why this model fits best>\n\n"
+            )
+            style = (
+                "- Format should be beautiful and consistent, no markdown, no bullets, no emojis.\n"
+                "- Maintain equal spacing after colons for clean readability.\n"
+            )
+            system = (
+                "You are a smart assistant helping select the best AI model "
+                "with a professional, plain-text report. Ensure speed is filled, "
+                "accuracy is shown as %, and output is beautifully aligned."
+            )
 
         prompt = (
             "You are an expert AI model selector.\n\n"
             f"1. Analyzed user requirement:\n{analyzed_input}\n\n"
-            f"2. Recommended models:\n{recommended_models}\n\n"
-            f"3. Pricing details of shortlisted models:\n{pricing_table}\n\n"
+            f"2. Shortlisted models with pricing (JSON):\n{self._report_input(recommended, pricing)}\n\n"
             "Step 2: Your task is to select the best model using logic.\n\n"
-            "Output Format (strictly follow this format):\n\n"
-            "Final Best Model Recommended:\n"
-            "1. Model Name      : <model_name>\n"
-            "2. Price           : <price with unit>\n"
-            "3. Speed           : <speed - always write something, even if approximate or inferred>\n"
-            "4. Accuracy        : <convert to percentage if decimal (e.g., 0.987 → 98.7 %)>\n"
-            "5. Cloud           : <cloud provider>\n"
-            "6. Region          : <region or deployment area>\n"
-            "7. Reason for Selection : <Short one-liner reason showing why this model fits best>\n\n"
+            + output_format +
             "Rules:\n"
             "- NEVER write \"Not specified\" for Speed or Accuracy.\n"
             "- If Speed or Accuracy is missing, use best assumption or guess based on other fields.\n"
-            "- Format should be beautiful and consistent, no markdown, no bullets, no emojis.\n"
-            "- Maintain equal spacing after colons for clean readability.\n"
+            + style +
             "- The reason must be short and clearly reflect accuracy/speed/user goal.\n"
             "- Do not recommend the same model again and again across different inputs.\n"
             "- Consider diverse strengths of other models if multiple meet requirements."
         )
 
+        return [
+            {
+                "role": "system",
+                "content": system
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+
+    def _candidate(self, model_name, recommended):
+        wanted = normalize_model_name(model_name)
+        candidate = next((m for m in recommended.models if normalize_model_name(m.name) == wanted), None)
+        if candidate is None:
+            logger.warning(f"Report picked a model outside the shortlist: {model_name}")
+        return candidate
+
+    def _complete_field(self, report, name, candidate, pricing):
+        """One field as _complete_report leaves it (model_name must be completed first)"""
+        value = getattr(report, name)
+        if name == "model_name" and candidate is not None:
+            value = candidate.name
+        elif name in ("speed", "accuracy", "cloud", "region") and candidate is not None:
+            value = value or getattr(candidate, name)
+        elif name == "price" and not value:
+            quote = pricing.quote_for(report.model_name)
+            value = f"{quote.price} {quote.unit}".strip() if quote else value
+        if name == "accuracy":
+            accuracy = parse_accuracy(value)
+            if accuracy is not None:
+                value = f"{round(accuracy, 2):g} %"
+        setattr(report, name, value)
+
+    def _complete_report(self, report, recommended, pricing):
+        """Fill fields GPT left blank from the chosen candidate and its quote; accuracy as a percentage"""
+        candidate = self._candidate(report.model_name, recommended)
+        for name, _ in REPORT_FIELDS:
+            self._complete_field(report, name, candidate, pricing)
+        return report
+
+    def generate_report(self, username, analyzed_input, recommended, pricing):
+        """The selected model as a FinalReport, or None if GPT could not produce one"""
+        logger.info("Sending all inputs to GPT for final analysis...")
+
         try:
             completion = self.client.chat.completions.create(
+                **self._report_request(analyzed_input, recommended, pricing)
+            )
+            report = self._parse_report(completion, recommended, pricing)
+            self.save_final_model(username, analyzed_input, report.model_name)
+            return report
+
+        except Exception as e:
+            logger.error(f"Error generating report: {e}")
+            return None
+
+    async def generate_report_async(self, username, analyzed_input, recommended, pricing):
+        """generate_report awaiting the async client; the final model is saved off the event loop"""
+        logger.info("Sending all inputs to GPT for final analysis...")
+
+        try:
+            completion = await self.async_client.chat.completions.create(
+                **self._report_request(analyzed_input, recommended, pricing)
+            )
+            report = self._parse_report(completion, recommended, pricing)
+            await asyncio.to_thread(self.save_final_model, username, analyzed_input, report.model_name)
+            return report
+
+        except Exception as e:
+            logger.error(f"Error generating report: {e}")
+            return None
+
+    def _report_request(self, analyzed_input, recommended, pricing):
+        return {
+            "model": "gpt-4o",
+            "messages": self._report_messages(analyzed_input, recommended, pricing, json_output=True),
+            "temperature": 0.4,
+            "max_tokens": 800,
+            "response_format": {"type": "json_object"},
+        }
+
+    def _parse_report(self, completion, recommended, pricing):
+        data = parse_json_object(completion.choices[0].message.content)
+        if data is None:
+            raise ValueError("response was not a JSON object")
+        report = self._complete_report(FinalReport.from_dict(data), recommended, pricing)
+        logger.info("GPT response generated successfully.")
+        print(report.to_text())
+        return report
+
+    def stream_report(self, username, analyzed_input, recommended, pricing, on_complete=None):
+        """
+        The report as a generator of text chunks, one per report line as soon
+        as GPT has finished it. Each line goes through the same completion as
+        generate_report and is laid out like FinalReport.to_text(), so the
+        streamed text matches the blocking endpoint's. The final model is
+        saved (and `on_complete(report_text, final_model)` called) once the
+        whole report has arrived.
+        """
+        logger.info("Streaming final analysis from GPT...")
+        report = FinalReport(model_name="UNKNOWN")
+        state = {"candidate": None, "seen": set(), "sent": 0}
+
+        def take(line):
+            match = _REPORT_LINE.match(line)
+            if not match:
+                return
+            number, label, value = match.groups()
+            name = _FIELD_BY_LABEL.get(label.lower())
+            if name is None and 1 <= int(number) <= len(REPORT_FIELDS):
+                name = REPORT_FIELDS[int(number) - 1][0]
+            if name is not None and name not in state["seen"]:
+                setattr(report, name, value)
+                state["seen"].add(name)
+
+        def ready(finished=False):
+            """Lines of the fields known so far, in to_text() order; all of them once finished"""
+            while state["sent"] < len(REPORT_FIELDS):
+                name, label = REPORT_FIELDS[state["sent"]]
+                if name not in state["seen"] and not finished:
+                    return
+                if name == "model_name" and name in state["seen"]:
+                    state["candidate"] = self._candidate(report.model_name, recommended)
+                self._complete_field(report, name, state["candidate"], pricing)
+                head = "Final Best Model Recommended:\n" if state["sent"] == 0 else "\n"
+                state["sent"] += 1
+                yield f"{head}{state['sent']}. {label}: {getattr(report, name) or 'Not available'}"
+
+        buffer = ""
+
+        try:
+            stream = self.client.chat.completions.create(
                 model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": (
-                            "You are a smart assistant helping select the best AI model "
-                            "with a professional, plain-text report. Ensure speed is filled, "
-                            "accuracy is shown as %, and output is beautifully aligned."
-                        )
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
+                messages=self._report_messages(analyzed_input, recommended, pricing),
                 temperature=0.4,
-                max_tokens=800
+                max_tokens=800,
+                stream=True
             )
 
-            result = completion.choices[0].message.content.strip()
-            logger.info("GPT response generated successfully.")
-            print(result)
-
-            # Extract model name
-            import re
-            match = re.search(r"Model Name\s*:\s*(.+)", result)
-            final_model = match.group(1).strip() if match else "UNKNOWN"
-
-            # Store to MongoDB
-            try:
-                final_model_col.update_one(
-                    {"email": username},
-                    {
-                        "$set": {
-                            "email": username,
-                            "analyzed_input": analyzed_input,
-                            "final_model": final_model
-                        }
-                    },
-                    upsert=True
-                )
-                print("📨 Inside report agent - saving for:", username)
-
-                logger.info(f"Stored final recommendation for user {username}: {final_model}")
-            except Exception as db_err:
-                logger.error(f"Error saving final model to DB: {db_err}")
-
-            return result
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                buffer += delta
+                *lines, buffer = buffer.split("\n")
+                for line in lines:
+                    take(line)
+                yield from ready()
+            take(buffer)
 
         except Exception as e:
-            logger.error(f"Error generating report: {e}")
-            return f"Error generating report: {e}"
+            logger.error(f"Error streaming report: {e}")
+            yield (f"Error generating report: {e}" if not state["sent"]
+                   else "\n\n⚠️ The report was interrupted. Please try again.")
+            return
+
+        if not state["seen"]:
+            logger.error("Streamed report had none of the expected fields.")
+            yield "Error generating report: the response was not in the report format"
+            return
+        # Fields GPT left out are completed and listed as in to_text()
+        yield from ready(finished=True)
+        logger.info("GPT response streamed successfully.")
+
+        final_model = report.model_name
+        self.save_final_model(username, analyzed_input, final_model)
+        if on_complete:
+            on_complete(report.to_text(), final_model)
+
+
+    def save_final_model(self, username, analyzed_input, final_model):
+        try:
+            final_model_col.update_one(
+                {"email": username},
+                {
+                    "$set": {
+                        "email": username,
+                        "analyzed_input": analyzed_input,
+                        "final_model": final_model
+                    }
+                },
+                upsert=True
+            )
+            print("📨 Inside report agent - saving for:", username)
 
+            logger.info(f"Stored final recommendation for user {username}: {final_model}")
+        except Exception as db_err:
+            logger.error(f"Error saving final model to DB: {db_err}")
 
     def get_model_info(self, model_name: str):
         try:
-            doc = model_col.find_one({"model_name": model_name})
+            doc = get_catalog_index().get(model_name)
             if not doc:
-                logger.warning(f"No document found in MongoDB for model: {model_name}")
+                logger.warning(f"No catalog entry for model: {model_name}")
                 return f"No information found for model: {model_name}"
 
             info = (
@@ -1,13 +1,28 @@
 import os
-import pymongo
 from dotenv import load_dotenv
 from agents.logger import get_logger # type: ignore
+from agents.model_catalog import get_model_catalog  # type: ignore
+from agents.mongo_pool import LazyCollection  # type: ignore
+from agents.catalog_search import (  # type: ignore
+    RECOMMENDER_TOP_K, RECOMMENDER_CATALOG_TOKEN_BUDGET,
+    get_bm25_index, fit_to_budget, count_message_tokens
+)
+from agents.ranking_engine import get_ranking_engine  # type: ignore
+from agents.pricing_index import extract_model_names, normalize_model_name  # type: ignore
+from agents.schemas import ModelCandidate, Recommendation, parse_json_object  # type: ignore
 
 # Load environment variables from .env file
 load_dotenv()
 
 logger = get_logger("recommender_agent", "logs/recommender_agent.log")
-final_model_col = pymongo.MongoClient(os.getenv("MONGO_URI"))[os.getenv("USER_DB_NAME")]["final_models"]
+final_model_col = LazyCollection(os.getenv("USER_DB_NAME"), "final_models")
+
+# "llm": gpt-4o picks from the pre-filtered catalog; "local": the ranking engine
+# alone; "hybrid": gpt-4o re-ranks and explains the engine's top candidates
+RECOMMENDER_MODE = os.getenv("RECOMMENDER_MODE", "hybrid").lower()
+# Models in a local shortlist, and candidates handed to gpt-4o in hybrid mode
+RECOMMENDER_SHORTLIST_SIZE = int(os.getenv("RECOMMENDER_SHORTLIST_SIZE", "5"))
+RANKING_TOP_N = int(os.getenv("RANKING_TOP_N", "10"))
 
 
 class RecommenderAgent:
@@ -22,23 +37,54 @@ class RecommenderAgent:
 
     def _fetch_model_dataset(self):
         try:
-            client = pymongo.MongoClient(self.mongo_uri)
-            db = client[self.db_name]
-            collection = db[self.collection_name]
-            data = list(collection.find({}, {"_id": 0}))  # Exclude _id field
-            logger.info(f"✅ Fetched {len(data)} models from MongoDB collection `{self.collection_name}`.")
+            data = get_model_catalog().snapshot()
+            logger.info(f"✅ Using {len(data)} cached models from collection `{self.collection_name}`.")
             return data
         except Exception as e:
             logger.error(f"❌ MongoDB connection failed: {e}")
             print(f"❌ MongoDB connection failed: {e}")
             return []
 
-    def recommend_models(self, analyzed_user_input: str, username: str, is_new_requirement: int = 1):
+    def _local_recommendation(self, requirement, ranked):
+        """The ranking engine's shortlist, with reasons built from catalog attributes"""
+        models = []
+        for doc, score, _ in ranked:
+            details = [str(doc.get(field)) for field in ("type", "cloud") if doc.get(field)]
+            if doc.get("accuracy") is not None:
+                details.append(f"accuracy {doc.get('accuracy')}")
+            if doc.get("speed"):
+                details.append(f"speed {doc.get('speed')}")
+            models.append(ModelCandidate.from_catalog(doc, reason=", ".join(details), score=round(score, 4)))
+        return Recommendation(requirement, models, source="local")
+
+    def _parse_llm_choice(self, requirement, result, candidates, source):
+        """Recommendation from the LLM's JSON reply; names must come from `candidates`"""
+        by_name = {normalize_model_name(doc.get("model_name")): doc for doc in candidates}
+        data = parse_json_object(result) or {}
+        chosen = data.get("models") if isinstance(data.get("models"), list) else []
+        if not chosen:
+            # Not JSON after all: fall back to reading a bullet list
+            chosen = [{"name": name} for name in extract_model_names(result)]
+
+        models, seen = [], set()
+        for item in chosen:
+            if not isinstance(item, dict):
+                continue
+            key = normalize_model_name(item.get("name"))
+            doc = by_name.get(key)
+            if doc is None or key in seen:
+                logger.warning(f"⚠️ Ignoring model not in the shortlist: {item.get('name')}")
+                continue
+            seen.add(key)
+            models.append(ModelCandidate.from_catalog(doc, reason=str(item.get("reason") or "").strip()))
+        return Recommendation(requirement, models, source=source)
+
+    def recommend_models(self, analyzed_user_input: str, username: str, is_new_requirement: int = 1) -> Recommendation:
 
         dataset = self._fetch_model_dataset()
         if not dataset:
             logger.warning("⚠️ No dataset available for recommendation.")
-            return []
+            return Recommendation(analyzed_user_input)
         
         excluded_model = None
         if is_new_requirement == 0:
@@ -48,26 +94,61 @@ class RecommenderAgent:
                 if excluded_model_raw:
                     excluded_model = excluded_model_raw.strip().lower()
 
-                    original_len = len(dataset)
-                    dataset = [
-                        m for m in dataset
-                        if m.get("model_name", "").strip().lower() != excluded_model
-                    ]
-                    removed_count = original_len - len(dataset)
-                    logger.info(f"🚫 Excluded model '{excluded_model_raw}'. {removed_count} model(s) removed.")
-                    
-                 
-
-        # Convert models into formatted bullet list
-        formatted_dataset = ""
-        for model in dataset:
-            formatted_dataset += (
+        local_result = None
+        if RECOMMENDER_MODE in ("local", "hybrid"):
+            size = RECOMMENDER_SHORTLIST_SIZE if RECOMMENDER_MODE == "local" else RANKING_TOP_N
+            ranked = get_ranking_engine(dataset).rank(
+                analyzed_user_input, top_n=size, exclude=[excluded_model] if excluded_model else ()
+            )
+            if excluded_model:
+                logger.info(f"🚫 Excluded model '{excluded_model_raw}' from ranking.")
+            local_result = self._local_recommendation(analyzed_user_input, ranked[:RECOMMENDER_SHORTLIST_SIZE])
+            if RECOMMENDER_MODE == "local" or not ranked:
+                logger.info("✅ Recommended models (local ranking):\n" + local_result.to_text())
+                return local_result
+            candidates = [model for model, _, _ in ranked]
+            top_score = ranked[0][1]
+        else:
+            # Only the most relevant models go into the prompt (+1 so the
+            # shortlist stays full after the excluded model is dropped)
+            ranked = get_bm25_index(dataset).search(analyzed_user_input, RECOMMENDER_TOP_K + 1)
+            candidates = [model for model, _ in ranked]
+
+            if excluded_model:
+                original_len = len(candidates)
+                candidates = [
+                    m for m in candidates
+                    if m.get("model_name", "").strip().lower() != excluded_model
+                ]
+                removed_count = original_len - len(candidates)
+                logger.info(f"🚫 Excluded model '{excluded_model_raw}'. {removed_count} model(s) removed.")
+            candidates = candidates[:RECOMMENDER_TOP_K]
+            top_score = ranked[0][1]
+
+        # Convert models into formatted bullet list, within the token budget
+        lines = [
+            (
                 f"- {model.get('model_name', 'Unknown')} | "
                 f"Accuracy: {model.get('accuracy', 'N/A')} | "
                 f"Speed: {model.get('speed', 'N/A')} | "
                 f"Cloud: {model.get('cloud', 'N/A')} | "
                 f"Type: {model.get('type', 'N/A')}\n"
             )
+            for model in candidates
+        ]
+        lines, catalog_tokens = fit_to_budget(lines, RECOMMENDER_CATALOG_TOKEN_BUDGET)
+        candidates = candidates[:len(lines)]
+        formatted_dataset = "".join(lines)
+        logger.info(
+            f"🔎 Pre-filtered catalog: {len(lines)} of {len(dataset)} models "
+            f"({catalog_tokens} tokens, top score {top_score:.2f})"
+        )
+
+        ranking_note = (
+            "        - The list is already ranked best-first by a scoring engine (relevance, accuracy, speed, price);\n"
+            "          keep that order unless the requirement clearly favours a lower-ranked model.\n"
+            if local_result else ""
+        )
 
         prompt = f"""
         You are an AI expert. From the following AI model shortlist, choose the top 4–5 models suitable for the user's requirement below.
@@ -79,31 +160,44 @@ class RecommenderAgent:
         {formatted_dataset}
 
         Instructions:
-        - Only use the above list for selection.
-        - If the requirement involves multiple tasks, prefer multi-capability models.
-        - For each selected model, reply with:
-        - Model Name
-        - A short reason (max 1 line)
-
-        Reply only with a bullet list in this format:
-        - <Model Name>: <short reason>
+        - Only use the above list for selection, with model names exactly as listed.
+{ranking_note}        - If the requirement involves multiple tasks, prefer multi-capability models.
+        - For each selected model, give a short reason (max 1 line).
+
+        Reply only with a JSON object in this format:
+        {{"models": [{{"name": "<Model Name>", "reason": "<short reason>"}}]}}
         """
 
 
         try:
             messages = [
-                {"role": "system", "content": "You are a helpful assistant for AI model recommendation."},
+                {"role": "system", "content": "You are a helpful assistant for AI model recommendation. You reply in JSON."},
                 {"role": "user", "content": prompt}
             ]
+            prompt_tokens = count_message_tokens(messages)
             response = self.client.chat.completions.create(
                 model="gpt-4o",
-                messages=messages
+                messages=messages,
+                response_format={"type": "json_object"}
+            )
+            usage = getattr(response, "usage", None)
+            logger.info(
+                f"🧮 Recommendation prompt tokens: {prompt_tokens} estimated"
+                + (f", {usage.prompt_tokens} billed" if usage else "")
             )
             result = response.choices[0].message.content
-            print("🧠 GPT Response:\n", result)
-            logger.info("✅ Recommended models:\n" + result)
-            return result
+            recommendation = self._parse_llm_choice(
+                analyzed_user_input, result, candidates, "hybrid" if local_result else "llm"
+            )
+            print("🧠 GPT Response:\n", recommendation.to_text())
+            logger.info("✅ Recommended models:\n" + recommendation.to_text())
+            if not recommendation and local_result:
+                return local_result
+            return recommendation
         except Exception as e:
             logger.error(f"❌ GPT recommendation error: {e}")
             print(f"❌ GPT recommendation error: {e}")
-            return "Model recommendation failed."
+            if local_result:
+                # Hybrid mode still has the engine's own shortlist
+                return local_result
+            return Recommendation(analyzed_user_input)
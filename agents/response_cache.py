@@ -0,0 +1,246 @@
+# Requirement-level cache: near-identical requirements reuse a finished report
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from agents.logger import get_logger  # type: ignore
+
+logger = get_logger("response_cache", "logs/response_cache.log")
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.8"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# MinHash signature of NUM_PERM values split into BANDS locality-sensitive buckets
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(1337)
+_PERM_A = _rng.randint(1, _PRIME, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, _PRIME, size=NUM_PERM, dtype=np.uint64)
+
+# Words that carry no information about the task itself. Direction words
+# ("to", "from", "into", "with") are kept: "speech to text" and "text to
+# speech" are different requirements.
+_STOPWORDS = set("""
+a an the i im i'm we you me my our your it its this that these those is are be am was were
+need needs want wants would like looking look suggest suggests recommend recommendation
+recommendations please help find best good some any can could should model models ai tool
+tools for of and or as at which what that give me use using do does
+""".split())
+
+# Parts of a requirement that a near-duplicate must share exactly: numbers
+# with their units, currencies and comparison words. "accuracy above 90%"
+# and "accuracy above 95%" differ by one shingle but need different answers.
+_CONSTRAINT_TERM = re.compile(
+    r"[$€£₹<>≤≥]"
+    r"|\d+(?:[.,]\d+)*(?:\s*%|\s*(?:percent|k|m|b|ms|s|sec\w*|min\w*|hours?|tokens?|pages?|words?|mb|gb)\b)?"
+    r"|\b(?:under|over|above|below|less|more|fewer|least|most|max\w*|min\w*|up\s+to|within|exceed\w*"
+    r"|usd|eur|gbp|inr|dollars?|euros?|rupees?|cents?)\b"
+)
+
+
+def normalize_requirement(text):
+    """Lowercase, drop punctuation and filler words, singularize plurals; word order is kept"""
+    words = re.findall(r"[a-z0-9]+", str(text or "").lower())
+    tokens = []
+    for word in words:
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return " ".join(tokens)
+
+
+def constraint_terms(text):
+    """Numbers, units, currencies and comparison words of `text`, in order"""
+    return tuple("".join(term.split()) for term in _CONSTRAINT_TERM.findall(str(text or "").lower()))
+
+
+def _shingles(normalized):
+    """
+    Whole tokens, in-token character trigrams (typo-tolerant) and word
+    bigrams, so reordering lowers the similarity as well
+    """
+    tokens = normalized.split()
+    shingles = set()
+    for token in tokens:
+        shingles.add(token)
+        padded = f"#{token}#"
+        shingles.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    shingles.update(f"{a}_{b}" for a, b in zip(tokens, tokens[1:]))
+    return shingles
+
+
+def _reordered(a, b):
+    """Same words in a different order ("english to french" / "french to english")"""
+    return a != b and sorted(a.split()) == sorted(b.split())
+
+
+def minhash(normalized):
+    shingles = _shingles(normalized)
+    if not shingles:
+        return np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), "little") % _PRIME
+         for s in shingles],
+        dtype=np.uint64,
+    )
+    # (a * h + b) mod p for every permutation, then the column-wise minimum;
+    # all operands are below 2^31, so the products cannot overflow uint64
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % np.uint64(_PRIME)
+    return permuted.min(axis=0)
+
+
+def _bands(signature):
+    return [(i, signature[i * ROWS:(i + 1) * ROWS].tobytes()) for i in range(BANDS)]
+
+
+class RequirementCache:
+    """
+    LRU + TTL cache of pipeline results keyed by requirement similarity.
+
+    Exact matches of the normalized, order-preserving requirement are a dict
+    hit; otherwise LSH buckets over a MinHash signature yield a few
+    candidates whose estimated Jaccard similarity must reach `threshold`.
+    A candidate with the same words in another order never matches, and
+    neither does one whose numbers, units, currencies or comparison words
+    differ (see constraint_terms), not even with the same normalized key.
+    """
+
+    def __init__(self, threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # normalized -> entry
+        self._buckets = {}              # (band, bytes) -> set(normalized)
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------- internals ----------
+
+    def _remove(self, normalized):
+        entry = self._entries.pop(normalized, None)
+        if entry is None:
+            return
+        self._bytes -= entry["size"]
+        for band in _bands(entry["signature"]):
+            bucket = self._buckets.get(band)
+            if bucket:
+                bucket.discard(normalized)
+                if not bucket:
+                    del self._buckets[band]
+
+    def _expired(self, entry):
+        return entry["expires_at"] < time.time()
+
+    def _find(self, normalized, signature, constraints):
+        entry = self._entries.get(normalized)
+        if entry is not None:
+            # "under $5" and "under 5" normalize alike
+            if entry["constraints"] == constraints:
+                return normalized, entry, 1.0
+            return None, None, 0.0
+
+        candidates = set()
+        for band in _bands(signature):
+            candidates |= self._buckets.get(band, set())
+
+        best, best_score = None, 0.0
+        for candidate in candidates:
+            # MinHash can't tell a reordering apart; it often flips the meaning
+            if _reordered(candidate, normalized):
+                continue
+            if self._entries[candidate]["constraints"] != constraints:
+                continue
+            score = float(np.mean(self._entries[candidate]["signature"] == signature))
+            if score > best_score:
+                best, best_score = candidate, score
+        if best is not None and best_score >= self.threshold:
+            return best, self._entries[best], best_score
+        return None, None, best_score
+
+    # ---------- public API ----------
+
+    def get(self, requirement):
+        normalized = normalize_requirement(requirement)
+        if not normalized:
+            return None
+        signature = minhash(normalized)
+        with self._lock:
+            key, entry, score = self._find(normalized, signature, constraint_terms(requirement))
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        logger.info(f"🎯 Cache hit ({score:.2f}) for '{requirement}' -> '{key}'")
+        return entry["value"]
+
+    def put(self, requirement, value):
+        normalized = normalize_requirement(requirement)
+        if not normalized:
+            return
+        signature = minhash(normalized)
+        size = len(normalized) + signature.nbytes + sum(len(str(v)) for v in value.values())
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove(normalized)
+            self._entries[normalized] = {
+                "signature": signature,
+                "constraints": constraint_terms(requirement),
+                "value": value,
+                "size": size,
+                "expires_at": time.time() + self.ttl,
+            }
+            self._bytes += size
+            for band in _bands(signature):
+                self._buckets.setdefault(band, set()).add(normalized)
+
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+response_cache = RequirementCache()
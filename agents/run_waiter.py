@@ -0,0 +1,274 @@
+# Completion tracking for Assistants API runs: event streams or adaptive polling
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from agents.logger import get_logger  # type: ignore
+
+logger = get_logger("run_waiter", "logs/run_waiter.log")
+
+RUN_TIMEOUT = float(os.getenv("RUN_TIMEOUT", "90"))
+# Longest silence between two events of a streamed run before the read fails
+RUN_STREAM_IDLE_TIMEOUT = float(os.getenv("RUN_STREAM_IDLE_TIMEOUT", "30"))
+RUN_POLL_INITIAL_INTERVAL = float(os.getenv("RUN_POLL_INITIAL_INTERVAL", "0.25"))
+RUN_POLL_MAX_INTERVAL = float(os.getenv("RUN_POLL_MAX_INTERVAL", "2.0"))
+RUN_POLL_BACKOFF = float(os.getenv("RUN_POLL_BACKOFF", "1.6"))
+RUN_POLL_MAX_ERRORS = int(os.getenv("RUN_POLL_MAX_ERRORS", "5"))
+# Threads making the `runs.retrieve` calls, so one slow request doesn't
+# delay the polls of every other run
+RUN_POLL_WORKERS = int(os.getenv("RUN_POLL_WORKERS", "4"))
+
+# Every status a run can stop in; `requires_action` is final for us because
+# our assistants have no tools we could answer with
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete", "requires_action"}
+
+_TERMINAL_EVENTS = {f"thread.run.{status}": status for status in TERMINAL_STATUSES}
+
+
+class RunError(Exception):
+    """A run stopped in a status other than `completed`"""
+
+    def __init__(self, status, run=None, message=None):
+        self.status = status
+        self.run = run
+        last_error = getattr(run, "last_error", None)
+        detail = message or (getattr(last_error, "message", None) if last_error else None)
+        super().__init__(f"Run ended with status '{status}'" + (f": {detail}" if detail else ""))
+
+
+class RunTimeout(RunError):
+    """The run did not finish before its deadline"""
+
+    def __init__(self, run=None, timeout=None):
+        super().__init__("timeout", run, f"no result after {timeout:.0f}s" if timeout else None)
+
+
+def cancel_run(client, thread_id, run_id):
+    try:
+        client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        logger.info(f"🛑 Cancelled run {run_id}")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not cancel run {run_id}: {e}")
+
+
+class RunStreamLost(Exception):
+    """The event stream broke after the run was created; the run itself can still be polled"""
+
+    def __init__(self, run, cause, remaining):
+        self.run = run
+        self.remaining = remaining
+        super().__init__(f"run stream lost: {cause}")
+
+
+def consume_run_stream(client, stream, timeout=RUN_TIMEOUT):
+    """
+    Read a `stream=True` run until it reaches a terminal event.
+
+    Returns `(run, text)` where `text` is the concatenated assistant message
+    content, so no `messages.list` round-trip is needed. Raises RunError for
+    every terminal status other than `completed`, RunTimeout past the
+    deadline (a watchdog cancels the run and closes the stream, so a stalled
+    stream can't block past it) and RunStreamLost if the stream breaks
+    after the run was created.
+    """
+    started = time.monotonic()
+    state = {"run": None}
+    timed_out = threading.Event()
+
+    def on_deadline():
+        timed_out.set()
+        run = state["run"]
+        if run is not None:
+            cancel_run(client, run.thread_id, run.id)
+        try:
+            stream.close()
+        except Exception:
+            pass
+
+    watchdog = threading.Timer(timeout, on_deadline)
+    watchdog.daemon = True
+    watchdog.start()
+    parts = []
+    try:
+        with stream:
+            for event in stream:
+                name = getattr(event, "event", "")
+                data = getattr(event, "data", None)
+
+                if name.startswith("thread.run.") and not name.startswith("thread.run.step"):
+                    state["run"] = data
+                elif name == "thread.message.completed":
+                    for block in getattr(data, "content", []) or []:
+                        text = getattr(block, "text", None)
+                        if text is not None:
+                            parts.append(text.value)
+
+                status = _TERMINAL_EVENTS.get(name)
+                if status == "completed":
+                    return state["run"], "".join(parts)
+                if status is not None:
+                    run = state["run"]
+                    if status == "requires_action":
+                        cancel_run(client, run.thread_id, run.id)
+                    raise RunError(status, run)
+                if name == "error":
+                    raise RunError("error", state["run"], str(data))
+        cause = "stream closed before the run finished"
+    except RunError:
+        raise
+    except Exception as e:
+        if timed_out.is_set():
+            raise RunTimeout(state["run"], timeout) from None
+        if state["run"] is None:
+            raise
+        cause = e
+    finally:
+        watchdog.cancel()
+
+    if timed_out.is_set():
+        raise RunTimeout(state["run"], timeout)
+    if state["run"] is None:
+        raise RunError("unknown", None, str(cause))
+    raise RunStreamLost(state["run"], cause, max(1.0, timeout - (time.monotonic() - started)))
+
+
+class _PendingRun:
+    __slots__ = ("thread_id", "run_id", "future", "deadline", "timeout", "interval", "errors")
+
+    def __init__(self, thread_id, run_id, timeout, interval):
+        self.thread_id = thread_id
+        self.run_id = run_id
+        self.future = Future()
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.interval = interval
+        self.errors = 0
+
+
+class RunWaiter:
+    """
+    Polls any number of runs: one scheduler thread keeps the timing and
+    hands each due poll to a small pool of `workers` threads.
+
+    Each run gets its own backoff schedule (short first interval, growing by
+    `backoff` up to `max_interval`) and deadline; callers get a Future that
+    resolves to the finished run or raises RunError / RunTimeout.
+    """
+
+    def __init__(self, client, initial_interval=RUN_POLL_INITIAL_INTERVAL,
+                 max_interval=RUN_POLL_MAX_INTERVAL, backoff=RUN_POLL_BACKOFF, workers=RUN_POLL_WORKERS):
+        self.client = client
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.workers = max(1, workers)
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = None
+
+    def wait(self, thread_id, run_id, timeout=RUN_TIMEOUT):
+        pending = _PendingRun(thread_id, run_id, timeout, self.initial_interval)
+        self._schedule(pending, time.monotonic() + self.initial_interval)
+        return pending.future
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _schedule(self, pending, when):
+        with self._cond:
+            heapq.heappush(self._heap, (min(when, pending.deadline), next(self._seq), pending))
+            if self._thread is None or not self._thread.is_alive():
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="run-poll")
+                self._thread = threading.Thread(target=self._loop, name="run-waiter", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due, _, pending = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            # A run is back in the heap only after its poll finishes, so it
+            # is never polled twice at once
+            self._executor.submit(self._poll, pending)
+
+    def _poll(self, pending):
+        try:
+            self._check(pending)
+        except Exception as e:
+            # Never leave a caller waiting on a poll that blew up
+            if not pending.future.done():
+                pending.future.set_exception(e)
+
+    def _check(self, pending):
+        if pending.future.cancelled():
+            return
+
+        now = time.monotonic()
+        try:
+            run = self.client.beta.threads.runs.retrieve(thread_id=pending.thread_id, run_id=pending.run_id)
+            pending.errors = 0
+        except Exception as e:
+            pending.errors += 1
+            logger.warning(f"⚠️ Polling run {pending.run_id} failed ({pending.errors}): {e}")
+            if pending.errors >= RUN_POLL_MAX_ERRORS:
+                pending.future.set_exception(e)
+            elif now >= pending.deadline:
+                pending.future.set_exception(RunTimeout(None, pending.timeout))
+            else:
+                self._schedule(pending, now + pending.interval)
+            return
+
+        if run.status == "completed":
+            pending.future.set_result(run)
+        elif run.status in TERMINAL_STATUSES:
+            if run.status == "requires_action":
+                cancel_run(self.client, pending.thread_id, pending.run_id)
+            pending.future.set_exception(RunError(run.status, run))
+        elif now >= pending.deadline:
+            cancel_run(self.client, pending.thread_id, pending.run_id)
+            pending.future.set_exception(RunTimeout(run, pending.timeout))
+        else:
+            pending.interval = min(pending.interval * self.backoff, self.max_interval)
+            self._schedule(pending, now + pending.interval)
+
+
+_waiters = {}
+_waiters_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _waiters_lock
+    _waiters.clear()
+    _waiters_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_run_waiter(client):
+    """One shared waiter per API client"""
+    waiter = _waiters.get(id(client))
+    if waiter is None:
+        with _waiters_lock:
+            waiter = _waiters.get(id(client))
+            if waiter is None:
+                waiter = RunWaiter(client)
+                _waiters[id(client)] = waiter
+    return waiter
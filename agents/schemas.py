@@ -0,0 +1,170 @@
+# Typed data passed between the Recommender, Pricing and Report agents
+
+import json
+import re
+from dataclasses import asdict, dataclass, field, fields
+from typing import Optional
+
+from agents.pricing_index import format_pricing_table, normalize_model_name  # type: ignore
+
+
+def parse_json_object(text):
+    """The JSON object in an LLM reply (bare, fenced or surrounded by prose), or None"""
+    if not text:
+        return None
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    try:
+        value = json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end <= start:
+            return None
+        try:
+            value = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+    return value if isinstance(value, dict) else None
+
+
+def _from_dict(cls, data):
+    names = {f.name for f in fields(cls)}
+    return cls(**{k: v for k, v in (data or {}).items() if k in names})
+
+
+def _text(value):
+    return "" if value is None else str(value).strip()
+
+
+@dataclass(slots=True)
+class ModelCandidate:
+    """One shortlisted model with the catalog attributes later stages need"""
+    name: str
+    reason: str = ""
+    type: str = ""
+    cloud: str = ""
+    region: str = ""
+    accuracy: str = ""
+    speed: str = ""
+    score: Optional[float] = None
+
+    @classmethod
+    def from_catalog(cls, doc, reason="", score=None):
+        return cls(
+            name=_text(doc.get("model_name") or doc.get("name")) or "Unknown",
+            reason=reason,
+            type=_text(doc.get("type")),
+            cloud=_text(doc.get("cloud")),
+            region=_text(doc.get("region")),
+            accuracy=_text(doc.get("accuracy")),
+            speed=_text(doc.get("speed")),
+            score=score,
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        return _from_dict(cls, data)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class Recommendation:
+    """The recommender's shortlist, best first"""
+    requirement: str
+    models: list = field(default_factory=list)   # [ModelCandidate]
+    source: str = "llm"                          # "llm", "local" or "hybrid"
+
+    def __len__(self):
+        return len(self.models)
+
+    def names(self):
+        return [m.name for m in self.models]
+
+    def to_text(self):
+        """The bullet list format the recommender used to return"""
+        return "\n".join(f"- {m.name}: {m.reason}" if m.reason else f"- {m.name}" for m in self.models)
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data or {})
+        data["models"] = [ModelCandidate.from_dict(m) for m in data.get("models", [])]
+        return _from_dict(cls, data)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class PriceQuote:
+    model: str
+    price: str
+    unit: str = ""
+    provider: str = ""
+    region: str = ""
+    source: str = ""
+
+    @classmethod
+    def from_dict(cls, data):
+        data = {k: _text(v) for k, v in (data or {}).items()}
+        return _from_dict(cls, data)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class PricingResult:
+    """Quotes for a shortlist; `note` explains anything that could not be priced"""
+    quotes: list = field(default_factory=list)   # [PriceQuote]
+    note: str = ""
+
+    def __len__(self):
+        return len(self.quotes)
+
+    def quote_for(self, name):
+        wanted = normalize_model_name(name)
+        return next((q for q in self.quotes if normalize_model_name(q.model) == wanted), None)
+
+    def to_table(self):
+        table = format_pricing_table([q.to_dict() for q in self.quotes]) if self.quotes else ""
+        return "\n\n".join(part for part in (table, self.note) if part)
+
+
+# Report lines in display order: (field, label)
+REPORT_FIELDS = (
+    ("model_name", "Model Name      "),
+    ("price", "Price           "),
+    ("speed", "Speed           "),
+    ("accuracy", "Accuracy        "),
+    ("cloud", "Cloud           "),
+    ("region", "Region          "),
+    ("reason", "Reason for Selection "),
+)
+
+
+@dataclass(slots=True)
+class FinalReport:
+    model_name: str
+    price: str = ""
+    speed: str = ""
+    accuracy: str = ""
+    cloud: str = ""
+    region: str = ""
+    reason: str = ""
+
+    @classmethod
+    def from_dict(cls, data):
+        data = {k: _text(v) for k, v in (data or {}).items()}
+        data["model_name"] = data.get("model_name") or "UNKNOWN"
+        return _from_dict(cls, data)
+
+    def to_dict(self):
+        return asdict(self)
+
+    def to_text(self):
+        """The plain-text report layout shown to users"""
+        lines = ["Final Best Model Recommended:"]
+        for i, (name, label) in enumerate(REPORT_FIELDS, start=1):
+            lines.append(f"{i}. {label}: {getattr(self, name) or 'Not available'}")
+        return "\n".join(lines)
@@ -0,0 +1,216 @@
+# Server-side chat session store: in-memory LRU in front of a Mongo TTL collection
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+from agents.logger import get_logger  # type: ignore
+from agents.mongo_pool import LazyCollection  # type: ignore
+
+load_dotenv()
+
+logger = get_logger("session_store", "logs/session_store.log")
+
+# "mongo" (memory + Mongo) or "memory" (single process, lost on restart)
+SESSION_STORE = os.getenv("SESSION_STORE", "mongo").lower()
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+SESSION_MEMORY_ENTRIES = int(os.getenv("SESSION_MEMORY_ENTRIES", "5000"))
+# Memory entries older than this are re-read from Mongo, so several worker
+# processes don't keep serving each other's stale state
+SESSION_MEMORY_MAX_AGE = float(os.getenv("SESSION_MEMORY_MAX_AGE", "30"))
+# Most turns kept in the session's rolling history (see conversation_buffer),
+# and rows read from the chats collection on a cold start
+SESSION_HISTORY_TURNS = int(os.getenv("SESSION_HISTORY_TURNS", "10"))
+SESSION_SAVE_RETRIES = 3
+
+sessions_col = LazyCollection(os.getenv("USER_DB_NAME"), "chat_sessions")
+
+
+class SessionConflict(Exception):
+    """The session was saved by someone else since it was loaded"""
+
+
+def _appended(base, mine):
+    """
+    The entries `mine` added to the list `base`. `mine` may have dropped
+    entries from the front (history is trimmed oldest first), so the part
+    they share is a suffix of `base` and a prefix of `mine`.
+    """
+    for shared in range(min(len(base), len(mine)), 0, -1):
+        if mine[:shared] == base[-shared:]:
+            return mine[shared:]
+    return list(mine)
+
+
+class MemorySessionStore:
+    """
+    Sessions are plain dicts carrying a "_version" counter. `save` only
+    succeeds against the version that was loaded; on a conflict the fields
+    this turn changed are re-applied on top of the newer state, except the
+    rolling history, to which only this turn's new entries are appended.
+    """
+
+    def __init__(self, max_entries=SESSION_MEMORY_ENTRIES, ttl=SESSION_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()   # key -> (state, loaded_at)
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    # ---------- memory tier ----------
+
+    def _remember(self, key, state):
+        with self._lock:
+            self._memory[key] = (copy.deepcopy(state), time.time())
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _recall(self, key, max_age=None):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            age = time.time() - entry[1]
+            if age > self.ttl or (max_age is not None and age > max_age):
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return copy.deepcopy(entry[0])
+
+    # ---------- backing tier (none for the memory store) ----------
+
+    def _read(self, key):
+        return None
+
+    def _write(self, key, state, expected_version):
+        current = self._recall(key)
+        if (current or {}).get("_version", 0) != expected_version:
+            raise SessionConflict(key)
+
+    # ---------- API ----------
+
+    def load(self, key, default_factory=dict):
+        """The session for `key`, or `default_factory()` (version 0) if there is none"""
+        state = self._recall(key, SESSION_MEMORY_MAX_AGE)
+        if state is None:
+            state = self._read(key)
+            if state is not None:
+                self._remember(key, state)
+        if state is None:
+            self.misses += 1
+            state = default_factory()
+            state["_version"] = 0
+        else:
+            self.hits += 1
+        return state
+
+    def save(self, key, state, base=None):
+        """
+        Store `state` if nobody else saved `key` since it was loaded. `base`
+        is the state as loaded; with it, conflicts are resolved by applying
+        the fields that differ from `base` to the latest stored state.
+        """
+        state = dict(state)
+        for _ in range(SESSION_SAVE_RETRIES):
+            expected = state.get("_version", 0)
+            new_state = {**state, "_version": expected + 1}
+            try:
+                self._write(key, new_state, expected)
+            except SessionConflict:
+                self.conflicts += 1
+                if base is None:
+                    raise
+                latest = self._read(key) or self._recall(key) or {"_version": expected}
+                changes = {k: v for k, v in state.items() if k != "_version" and base.get(k) != v}
+                if "history" in changes:
+                    # Keep the turns the other writer appended
+                    history = (latest.get("history") or []) + _appended(base.get("history") or [], state["history"])
+                    changes["history"] = history[-SESSION_HISTORY_TURNS:]
+                logger.warning(f"⚠️ Session conflict for {key}, re-applying {sorted(changes)}")
+                base = latest
+                state = {**latest, **changes}
+                continue
+            self._remember(key, new_state)
+            return new_state["_version"]
+        raise SessionConflict(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "memory_entries": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "conflicts": self.conflicts,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+class MongoSessionStore(MemorySessionStore):
+    """Memory tier in front of a collection whose TTL index expires idle sessions"""
+
+    def __init__(self, collection=sessions_col, **kwargs):
+        super().__init__(**kwargs)
+        self.collection = collection
+        self._index_ready = False
+
+    def _ensure_index(self):
+        if self._index_ready:
+            return
+        try:
+            self.collection.create_index("updated_at", expireAfterSeconds=self.ttl)
+            self._index_ready = True
+        except Exception as e:
+            logger.error(f"❌ Could not create session TTL index: {e}")
+
+    def _read(self, key):
+        try:
+            doc = self.collection.find_one({"_id": key})
+        except Exception as e:
+            logger.error(f"❌ Session read failed for {key}: {e}")
+            return None
+        if not doc:
+            return None
+        return {**doc.get("state", {}), "_version": doc.get("version", 0)}
+
+    def _write(self, key, state, expected_version):
+        self._ensure_index()
+        fields = {k: v for k, v in state.items() if k != "_version"}
+        now = datetime.utcnow()
+        if expected_version == 0:
+            try:
+                self.collection.insert_one({"_id": key, "state": fields, "version": 1, "updated_at": now})
+            except DuplicateKeyError:
+                raise SessionConflict(key)
+            return
+        result = self.collection.update_one(
+            {"_id": key, "version": expected_version},
+            {"$set": {"state": fields, "updated_at": now}, "$inc": {"version": 1}}
+        )
+        if result.matched_count == 0:
+            raise SessionConflict(key)
+
+    def delete(self, key):
+        super().delete(key)
+        try:
+            self.collection.delete_one({"_id": key})
+        except Exception as e:
+            logger.error(f"❌ Session delete failed for {key}: {e}")
+
+    def stats(self):
+        return {**super().stats(), "backend": "mongo"}
+
+
+session_store = MemorySessionStore() if SESSION_STORE == "memory" else MongoSessionStore()
@@ -0,0 +1,344 @@
+# Resumable chunked uploads: per-user quotas, incremental hashing, background extraction
+
+import hashlib
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from agents.logger import get_logger  # type: ignore
+from agents.mongo_pool import LazyCollection  # type: ignore
+from agents.extraction_cache import UPLOAD_DIR, object_path, store_object  # type: ignore
+from agents.file_extractors import EXTRACTORS, extract_file  # type: ignore
+from agents.job_queue import JOB_QUEUE_ENABLED, get_job_queue  # type: ignore
+
+load_dotenv()
+
+logger = get_logger("upload_store", "logs/upload_store.log")
+
+# Largest chunk one PUT may carry; clients send the file in pieces of this size
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(4 * 1024 * 1024)))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(50 * 1024 * 1024)))
+# Total bytes of uploads (finished or in progress) one user may hold
+UPLOAD_USER_QUOTA_BYTES = int(os.getenv("UPLOAD_USER_QUOTA_BYTES", str(200 * 1024 * 1024)))
+# Unfinished uploads one user may have open at once
+UPLOAD_MAX_ACTIVE = int(os.getenv("UPLOAD_MAX_ACTIVE", "3"))
+# Unfinished uploads untouched this long are discarded
+UPLOAD_ABANDON_SECONDS = float(os.getenv("UPLOAD_ABANDON_SECONDS", str(24 * 3600)))
+# A chunk write holds the upload this long; a crashed writer's claim lapses after it
+UPLOAD_CHUNK_LEASE_SECONDS = float(os.getenv("UPLOAD_CHUNK_LEASE_SECONDS", "120"))
+
+UPLOAD_PARTIAL_DIR = os.path.join(UPLOAD_DIR, ".partial")
+_WRITE_BLOCK = 64 * 1024
+# In-progress hash states kept per process; a missing one is rebuilt from the partial file
+_HASHER_ENTRIES = 256
+# How chat messages refer to an upload
+UPLOAD_REFERENCE = re.compile(r"\bupload:([0-9a-f]{32})\b")
+
+uploads_col = LazyCollection(os.getenv("USER_DB_NAME"), "uploads")
+
+
+class UploadError(Exception):
+    """A rejected upload request; `status` is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, **details):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def public_view(doc):
+    """The fields of an upload document returned to clients"""
+    return {
+        "upload_id": doc["_id"],
+        "filename": doc["filename"],
+        "size": doc["size"],
+        "received": doc["received"],
+        "status": doc["status"],
+        "sha256": doc.get("sha256"),
+        "deduplicated": doc.get("deduplicated"),
+        "tokens": doc.get("tokens"),
+        "truncated": doc.get("truncated"),
+        "error": doc.get("error"),
+        "chunk_size": UPLOAD_CHUNK_BYTES,
+        "reference": f"upload:{doc['_id']}",
+    }
+
+
+def _partial_path(upload_id):
+    return os.path.join(UPLOAD_PARTIAL_DIR, f"{upload_id}.part")
+
+
+# ---------- incremental hashing ----------
+
+_hashers = OrderedDict()   # upload_id -> (sha256 object, bytes hashed)
+_hashers_lock = threading.Lock()
+
+
+def _take_hasher(upload_id, offset):
+    """The hash of the first `offset` bytes, from memory or re-read from the partial file"""
+    with _hashers_lock:
+        entry = _hashers.pop(upload_id, None)
+    if entry and entry[1] == offset:
+        return entry[0]
+    # Another process took the earlier chunks, or this one restarted
+    digest = hashlib.sha256()
+    remaining = offset
+    if remaining:
+        with open(_partial_path(upload_id), "rb") as f:
+            while remaining:
+                block = f.read(min(_WRITE_BLOCK * 16, remaining))
+                if not block:
+                    raise UploadError("partial upload is shorter than recorded", 409)
+                digest.update(block)
+                remaining -= len(block)
+    return digest
+
+
+def _keep_hasher(upload_id, digest, offset):
+    with _hashers_lock:
+        _hashers[upload_id] = (digest, offset)
+        while len(_hashers) > _HASHER_ENTRIES:
+            _hashers.popitem(last=False)
+
+
+def _reset_after_fork():
+    global _hashers_lock
+    _hashers.clear()
+    _hashers_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# ---------- lifecycle ----------
+
+def _discard_abandoned(email):
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_ABANDON_SECONDS)
+    stale = list(uploads_col.find({"email": email, "status": "uploading", "updated_at": {"$lt": cutoff}}, {"_id": 1}))
+    for doc in stale:
+        try:
+            os.remove(_partial_path(doc["_id"]))
+        except OSError:
+            pass
+    if stale:
+        uploads_col.delete_many({"_id": {"$in": [doc["_id"] for doc in stale]}})
+        logger.info(f"🧹 Discarded {len(stale)} abandoned uploads for {email}")
+
+
+def create_upload(email, filename, size):
+    """Open a resumable upload after checking the file type, size and the user's quota"""
+    if not email:
+        raise UploadError("email is required")
+    ext = os.path.splitext(filename or "")[-1].lower()
+    if ext not in EXTRACTORS:
+        raise UploadError(f"unsupported file format: {ext or 'none'}", 415)
+    if not isinstance(size, int) or size <= 0:
+        raise UploadError("size must be a positive number of bytes")
+    if size > UPLOAD_MAX_FILE_BYTES:
+        raise UploadError(f"file is larger than {UPLOAD_MAX_FILE_BYTES} bytes", 413)
+
+    _discard_abandoned(email)
+    usage = list(uploads_col.aggregate([
+        {"$match": {"email": email, "status": {"$ne": "failed"}}},
+        {"$group": {"_id": "$status", "bytes": {"$sum": "$size"}, "count": {"$sum": 1}}},
+    ]))
+    used = sum(row["bytes"] for row in usage)
+    active = sum(row["count"] for row in usage if row["_id"] == "uploading")
+    if active >= UPLOAD_MAX_ACTIVE:
+        raise UploadError(f"{active} uploads already in progress; finish or wait for them first", 429)
+    if used + size > UPLOAD_USER_QUOTA_BYTES:
+        raise UploadError("upload quota exceeded", 413, used=used, quota=UPLOAD_USER_QUOTA_BYTES)
+
+    now = datetime.utcnow()
+    doc = {
+        "_id": uuid.uuid4().hex,
+        "email": email,
+        "filename": filename,
+        "size": size,
+        "received": 0,
+        "status": "uploading",
+        "lease_until": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    os.makedirs(UPLOAD_PARTIAL_DIR, exist_ok=True)
+    open(_partial_path(doc["_id"]), "wb").close()
+    uploads_col.insert_one(doc)
+    logger.info(f"⬆️ Upload {doc['_id']} opened by {email}: {filename} ({size} bytes)")
+    return doc
+
+
+def get_upload(upload_id, email):
+    doc = uploads_col.find_one({"_id": upload_id, "email": email})
+    if doc is None:
+        raise UploadError("upload not found", 404)
+    return doc
+
+
+def write_chunk(upload_id, email, offset, stream, length=None):
+    """
+    Append the bytes of `stream` at `offset`, which must equal the bytes
+    received so far; a mismatch returns 409 with the offset to resume from.
+    Data is written and hashed in small blocks as it arrives. The last chunk
+    completes the upload and queues its extraction; repeating it afterwards
+    returns the completed upload.
+    """
+    if length is not None and length > UPLOAD_CHUNK_BYTES:
+        raise UploadError(f"chunks are limited to {UPLOAD_CHUNK_BYTES} bytes", 413)
+
+    # Claim the upload for this chunk, so concurrent retries can't interleave
+    doc = _claim(upload_id, "uploading", email=email, received=offset)
+    if doc is None:
+        current = get_upload(upload_id, email)
+        if current["status"] == "storing":
+            # A completion that stopped before the file was stored: finish it
+            claimed = _claim(upload_id, "storing")
+            if claimed is not None:
+                return _complete(claimed)
+        if (current["status"] != "uploading" and length is not None
+                and offset + length == current["received"] == current["size"]):
+            return current    # a retried last chunk
+        if current["status"] != "uploading":
+            raise UploadError(f"upload is {current['status']}", 409, received=current["received"])
+        raise UploadError("offset does not match the bytes received", 409, received=current["received"])
+
+    received = offset
+    try:
+        digest = _take_hasher(upload_id, offset)
+        limit = min(UPLOAD_CHUNK_BYTES, doc["size"] - offset)
+        with open(_partial_path(upload_id), "r+b") as f:
+            # Drop anything a failed earlier attempt left past the offset
+            f.truncate(offset)
+            f.seek(offset)
+            while True:
+                block = stream.read(_WRITE_BLOCK)
+                if not block:
+                    break
+                if received + len(block) - offset > limit:
+                    raise UploadError("chunk runs past the declared size or chunk limit", 413)
+                f.write(block)
+                digest.update(block)
+                received += len(block)
+    except BaseException:
+        uploads_col.update_one({"_id": upload_id}, {"$set": {"lease_until": None}})
+        raise
+
+    update = {"received": received, "lease_until": None, "updated_at": datetime.utcnow()}
+    if received < doc["size"]:
+        _keep_hasher(upload_id, digest, received)
+        uploads_col.update_one({"_id": upload_id}, {"$set": update})
+        return {**doc, **update}
+
+    # Record that every byte arrived (and its hash) before touching the file,
+    # so a crash from here on is finished by a retry instead of re-uploaded
+    update.update(status="storing", sha256=digest.hexdigest(),
+                  lease_until=datetime.utcnow() + timedelta(seconds=UPLOAD_CHUNK_LEASE_SECONDS))
+    uploads_col.update_one({"_id": upload_id}, {"$set": update})
+    return _complete({**doc, **update})
+
+
+def _claim(upload_id, status, **match):
+    """The upload in `status` with this call holding its lease, or None if it isn't free"""
+    now = datetime.utcnow()
+    return uploads_col.find_one_and_update(
+        {"_id": upload_id, "status": status, **match,
+         "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+        {"$set": {"lease_until": now + timedelta(seconds=UPLOAD_CHUNK_LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _complete(doc):
+    """
+    Move a fully received ("storing") upload into the object store and queue
+    its extraction. Every step tolerates having run before, so a completion
+    interrupted at any point can simply be repeated.
+    """
+    sha = doc["sha256"]
+    ext = os.path.splitext(doc["filename"])[-1]
+    partial = _partial_path(doc["_id"])
+    if os.path.exists(partial):
+        path, deduplicated = store_object(partial, sha, ext)
+    else:
+        # Moved by an earlier attempt
+        path, deduplicated = object_path(sha, ext), bool(doc.get("deduplicated"))
+        if not os.path.exists(path):
+            uploads_col.update_one({"_id": doc["_id"]}, {"$set": {
+                "status": "failed", "error": "upload data was lost; upload the file again",
+                "lease_until": None, "updated_at": datetime.utcnow(),
+            }})
+            raise UploadError("upload data was lost; upload the file again", 410)
+    with _hashers_lock:
+        _hashers.pop(doc["_id"], None)
+
+    done = uploads_col.find_one_and_update(
+        {"_id": doc["_id"], "status": "storing"},
+        {"$set": {"status": "processing", "path": path, "deduplicated": deduplicated,
+                  "lease_until": None, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if done is None:
+        # Another attempt finished first and has queued the extraction
+        return uploads_col.find_one({"_id": doc["_id"]})
+    logger.info(f"✅ Upload {doc['_id']} complete ({doc['size']} bytes, {sha[:12]}"
+                f"{', duplicate content' if deduplicated else ''})")
+    _schedule_extraction(doc["_id"], doc["email"])
+    return done
+
+
+# ---------- extraction ----------
+
+def extract_upload_job(payload):
+    """Extract a finished upload; the text itself lives in the extraction cache"""
+    doc = uploads_col.find_one({"_id": payload["upload_id"]})
+    if doc is None or doc.get("status") not in ("processing", "ready"):
+        return
+    result = extract_file(doc["path"])
+    uploads_col.update_one({"_id": doc["_id"]}, {"$set": {
+        "status": "failed" if result.error else "ready",
+        "kind": result.kind,
+        "tokens": result.tokens,
+        "truncated": result.truncated,
+        "error": result.error or None,
+        "updated_at": datetime.utcnow(),
+    }})
+
+
+def _schedule_extraction(upload_id, email):
+    payload = {"upload_id": upload_id}
+    if JOB_QUEUE_ENABLED:
+        try:
+            get_job_queue().enqueue("extract_upload", f"upload:{email}", payload)
+            return
+        except Exception as e:
+            logger.error(f"❌ Could not queue extraction of {upload_id}: {e}")
+    threading.Thread(target=extract_upload_job, args=(payload,), name="extract-upload", daemon=True).start()
+
+
+def resolve_upload_references(email, message):
+    """
+    `message` with every `upload:<id>` owned by `email` replaced by the
+    upload's extracted text (a note if it isn't ready or doesn't exist)
+    """
+    if not message or "upload:" not in message:
+        return message
+
+    def expand(match):
+        doc = uploads_col.find_one({"_id": match.group(1), "email": email})
+        if doc is None:
+            return f"[{match.group(0)}: no such upload]"
+        name = doc["filename"]
+        if doc["status"] in ("uploading", "storing", "processing"):
+            return f"[File {name} is still being {'uploaded' if doc['status'] == 'uploading' else 'processed'}]"
+        if doc["status"] == "failed":
+            return f"[File {name} could not be read: {doc.get('error')}]"
+        # A cache hit unless the entry was evicted, in which case it is re-extracted
+        return f"[File {name}]\n{extract_file(doc['path']).text}\n[End of {name}]"
+
+    return UPLOAD_REFERENCE.sub(expand, message)
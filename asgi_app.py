@@ -0,0 +1,407 @@
+# ASGI serving mode: asyncio-native chat and webhook endpoints
+#
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+#   (or SERVER_MODE=asgi python main_flask.py)
+#
+# /chat and the three webhooks are served by Quart with the same routes and
+# payloads as main_flask.py; Mongo writes use the async client and Telegram
+# replies use httpx. Classification, follow-up answers and reports await
+# AsyncAzureOpenAI on the event loop. The stages that are still synchronous
+# (recommendation, the pricing Assistants run, session and dedup I/O) run on
+# a small thread pool. Every other route is passed through to the unchanged
+# Flask app.
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, request, jsonify
+
+import main_flask as core
+from agents.async_mongo import get_async_collection
+from agents.chat_agent import ChatAgent
+from agents.dedup_store import webhook_message_key
+from agents.pipeline import StagePipeline
+from agents.report_agent import ReportAgent
+from agents.requir_recommender_agent import RecommenderAgent
+from agents.pricing_agent import PricingAgent
+from agents.upload_store import resolve_upload_references
+
+# Turns (LLM pipelines) allowed in flight at once; requests beyond this wait in the loop
+ASGI_MAX_INFLIGHT_TURNS = int(os.getenv("ASGI_MAX_INFLIGHT_TURNS", "64"))
+# Threads for the blocking stages only. Most turns hold one for a few
+# milliseconds of session I/O; new requirements hold one through
+# recommendation and pricing.
+ASGI_BLOCKING_THREADS = int(os.getenv("ASGI_BLOCKING_THREADS", "16"))
+
+quart_app = Quart(__name__)
+quart_app.secret_key = core.app.secret_key
+
+_turn_executor = ThreadPoolExecutor(max_workers=ASGI_BLOCKING_THREADS, thread_name_prefix="asgi-turn")
+_turn_slots = None
+_http_client = None
+
+
+def users_col():
+    return get_async_collection(core.user_db_name, core.users_collection_name)
+
+
+def chats_col():
+    return get_async_collection(core.user_db_name, core.chats_collection_name)
+
+
+def http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=10)
+    return _http_client
+
+
+@quart_app.before_serving
+async def start_background_services():
+    core.start_background_services()
+
+
+@quart_app.after_request
+async def add_cors_headers(response):
+    # Same permissive policy flask_cors applies to the sync app
+    response.headers.setdefault("Access-Control-Allow-Origin", "*")
+    response.headers.setdefault("Access-Control-Allow-Headers", "Content-Type")
+    response.headers.setdefault("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+    return response
+
+
+# ==================== ASYNC HELPERS ====================
+
+async def auto_register_user(email, username, platform="unknown"):
+    """Auto-register users from messaging platforms"""
+    existing_user = await users_col().find_one({"email": email})
+    if existing_user:
+        return existing_user
+
+    user_data = {
+        "username": username,
+        "email": email,
+        "password": "auto_generated",
+        "platform": platform,
+        "created_at": datetime.now()
+    }
+    # Concurrent first messages from one user race here; the unique email
+    # index lets exactly one of them insert
+    result = await users_col().update_one({"email": email}, {"$setOnInsert": user_data}, upsert=True)
+    if result.upserted_id is None:
+        return await users_col().find_one({"email": email})
+
+    core.platform_counters.incr("users", platform)
+    print(f"✅ Auto-registered {platform} user: {email}")
+    return {"_id": result.upserted_id, **user_data}
+
+
+async def send_telegram_message(chat_id, message):
+    """Send message to Telegram user"""
+    try:
+        if not core.TELEGRAM_BOT_TOKEN:
+            print("❌ Telegram bot token not configured")
+            return False
+
+        url = f"https://api.telegram.org/bot{core.TELEGRAM_BOT_TOKEN}/sendMessage"
+        response = await http_client().post(url, json={"chat_id": chat_id, "text": message, "parse_mode": "HTML"})
+
+        if response.status_code == 200:
+            print(f"✅ Telegram message sent to {chat_id}")
+            return True
+        print(f"❌ Telegram send failed: {response.text}")
+        return False
+
+    except Exception as e:
+        print(f"❌ Telegram send error: {e}")
+        return False
+
+
+async def in_thread(func, *args, **kwargs):
+    """Run blocking I/O (dedup store, job queue, modem) and synchronous stages off the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(_turn_executor, functools.partial(func, *args, **kwargs))
+
+
+def turn_slots():
+    global _turn_slots
+    if _turn_slots is None:
+        _turn_slots = asyncio.Semaphore(ASGI_MAX_INFLIGHT_TURNS)
+    return _turn_slots
+
+
+async def run_chat_turn(email, message, session_data, platform="web"):
+    """
+    main_flask.run_chat_turn with the LLM calls it makes directly (classify,
+    follow-up, report) awaited on the async client
+    """
+    pipeline = StagePipeline(f"chat:{platform}:async")
+    chat_agent = ChatAgent(core.gpt_client, core.async_gpt_client)
+
+    # As in main_flask, upload:<id> references are expanded only for
+    # recommendation and the report
+    pipeline.submit("catalog", core.get_model_catalog)
+    cached = pipeline.run("cache_lookup", core.response_cache.get, message) if core.RESPONSE_CACHE_ENABLED else None
+    if cached is None:
+        core.start_speculation(pipeline, message, email, session_data)
+
+    chat_response = await pipeline.run_async(
+        "classify", chat_agent.process_web_input_async, message, session_data, username=email
+    )
+    core.settle_speculation(pipeline, chat_response)
+
+    if not chat_response:
+        response = core.NO_RESPONSE
+    elif not chat_response["proceed"]:
+        response = chat_response["message"]
+    else:
+        action = chat_response.get("action")
+        report_agent = ReportAgent(core.gpt_client, core.async_gpt_client)
+
+        if action == "NewRequirement" and cached is not None:
+            response = await in_thread(core.use_cached_report, email, message, cached, session_data)
+
+        elif action == "NewRequirement":
+            if pipeline.has("speculative"):
+                recommended, pricing_info = await pipeline.result_async("speculative")
+            else:
+                recommended, pricing_info = await in_thread(
+                    pipeline.run, "recommend_and_price", core.recommend_and_price, message, email
+                )
+            session_data["original_requirement"] = message
+
+            requirement = await in_thread(resolve_upload_references, email, message)
+            final_report = await pipeline.run_async(
+                "report", report_agent.generate_report_async, email, requirement, recommended, pricing_info
+            )
+            response = final_report.to_text() if final_report else core.REPORT_ERROR_RESPONSE
+            if final_report:
+                core.remember_report(session_data, message, response, final_report.model_name, recommended)
+            core.adopt_shortlist(session_data, recommended.names())
+
+        elif action == "FollowUp":
+            response = chat_response["message"]
+
+        elif action == "ModelRejection":
+            original_requirement = chat_response.get("requirement", "")
+            requirement = await in_thread(resolve_upload_references, email, original_requirement)
+            recommended = await in_thread(
+                pipeline.run, "recommend", RecommenderAgent(core.gpt_client).recommend_models,
+                analyzed_user_input=requirement, username=email, is_new_requirement=0
+            )
+            if not recommended:
+                response = core.NO_MORE_MODELS_RESPONSE
+            else:
+                pricing_agent = PricingAgent(core.assistant_id, core.az_key, core.az_endpoint)
+                pricing_info = await in_thread(pipeline.run, "pricing", pricing_agent.analyze_pricing, recommended)
+                final_report = await pipeline.run_async(
+                    "report", report_agent.generate_report_async, email, requirement, recommended, pricing_info
+                )
+                response = final_report.to_text() if final_report else core.REPORT_ERROR_RESPONSE
+                if final_report:
+                    core.remember_report(session_data, original_requirement, response, final_report.model_name)
+                core.adopt_shortlist(session_data, recommended.names(), reset_rejected=False)
+
+        else:
+            response = core.UNCLEAR_RESPONSE
+
+    pipeline.log_timings()
+    return response
+
+
+async def process_chat_message(email, message, platform="web"):
+    """Async counterpart of main_flask.process_chat_message; returns a dict"""
+    try:
+        session_data, base = await in_thread(core.load_session, email)
+
+        async with turn_slots():
+            response = await run_chat_turn(email, message, session_data, platform)
+
+        await chats_col().insert_one({
+            "email": email,
+            "message": message,
+            "response": response,
+            "platform": platform,
+            "timestamp": datetime.now()
+        })
+        core.platform_counters.incr("chats", platform)
+        core.remember_turn(session_data, message, response)
+        await in_thread(core.store_session, email, session_data, base)
+
+        return {
+            "response": core.format_for_platform(response, platform),
+            "current_model": session_data.get("current_model")
+        }
+
+    except Exception as e:
+        print(f"❌ Error processing chat message: {e}")
+        return {"response": core.CHAT_ERROR_RESPONSE, "current_model": None}
+
+
+async def process_webhook_message(message_key, email, message, platform):
+    """Async counterpart of main_flask.process_webhook_message"""
+    if message_key:
+        is_new, cached_response = await in_thread(core.dedup_store.claim, message_key)
+        if not is_new:
+            print(f"🔁 Duplicate webhook delivery {message_key}, returning cached reply")
+            return {"response": cached_response, "current_model": None, "duplicate": True}
+
+    result = await process_chat_message(email, message, platform)
+    await in_thread(core.finish_webhook_message, message_key, result["response"])
+    return result
+
+
+# ==================== ROUTES ====================
+
+@quart_app.route("/chat", methods=["POST"])
+async def chat():
+    data = await request.get_json()
+    email = data.get("email")
+    message = data.get("message")
+
+    return jsonify(await process_chat_message(email, message, "web"))
+
+
+@quart_app.route("/whatsapp-webhook", methods=["POST"])
+async def whatsapp_webhook():
+    """Handle incoming WhatsApp messages"""
+    try:
+        data = await request.get_json()
+        print(f"📱 WhatsApp webhook received: {data}")
+
+        phone_number = data.get("from", data.get("From", "")).replace("+", "").replace(" ", "")
+        message_text = data.get("message", data.get("text", data.get("body", "")))
+
+        clean_phone = core.clean_phone_number(phone_number)
+
+        if not clean_phone or not message_text:
+            print(f"❌ Invalid WhatsApp data: phone={phone_number}, message={message_text}")
+            return jsonify({"status": "error", "message": "Missing phone or message"}), 400
+
+        full_phone = f"91{clean_phone}"
+        if full_phone not in core.WHATSAPP_FRIENDS:
+            print(f"❌ Unauthorized WhatsApp user: {full_phone}")
+            return jsonify({"status": "unauthorized", "message": "Not authorized"}), 403
+
+        await auto_register_user(email=full_phone, username=f"WhatsApp_{clean_phone}", platform="whatsapp")
+
+        message_key = webhook_message_key("whatsapp", data)
+        result = await process_webhook_message(message_key, full_phone, message_text, "whatsapp")
+
+        print(f"✅ WhatsApp response sent to {phone_number}")
+        return jsonify({"status": "success", "response": result["response"] or "", "to": phone_number,
+                        "duplicate": result.get("duplicate", False)})
+
+    except Exception as e:
+        print(f"❌ WhatsApp webhook error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@quart_app.route("/telegram-webhook", methods=["POST"])
+async def telegram_webhook():
+    """Handle incoming Telegram messages"""
+    try:
+        data = await request.get_json()
+        print(f"🤖 Telegram webhook received: {data}")
+
+        message = data.get("message", {})
+        chat_id = message.get("chat", {}).get("id")
+        message_text = message.get("text", "")
+        user_info = message.get("from", {})
+        username = user_info.get("username", user_info.get("first_name", "TelegramUser"))
+
+        if not chat_id or not message_text:
+            print(f"❌ Invalid Telegram data: chat_id={chat_id}, message={message_text}")
+            return jsonify({"status": "error", "message": "Missing chat_id or message"}), 400
+
+        if message_text.startswith("/"):
+            await send_telegram_message(chat_id, core.telegram_command_reply(message_text, username))
+            return jsonify({"status": "success"})
+
+        telegram_email = f"telegram_{chat_id}"
+        message_key = webhook_message_key("telegram", data)
+
+        if core.JOB_QUEUE_ENABLED:
+            if not await in_thread(core.claim_webhook_message, message_key):
+                return jsonify({"status": "success", "duplicate": True})
+            # Acknowledge right away; a background worker runs the turn and replies
+            await in_thread(core.enqueue_chat_turn, telegram_email, f"Telegram_{username}", message_text,
+                            "telegram", chat_id, message_key)
+            return jsonify({"status": "success", "queued": True})
+
+        await auto_register_user(email=telegram_email, username=f"Telegram_{username}", platform="telegram")
+
+        result = await process_webhook_message(message_key, telegram_email, message_text, "telegram")
+        if result.get("duplicate"):
+            return jsonify({"status": "success", "duplicate": True})
+        await send_telegram_message(chat_id, result["response"])
+
+        print(f"✅ Telegram response sent to {chat_id}")
+        return jsonify({"status": "success"})
+
+    except Exception as e:
+        print(f"❌ Telegram webhook error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@quart_app.route("/sms-webhook", methods=["POST"])
+async def sms_webhook():
+    """Handle incoming SMS messages"""
+    try:
+        data = await request.get_json(silent=True) or (await request.form).to_dict()
+        print(f"📞 SMS webhook received: {data}")
+
+        phone_number = data.get("from", data.get("From", data.get("mobile", "")))
+        message_text = data.get("body", data.get("Body", data.get("text", "")))
+
+        clean_phone = core.clean_phone_number(phone_number)
+
+        if not clean_phone or not message_text:
+            print(f"❌ Invalid SMS data: phone={phone_number}, message={message_text}")
+            return jsonify({"status": "error", "message": "Missing phone or message"}), 400
+
+        full_phone = f"91{clean_phone}"
+        sms_email = f"sms_{full_phone}"
+        message_key = webhook_message_key("sms", data)
+
+        if core.JOB_QUEUE_ENABLED:
+            if not await in_thread(core.claim_webhook_message, message_key):
+                return jsonify({"status": "success", "duplicate": True})
+            await in_thread(core.enqueue_chat_turn, sms_email, f"SMS_{clean_phone}", message_text,
+                            "sms", full_phone, message_key)
+            return jsonify({"status": "success", "queued": True})
+
+        await auto_register_user(email=sms_email, username=f"SMS_{clean_phone}", platform="sms")
+
+        result = await process_webhook_message(message_key, sms_email, message_text, "sms")
+        if result.get("duplicate"):
+            return jsonify({"status": "success", "duplicate": True})
+
+        # Modem/ADB delivery is blocking I/O
+        await in_thread(core.send_sms_response, full_phone, result["response"])
+
+        print(f"✅ SMS response sent to {phone_number}")
+        return jsonify({"status": "success"})
+
+    except Exception as e:
+        print(f"❌ SMS webhook error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+# ==================== DISPATCH ====================
+
+ASYNC_ROUTES = {"/chat", "/whatsapp-webhook", "/telegram-webhook", "/sms-webhook"}
+
+_flask_asgi = WsgiToAsgi(core.app)
+
+
+async def app(scope, receive, send):
+    """Async routes go to Quart, everything else to the Flask app"""
+    if scope["type"] == "lifespan" or scope.get("path") in ASYNC_ROUTES:
+        await quart_app(scope, receive, send)
+    else:
+        await _flask_asgi(scope, receive, send)
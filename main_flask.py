@@ -1,9 +1,7 @@
-from flask import Flask, request, jsonify, session
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from pymongo import MongoClient
 
 import re
-import certifi
 import os
 import threading
 import time
@@ -11,22 +9,45 @@ import serial
 import subprocess
 import requests
 import json
+import copy
+import queue
+import uuid
 from datetime import datetime
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AzureOpenAI
 from werkzeug.utils import secure_filename
 
 # Import your existing agents (NO CHANGES NEEDED)
-from agents.chat_agent import model_col, ChatAgent
+from agents.chat_agent import ChatAgent
 from agents.requir_recommender_agent import RecommenderAgent
 from agents.pricing_agent import PricingAgent
 from agents.report_agent import ReportAgent
+from agents.mongo_pool import LazyCollection, pool_stats
+from agents.model_catalog import get_model_catalog
+from agents.pipeline import StagePipeline
+from agents.fast_classifier import FAST_CLASSIFIER_ENABLED, fast_classifier
+from agents.response_cache import RESPONSE_CACHE_ENABLED, response_cache
+from agents.job_queue import JOB_QUEUE_ENABLED, get_job_queue
+from agents.dedup_store import dedup_store, webhook_message_key
+from agents.session_store import session_store
+from agents.conversation_buffer import remember_turn
+from agents.classify_batcher import classify_batcher_stats
+from agents.db_indexes import DB_INDEXES_AUTO, ensure_indexes_in_background
+from agents.platform_counters import platform_counters, prometheus_metrics
+from agents.extraction_pool import extraction_pool
+from agents.extraction_cache import extraction_cache, save_upload
+from agents.upload_store import (
+    UPLOAD_MAX_FILE_BYTES, UploadError, create_upload, extract_upload_job, get_upload, public_view,
+    resolve_upload_references, write_chunk
+)
 
 # ✅ Load .env variables
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
+# Werkzeug rejects larger request bodies with 413 instead of reading them
+app.config["MAX_CONTENT_LENGTH"] = UPLOAD_MAX_FILE_BYTES
 app.config["SESSION_TYPE"] = "filesystem"
 CORS(app)
 
@@ -36,16 +57,10 @@ user_db_name = os.getenv("USER_DB_NAME")
 users_collection_name = os.getenv("USERS_COLLECTION_NAME", "users")
 chats_collection_name = os.getenv("CHATS_COLLECTION_NAME", "chats")
 
-mongo_client = MongoClient(
-    mongo_uri,
-    tls=True,
-    tlsCAFile=certifi.where(),
-    serverSelectionTimeoutMS=20000
-)
-user_db = mongo_client[user_db_name]
-users_col = user_db[users_collection_name]
-chats_col = user_db[chats_collection_name]
-final_model_col = user_db["final_models"]
+# Collections resolve through the shared, fork-safe pool in agents/mongo_pool.py
+users_col = LazyCollection(user_db_name, users_collection_name)
+chats_col = LazyCollection(user_db_name, chats_collection_name)
+final_model_col = LazyCollection(user_db_name, "final_models")
 
 # ✅ Azure OpenAI Setup
 gpt_client = AzureOpenAI(
@@ -54,6 +69,13 @@ gpt_client = AzureOpenAI(
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
     default_headers={"azure-openai-deployment": os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")}
 )
+# Same deployment for the ASGI app's awaited stages (classify, follow-ups, reports)
+async_gpt_client = AsyncAzureOpenAI(
+    api_key=os.getenv("AZURE_OPENAI_KEY"),
+    api_version="2024-05-01-preview",
+    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+    default_headers={"azure-openai-deployment": os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")}
+)
 az_key = os.getenv("AZURE_OPENAI_KEY")
 az_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 assistant_id = os.getenv("AZURE_OPENAI_ASSISTANT_ID")
@@ -66,6 +88,19 @@ TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 USB_MODEM_PORT = os.getenv("USB_MODEM_PORT", "/dev/ttyUSB0")
 ANDROID_DEVICE_ID = os.getenv("ANDROID_DEVICE_ID")
 
+# Messages with at least this many words that the rule classifier marks as a
+# new requirement start recommendation + pricing while classification is
+# still running (0 disables speculation)
+SPECULATIVE_MIN_WORDS = int(os.getenv("SPECULATIVE_MIN_WORDS", "6"))
+# /chat/stream sends an SSE comment this often while a stage is still running,
+# so proxies don't close a quiet connection
+CHAT_STREAM_KEEPALIVE_SECONDS = float(os.getenv("CHAT_STREAM_KEEPALIVE_SECONDS", "10"))
+
+# Speculative stages by outcome; "wasted" ones had already started (an LLM
+# recommendation and an Assistants run) when classification disagreed
+speculation_counts = {"started": 0, "used": 0, "cancelled": 0, "wasted": 0}
+speculation_lock = threading.Lock()
+
 # 🆕 Keep-alive for Render (prevents sleeping)
 def keep_alive():
     """Ping self every 10 minutes to prevent Render from sleeping"""
@@ -78,10 +113,6 @@ def keep_alive():
             except Exception as e:
                 print(f"Keep-alive error: {e}")
 
-# Start keep-alive in background
-if os.getenv("RENDER"):
-    threading.Thread(target=keep_alive, daemon=True).start()
-
 # 🆕 Platform identification helper
 def identify_platform(email):
     """Identify which platform the user is from"""
@@ -100,20 +131,25 @@ def identify_platform(email):
 def auto_register_user(email, username, platform="unknown"):
     """Auto-register users from messaging platforms"""
     existing_user = users_col.find_one({"email": email})
-    
-    if not existing_user:
-        user_data = {
-            "username": username,
-            "email": email,
-            "password": "auto_generated",
-            "platform": platform,
-            "created_at": datetime.now()
-        }
-        users_col.insert_one(user_data)
-        print(f"✅ Auto-registered {platform} user: {email}")
-        return user_data
-    
-    return existing_user
+    if existing_user:
+        return existing_user
+
+    user_data = {
+        "username": username,
+        "email": email,
+        "password": "auto_generated",
+        "platform": platform,
+        "created_at": datetime.now()
+    }
+    # Concurrent first messages from one user race here; the unique email
+    # index lets exactly one of them insert
+    result = users_col.update_one({"email": email}, {"$setOnInsert": user_data}, upsert=True)
+    if result.upserted_id is None:
+        return users_col.find_one({"email": email})
+
+    platform_counters.incr("users", platform)
+    print(f"✅ Auto-registered {platform} user: {email}")
+    return {"_id": result.upserted_id, **user_data}
 
 # 🆕 Clean phone number helper
 def clean_phone_number(phone):
@@ -184,6 +220,7 @@ def signup():
         "platform": "web",
         "created_at": datetime.now()
     })
+    platform_counters.incr("users", "web")
 
     return jsonify({"status": "success", "message": "User registered successfully"})
 
@@ -205,13 +242,15 @@ def login():
     if existing_user["password"] != password:
         return jsonify({"status": "fail", "message": "Incorrect password"}), 401
     
-    session[f"chat_session_{existing_user['email']}"] = {
-        "shortlisted_models": [],
-        "current_model": None,
-        "rejected_models": [],
-        "original_requirement": "",
-        "username": existing_user["email"]
-    }
+    # Fresh conversation state; history and the last final model are kept
+    session_data, base = load_session(existing_user["email"])
+    session_data.update(
+        shortlisted_models=[],
+        current_model=None,
+        rejected_models=[],
+        original_requirement=""
+    )
+    store_session(existing_user["email"], session_data, base)
     
     print("✅ Login successful for:", email)
     return jsonify({"status": "success", "email": existing_user["email"]})
@@ -223,115 +262,454 @@ def chat():
     message = data.get("message")
     return process_chat_message(email, message, "web")
 
-# 🆕 Core chat processing function
-def process_chat_message(email, message, platform="web"):
-    """Core chat processing that works for all platforms"""
-    
-    try:
-        chat_agent = ChatAgent(gpt_client)
-        
-        session_key = f"chat_session_{email}"
-        session_data = session.get(session_key, {
-            "email": email,
-            "shortlisted_models": [],
-            "current_model": None,
-            "rejected_models": [],
-            "original_requirement": ""
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """
+    /chat as Server-Sent Events: {"status": <stage>} as each stage of the
+    turn starts (classify, recommend_and_price, pricing, ...), {"delta": ...}
+    events as the answer is generated, then one
+    {"done": true, "response": ..., "current_model": ...}
+    """
+    data = request.get_json()
+    email = data.get("email")
+    message = data.get("message")
+
+    def events():
+        # The turn runs on its own thread so stage changes reach the client
+        # while it works; nothing runs before the response has started
+        updates = queue.Queue()
+        session_data, base = load_session(email)
+
+        def turn():
+            try:
+                updates.put(("response", run_chat_turn(
+                    email, message, session_data, "web", stream=True,
+                    on_stage=lambda stage: updates.put(("status", stage))
+                )))
+            except Exception as e:
+                print(f"❌ Error processing chat message: {e}")
+                updates.put(("response", CHAT_ERROR_RESPONSE))
+
+        threading.Thread(target=turn, name="chat-stream-turn", daemon=True).start()
+        yield sse_event({"status": "started"})
+        while True:
+            try:
+                kind, value = updates.get(timeout=CHAT_STREAM_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if kind == "response":
+                response = value
+                break
+            yield sse_event({"status": value})
+
+        chunks = []
+        try:
+            for chunk in ([response] if isinstance(response, str) else response):
+                chunks.append(chunk)
+                yield sse_event({"delta": chunk})
+        finally:
+            # Persist whatever the client was shown, even if it disconnected
+            full_response = "".join(chunks)
+            if full_response:
+                save_chat(email, message, full_response, "web")
+                remember_turn(session_data, message, full_response)
+            store_session(email, session_data, base)
+        yield sse_event({
+            "done": True,
+            "response": full_response,
+            "current_model": session_data.get("current_model")
+        })
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# 🆕 Speculative recommend + price stage for likely new requirements
+def recommend_and_price(message, email):
+    """Recommendation followed by pricing, as one background stage"""
+    recommender = RecommenderAgent(gpt_client)
+    recommended = recommender.recommend_models(
+        analyzed_user_input=resolve_upload_references(email, message),
+        username=email,
+        is_new_requirement=1
+    )
+    pricing_agent = PricingAgent(assistant_id, az_key, az_endpoint)
+    return recommended, pricing_agent.analyze_pricing(recommended)
+
+def should_speculate(message, current_model=None):
+    """
+    Only when nothing has been recommended yet and the rule classifier is
+    already sure this is a new requirement: a wrong guess costs a full
+    recommendation and an Assistants run
+    """
+    if SPECULATIVE_MIN_WORDS <= 0 or not FAST_CLASSIFIER_ENABLED or current_model:
+        return False
+    if len((message or "").split()) < SPECULATIVE_MIN_WORDS:
+        return False
+    label, _, tier = fast_classifier.classify(message, current_model)
+    return label == "NewRequirement" and tier == "rule"
+
+def count_speculation(outcome):
+    with speculation_lock:
+        speculation_counts[outcome] += 1
+
+def start_speculation(pipeline, message, email, session_data):
+    if should_speculate(message, session_data.get("current_model")):
+        pipeline.submit("speculative", recommend_and_price, message, email)
+        count_speculation("started")
+
+def settle_speculation(pipeline, chat_response):
+    """Keep the speculative stage if the classifier agreed, otherwise drop it and count the waste"""
+    if not pipeline.has("speculative"):
+        return
+    if chat_response and chat_response["proceed"] and chat_response.get("action") == "NewRequirement":
+        count_speculation("used")
+    elif pipeline.discard("speculative"):
+        count_speculation("cancelled")
+    else:
+        count_speculation("wasted")
+        print("⚠️ Discarded a speculative recommendation that had already started")
+
+def speculation_stats():
+    with speculation_lock:
+        return {"min_words": SPECULATIVE_MIN_WORDS, **speculation_counts}
+
+def adopt_shortlist(session_data, names, reset_rejected=True):
+    session_data["shortlisted_models"] = names
+    session_data["current_model"] = (names or [None])[0]
+    if reset_rejected:
+        session_data["rejected_models"] = []
+
+def use_cached_report(email, message, cached, session_data):
+    """Same requirement answered before: reuse the report, skip all LLM stages"""
+    session_data["original_requirement"] = message
+    ReportAgent(gpt_client).save_final_model(email, message, cached["final_model"])
+    session_data.update(final_model=cached["final_model"], analyzed_input=message)
+    adopt_shortlist(session_data, cached["recommended"])
+    return cached["report"]
+
+def remember_report(session_data, requirement, report, final_model, recommended=None):
+    """Record the report's final model; new-requirement reports (with `recommended`) are also cached"""
+    session_data.update(final_model=final_model, analyzed_input=requirement)
+    if recommended is not None and RESPONSE_CACHE_ENABLED and recommended and final_model != "UNKNOWN":
+        response_cache.put(requirement, {
+            "recommended": recommended.names(),
+            "report": report,
+            "final_model": final_model
         })
 
-        chat_response = chat_agent.process_web_input(message, session_data, username=email)
+def new_session_data(email):
+    return {
+        "email": email,
+        "shortlisted_models": [],
+        "current_model": None,
+        "rejected_models": [],
+        "original_requirement": ""
+    }
+
+def load_session(email):
+    """(session_data, base): the server-side session and an untouched copy for store_session"""
+    session_data = session_store.load(email, lambda: new_session_data(email))
+    return session_data, copy.deepcopy(session_data)
 
-        if not chat_response or not chat_response["proceed"]:
-            response = chat_response["message"] if chat_response else "Could not process your request. Please try again."
+def store_session(email, session_data, base):
+    try:
+        session_store.save(email, session_data, base)
+        print(f"✅ Stored session for: {email}")
+    except Exception as e:
+        print(f"❌ Could not store session for {email}: {e}")
+
+# 🆕 Agent pipeline for one message, independent of Flask request state
+def run_chat_turn(email, message, session_data, platform="web", stream=False, on_stage=None):
+    """
+    Run the agents for one message; updates session_data in place and returns
+    the raw response. With stream=True, generated answers (reports and
+    follow-ups) are returned as an iterator of text chunks instead.
+    `on_stage` is called with each stage's name as the turn reaches it.
+    """
+    pipeline = StagePipeline(f"chat:{platform}", on_stage=on_stage)
+    chat_agent = ChatAgent(gpt_client)
+
+    # Warm the catalog and, for clear new requirements, start the heavy path
+    # early (unless an equivalent requirement has already been answered).
+    # Classification and the cache see the user's own words; upload:<id>
+    # references are expanded only for recommendation and the report.
+    pipeline.submit("catalog", get_model_catalog)
+    cached = pipeline.run("cache_lookup", response_cache.get, message) if RESPONSE_CACHE_ENABLED else None
+    if cached is None:
+        start_speculation(pipeline, message, email, session_data)
+
+    chat_response = pipeline.run(
+        "classify", chat_agent.process_web_input, message, session_data, username=email, stream=stream
+    )
+    # Wrong guess: cancelled if it hasn't started yet
+    settle_speculation(pipeline, chat_response)
+
+    if not chat_response or not chat_response["proceed"]:
+        if not chat_response:
+            response = NO_RESPONSE
         else:
-            action = chat_response.get("action")
+            response = chat_response.get("stream") or chat_response["message"]
+    else:
+        action = chat_response.get("action")
 
-            if action == "NewRequirement":
-                recommender = RecommenderAgent(gpt_client)
-                recommended = recommender.recommend_models(
-                    analyzed_user_input=message,
-                    username=email,
-                    is_new_requirement=1
-                )
+        if action == "NewRequirement" and cached is not None:
+            response = use_cached_report(email, message, cached, session_data)
 
-                pricing_agent = PricingAgent(assistant_id, az_key, az_endpoint)
-                pricing_info = pricing_agent.analyze_pricing(recommended)
+        elif action == "NewRequirement":
+            if pipeline.has("speculative"):
+                recommended, pricing_info = pipeline.result("speculative")
+            else:
+                recommended, pricing_info = pipeline.run("recommend_and_price", recommend_and_price, message, email)
 
-                session_data["original_requirement"] = message
-                print("👀 Saving for email:", email)
+            session_data["original_requirement"] = message
+            print("👀 Saving for email:", email)
 
-                report_agent = ReportAgent(gpt_client)
-                report = report_agent.generate_report(email, message, recommended, pricing_info)
+            def cache_report(report, final_model):
+                remember_report(session_data, message, report, final_model, recommended)
+
+            report_agent = ReportAgent(gpt_client)
+            requirement = resolve_upload_references(email, message)
+            if stream:
+                report = report_agent.stream_report(email, requirement, recommended, pricing_info, on_complete=cache_report)
+            else:
+                final_report = pipeline.run("report", report_agent.generate_report, email, requirement, recommended, pricing_info)
+                report = final_report.to_text() if final_report else REPORT_ERROR_RESPONSE
+                if final_report:
+                    cache_report(report, final_report.model_name)
+
+            adopt_shortlist(session_data, recommended.names())
+            response = report
+
+        elif action == "FollowUp":
+            response = chat_response["message"]
+
+        elif action == "ModelRejection":
+            recommender = RecommenderAgent(gpt_client)
+            original_requirement = chat_response.get("requirement", "")
+            rejected_models = session_data.get("rejected_models", [])
+
+            requirement = resolve_upload_references(email, original_requirement)
+            recommended = pipeline.run(
+                "recommend",
+                recommender.recommend_models,
+                analyzed_user_input=requirement,
+                username=email,
+                is_new_requirement=0
+            )
+
+            if not recommended:
+                response = NO_MORE_MODELS_RESPONSE
+            else:
+                pricing_agent = PricingAgent(assistant_id, az_key, az_endpoint)
+                pricing_info = pipeline.run("pricing", pricing_agent.analyze_pricing, recommended)
 
-                session_data["shortlisted_models"] = recommended
-                session_data["current_model"] = recommended[0] if recommended else None
-                session_data["rejected_models"] = []
+                def remember_final_model(report, final_model):
+                    remember_report(session_data, original_requirement, report, final_model)
 
+                report_agent = ReportAgent(gpt_client)
+                if stream:
+                    report = report_agent.stream_report(
+                        email, requirement, recommended, pricing_info, on_complete=remember_final_model
+                    )
+                else:
+                    final_report = pipeline.run(
+                        "report", report_agent.generate_report, email, requirement, recommended, pricing_info
+                    )
+                    report = final_report.to_text() if final_report else REPORT_ERROR_RESPONSE
+                    if final_report:
+                        remember_final_model(report, final_report.model_name)
+
+                adopt_shortlist(session_data, recommended.names(), reset_rejected=False)
                 response = report
 
-            elif action == "FollowUp":
-                response = chat_response["message"]
+        else:
+            response = UNCLEAR_RESPONSE
+
+    pipeline.log_timings()
+    return response
+
+def save_chat(email, message, response, platform):
+    chats_col.insert_one({
+        "email": email, 
+        "message": message, 
+        "response": response, 
+        "platform": platform,
+        "timestamp": datetime.now()
+    })
+    platform_counters.incr("chats", platform)
 
-            elif action == "ModelRejection":
-                recommender = RecommenderAgent(gpt_client)
-                original_requirement = chat_response.get("requirement", "")
-                rejected_models = session_data.get("rejected_models", [])
+CHAT_ERROR_RESPONSE = "Sorry, I'm having trouble processing your request right now. Please try again."
+REPORT_ERROR_RESPONSE = "Error generating report: the final analysis could not be completed. Please try again."
+NO_RESPONSE = "Could not process your request. Please try again."
+NO_MORE_MODELS_RESPONSE = "No more suitable models found. Would you like to try a different approach or modify your requirements?"
+UNCLEAR_RESPONSE = "I'm here to help with AI model recommendations. Could you please clarify what you need?"
 
-                recommended = recommender.recommend_models(
-                    analyzed_user_input=original_requirement,
-                    username=email,
-                    is_new_requirement=0
-                )
+# 🆕 Core chat processing function
+def handle_chat_message(email, message, platform="web"):
+    """One chat turn, saved and formatted for the platform; raises if the turn fails"""
+    # Server-side session, so webhook and background turns keep state too
+    session_data, base = load_session(email)
 
-                if not recommended:
-                    response = "No more suitable models found. Would you like to try a different approach or modify your requirements?"
-                else:
-                    pricing_agent = PricingAgent(assistant_id, az_key, az_endpoint)
-                    pricing_info = pricing_agent.analyze_pricing(recommended)
+    response = run_chat_turn(email, message, session_data, platform)
 
-                    report_agent = ReportAgent(gpt_client)
-                    report = report_agent.generate_report(email, original_requirement, recommended, pricing_info)
+    save_chat(email, message, response, platform)
+    remember_turn(session_data, message, response)
+    store_session(email, session_data, base)
 
-                    session_data["shortlisted_models"] = recommended
-                    session_data["current_model"] = recommended[0] if recommended else None
+    return {
+        "response": format_for_platform(response, platform),
+        "current_model": session_data.get("current_model")
+    }
 
-                    response = report
+def process_chat_message(email, message, platform="web"):
+    """Core chat processing that works for all platforms"""
+    try:
+        result = handle_chat_message(email, message, platform)
+    except Exception as e:
+        print(f"❌ Error processing chat message: {e}")
+        result = {"response": CHAT_ERROR_RESPONSE, "current_model": None}
+    return jsonify(result) if platform == "web" else result
+
+# ==================== WEBHOOK DEDUPLICATION ====================
+
+def claim_webhook_message(message_key):
+    """True the first time a platform message ID is seen; redeliveries return False"""
+    if not message_key:
+        return True
+    is_new, _ = dedup_store.claim(message_key)
+    if not is_new:
+        print(f"🔁 Duplicate webhook delivery {message_key}, skipping")
+    return is_new
+
+def finish_webhook_message(message_key, response):
+    """Remember the reply for a message ID; failed turns are released so a redelivery retries"""
+    if not message_key:
+        return
+    if response == CHAT_ERROR_RESPONSE:
+        dedup_store.release(message_key)
+    else:
+        dedup_store.complete(message_key, response)
+
+def process_webhook_message(message_key, email, message, platform):
+    """process_chat_message at most once per platform message ID; repeats get the cached reply"""
+    if message_key:
+        is_new, cached_response = dedup_store.claim(message_key)
+        if not is_new:
+            print(f"🔁 Duplicate webhook delivery {message_key}, returning cached reply")
+            return {"response": cached_response, "current_model": None, "duplicate": True}
+
+    result = process_chat_message(email, message, platform)
+    finish_webhook_message(message_key, result["response"])
+    return result
+
+# ==================== BACKGROUND JOBS ====================
+
+def chat_turn_job(payload):
+    """
+    Queued webhook message: run the turn, then queue the reply for delivery.
+    A failed turn raises so the queue retries it. The reply is stored under
+    the message key first, so a retry after that (e.g. the delivery could
+    not be queued) sends the stored reply instead of running the turn again.
+    """
+    platform = payload["platform"]
+    message_key = payload.get("message_key") or payload.get("turn_key")
+    response = dedup_store.response(message_key) if message_key else None
+    if response is None:
+        auto_register_user(email=payload["email"], username=payload["username"], platform=platform)
+        response = handle_chat_message(payload["email"], payload["message"], platform)["response"]
+        if message_key:
+            dedup_store.complete(message_key, response)
+    else:
+        print(f"🔁 Turn {message_key} already answered; delivering the stored reply")
 
-            else:
-                response = "I'm here to help with AI model recommendations. Could you please clarify what you need?"
+    # Deliveries get their own lane so a slow next turn never delays this reply
+    get_job_queue().enqueue("deliver_reply", f"deliver:{payload['email']}", {
+        "platform": platform,
+        "to": payload["to"],
+        "response": response
+    })
 
-        session[session_key] = session_data
-        print(f"✅ Stored session for: {email} ({platform})")
+def chat_turn_failed(payload, error):
+    """
+    A queued turn that used up its attempts: free its message ID so a
+    platform redelivery is processed again, and tell the user it failed
+    """
+    if payload.get("message_key"):
+        dedup_store.release(payload["message_key"])
+    print(f"❌ Chat turn for {payload['email']} failed permanently: {error}")
+    get_job_queue().enqueue("deliver_reply", f"deliver:{payload['email']}", {
+        "platform": payload["platform"],
+        "to": payload["to"],
+        "response": CHAT_ERROR_RESPONSE
+    })
 
-        chats_col.insert_one({
-            "email": email, 
-            "message": message, 
-            "response": response, 
+def deliver_reply_job(payload):
+    """Send a finished reply; raising makes the queue retry with backoff"""
+    if payload["platform"] == "telegram":
+        delivered = send_telegram_message(payload["to"], payload["response"])
+    else:
+        delivered = send_sms_response(payload["to"], payload["response"])
+    if not delivered:
+        raise RuntimeError(f"{payload['platform']} delivery to {payload['to']} failed")
+
+def enqueue_chat_turn(email, username, message, platform, to, message_key=None):
+    try:
+        return get_job_queue().enqueue("chat_turn", email, {
+            "email": email,
+            "username": username,
+            "message": message,
             "platform": platform,
-            "timestamp": datetime.now()
+            "to": to,
+            "message_key": message_key,
+            # Where the reply is stored when the platform gives no message ID
+            "turn_key": None if message_key else f"turn:{uuid.uuid4().hex}"
         })
-        
-        formatted_response = format_for_platform(response, platform)
-        
-        if platform == "web":
-            return jsonify({
-                "response": formatted_response,
-                "current_model": session_data.get("current_model")
-            })
-        else:
-            return {
-                "response": formatted_response,
-                "current_model": session_data.get("current_model")
-            }
-            
-    except Exception as e:
-        print(f"❌ Error processing chat message: {e}")
-        error_response = "Sorry, I'm having trouble processing your request right now. Please try again."
-        
-        if platform == "web":
-            return jsonify({"response": error_response, "current_model": None})
-        else:
-            return {"response": error_response, "current_model": None}
+    except Exception:
+        # Not queued, so a redelivery must be allowed through
+        if message_key:
+            dedup_store.release(message_key)
+        raise
+
+# ==================== BACKGROUND SERVICES ====================
+
+_services_started = False
+_services_lock = threading.Lock()
+
+def start_background_services():
+    """
+    Keep-alive, index bootstrap and job-queue workers. Started by the server
+    entry points rather than at import, so processes that only import this
+    module (extraction workers, scripts) don't claim jobs or ping Render.
+    """
+    global _services_started
+    with _services_lock:
+        if _services_started:
+            return
+        _services_started = True
+
+    if os.getenv("RENDER"):
+        threading.Thread(target=keep_alive, daemon=True).start()
+
+    # Declare the indexes hot queries rely on (idempotent; see agents/db_indexes.py)
+    if DB_INDEXES_AUTO:
+        ensure_indexes_in_background()
+
+    if JOB_QUEUE_ENABLED:
+        job_queue = get_job_queue()
+        job_queue.register("chat_turn", chat_turn_job, on_failure=chat_turn_failed)
+        job_queue.register("deliver_reply", deliver_reply_job)
+        job_queue.register("extract_upload", extract_upload_job)
+        job_queue.start()
+
+@app.before_request
+def ensure_background_services():
+    # Covers WSGI servers that import `app` (gunicorn main_flask:app)
+    if not _services_started:
+        start_background_services()
 
 # ==================== WHATSAPP INTEGRATION ====================
 
@@ -362,13 +740,15 @@ def whatsapp_webhook():
             platform="whatsapp"
         )
         
-        result = process_chat_message(full_phone, message_text, "whatsapp")
+        message_key = webhook_message_key("whatsapp", data)
+        result = process_webhook_message(message_key, full_phone, message_text, "whatsapp")
         
         print(f"✅ WhatsApp response sent to {phone_number}")
         return jsonify({
             "status": "success",
-            "response": result["response"],
-            "to": phone_number
+            "response": result["response"] or "",
+            "to": phone_number,
+            "duplicate": result.get("duplicate", False)
         })
         
     except Exception as e:
@@ -398,6 +778,15 @@ def telegram_webhook():
             return handle_telegram_command(chat_id, message_text, username)
         
         telegram_email = f"telegram_{chat_id}"
+        message_key = webhook_message_key("telegram", data)
+
+        if JOB_QUEUE_ENABLED:
+            if not claim_webhook_message(message_key):
+                return jsonify({"status": "success", "duplicate": True})
+            # Acknowledge right away so Telegram doesn't redeliver slow turns
+            enqueue_chat_turn(telegram_email, f"Telegram_{username}", message_text, "telegram", chat_id, message_key)
+            print(f"📥 Telegram message from {chat_id} queued")
+            return jsonify({"status": "success", "queued": True})
         
         auto_register_user(
             email=telegram_email,
@@ -405,7 +794,10 @@ def telegram_webhook():
             platform="telegram"
         )
         
-        result = process_chat_message(telegram_email, message_text, "telegram")
+        result = process_webhook_message(message_key, telegram_email, message_text, "telegram")
+        if result.get("duplicate"):
+            # The first delivery already replied
+            return jsonify({"status": "success", "duplicate": True})
         
         send_telegram_message(chat_id, result["response"])
         
@@ -416,11 +808,10 @@ def telegram_webhook():
         print(f"❌ Telegram webhook error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
-def handle_telegram_command(chat_id, command, username):
-    """Handle Telegram bot commands"""
-    try:
-        if command == "/start":
-            welcome_msg = f"""🤖 Welcome to AI Model Selector Bot, {username}!
+def telegram_command_reply(command, username):
+    """Text for a Telegram bot command"""
+    if command == "/start":
+        return f"""🤖 Welcome to AI Model Selector Bot, {username}!
 
 I help you find the perfect AI model for your needs.
 
@@ -430,11 +821,9 @@ I help you find the perfect AI model for your needs.
 • "I want to build a chatbot"
 
 🚀 What AI task can I help you with today?"""
-            
-            send_telegram_message(chat_id, welcome_msg)
-            
-        elif command == "/help":
-            help_msg = """🆘 How to use AI Model Selector:
+
+    elif command == "/help":
+        return """🆘 How to use AI Model Selector:
 
 1️⃣ Describe your AI need
 2️⃣ Get personalized recommendations  
@@ -446,12 +835,13 @@ I help you find the perfect AI model for your needs.
 • "Help me choose between GPT models"
 
 Need help? Just ask! 😊"""
-            
-            send_telegram_message(chat_id, help_msg)
-            
-        else:
-            send_telegram_message(chat_id, "Unknown command. Type /help for assistance.")
-        
+
+    return "Unknown command. Type /help for assistance."
+
+def handle_telegram_command(chat_id, command, username):
+    """Handle Telegram bot commands"""
+    try:
+        send_telegram_message(chat_id, telegram_command_reply(command, username))
         return jsonify({"status": "success"})
         
     except Exception as e:
@@ -506,6 +896,14 @@ def sms_webhook():
         
         full_phone = f"91{clean_phone}"
         sms_email = f"sms_{full_phone}"
+        message_key = webhook_message_key("sms", data)
+
+        if JOB_QUEUE_ENABLED:
+            if not claim_webhook_message(message_key):
+                return jsonify({"status": "success", "duplicate": True})
+            enqueue_chat_turn(sms_email, f"SMS_{clean_phone}", message_text, "sms", full_phone, message_key)
+            print(f"📥 SMS from {phone_number} queued")
+            return jsonify({"status": "success", "queued": True})
         
         auto_register_user(
             email=sms_email,
@@ -513,7 +911,9 @@ def sms_webhook():
             platform="sms"
         )
         
-        result = process_chat_message(sms_email, message_text, "sms")
+        result = process_webhook_message(message_key, sms_email, message_text, "sms")
+        if result.get("duplicate"):
+            return jsonify({"status": "success", "duplicate": True})
         
         send_sms_response(full_phone, result["response"])
         
@@ -596,11 +996,13 @@ def send_sms_via_android_adb(phone_number, message):
 def platform_status():
     """Get status of all platforms - used by UptimeRobot"""
     try:
-        web_users = users_col.count_documents({"platform": "web"})
-        whatsapp_users = users_col.count_documents({"platform": "whatsapp"})
-        telegram_users = users_col.count_documents({"platform": "telegram"})
-        sms_users = users_col.count_documents({"platform": "sms"})
-        total_chats = chats_col.count_documents({})
+        # Maintained incrementally (agents/platform_counters.py), not counted per hit
+        totals = platform_counters.totals()
+        web_users = totals["users"].get("web", 0)
+        whatsapp_users = totals["users"].get("whatsapp", 0)
+        telegram_users = totals["users"].get("telegram", 0)
+        sms_users = totals["users"].get("sms", 0)
+        total_chats = sum(totals["chats"].values())
         
         return jsonify({
             "status": "healthy",
@@ -613,11 +1015,26 @@ def platform_status():
             },
             "total_users": web_users + whatsapp_users + telegram_users + sms_users,
             "total_chats": total_chats,
+            "database": pool_stats(),
+            "response_cache": response_cache.stats(),
+            "job_queue": get_job_queue().stats() if JOB_QUEUE_ENABLED else {"enabled": False},
+            "webhook_dedup": dedup_store.stats(),
+            "sessions": session_store.stats(),
+            "classifier_batching": classify_batcher_stats(),
+            "speculation": speculation_stats(),
+            "extraction_pool": extraction_pool.stats(),
+            "extraction_cache": extraction_cache.stats(),
+            "counters": platform_counters.stats(),
             "environment": "production" if os.getenv("RENDER") else "development"
         })
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Platform counters in Prometheus text format"""
+    return Response(prometheus_metrics(platform_counters.totals()), mimetype="text/plain; version=0.0.4")
+
 @app.route("/set-telegram-webhook", methods=["POST"])
 def set_telegram_webhook():
     """Set Telegram webhook URL"""
@@ -663,19 +1080,60 @@ def upload():
         file = request.files.get("file")
         if file:
             filename = secure_filename(file.filename)
-            filepath = os.path.join("uploads", filename)
-            os.makedirs("uploads", exist_ok=True)
-            file.save(filepath)
-            return jsonify({"status": "success", "file": filename})
+            # Identical content is stored once, whoever uploads it
+            _, sha256, deduplicated = save_upload(file.stream, filename)
+            return jsonify({"status": "success", "file": filename, "sha256": sha256, "deduplicated": deduplicated})
         return jsonify({"status": "fail", "message": "No file provided"}), 400
     except Exception as e:
         return jsonify({"status": "fail", "message": str(e)}), 400
 
+# 🆕 Resumable chunked uploads: open, then PUT chunks at ?offset= until complete
+def upload_error(e):
+    return jsonify({"status": "fail", "message": str(e), **e.details}), e.status
+
+@app.route("/uploads", methods=["POST"])
+def open_upload():
+    data = request.get_json() or {}
+    try:
+        doc = create_upload(data.get("email"), secure_filename(data.get("filename") or ""), data.get("size"))
+        return jsonify({"status": "success", **public_view(doc)}), 201
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({"status": "fail", "message": str(e)}), 500
+
+@app.route("/uploads/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    """Raw chunk bytes as the body; ?email=...&offset=<bytes received so far>"""
+    try:
+        offset = request.args.get("offset", type=int)
+        if offset is None or offset < 0:
+            raise UploadError("offset is required")
+        # Read from the socket in blocks; the body is never buffered whole
+        doc = write_chunk(upload_id, request.args.get("email"), offset, request.stream, request.content_length)
+        return jsonify({"status": "success", **public_view(doc)})
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({"status": "fail", "message": str(e)}), 500
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    """Progress (received bytes to resume from) and extraction status"""
+    try:
+        return jsonify({"status": "success", **public_view(get_upload(upload_id, request.args.get("email")))})
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        return jsonify({"status": "fail", "message": str(e)}), 500
+
 @app.route("/clear_chat", methods=["POST"])
 def clear_chat():
     try:
         email = request.get_json().get("username")
         deleted = chats_col.delete_many({"email": email})
+        platform_counters.incr("chats", identify_platform(email), -deleted.deleted_count)
+        session_store.delete(email)
         return jsonify({"status": "cleared", "deleted_count": deleted.deleted_count})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -692,7 +1150,9 @@ def logout_user():
         print(f"🔐 Logout request received for: {email}")
 
         deleted_chats = chats_col.delete_many({"email": email})
+        platform_counters.incr("chats", identify_platform(email), -deleted_chats.deleted_count)
         deleted_models = final_model_col.delete_many({"email": email})
+        session_store.delete(email)
 
         print(f"🧹 Deleted {deleted_chats.deleted_count} chats.")
         print(f"🧹 Deleted {deleted_models.deleted_count} final models.")
@@ -732,10 +1192,12 @@ def root():
         },
         "endpoints": {
             "web_chat": "/chat",
+            "web_chat_stream": "/chat/stream",
             "whatsapp_webhook": "/whatsapp-webhook", 
             "telegram_webhook": "/telegram-webhook",
             "sms_webhook": "/sms-webhook",
-            "platform_status": "/platform-status"
+            "platform_status": "/platform-status",
+            "metrics": "/metrics"
         }
     })
 
@@ -769,6 +1231,14 @@ if __name__ == "__main__":
     print("   5. Test with friends!")
     print("=" * 50)
     
-    # Start the Flask app
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
+
+    if os.getenv("SERVER_MODE", "wsgi").lower() == "asgi":
+        # Async chat/webhook endpoints (see asgi_app.py)
+        import uvicorn
+        print("⚡ Serving in ASGI mode")
+        uvicorn.run("asgi_app:app", host="0.0.0.0", port=port)
+    else:
+        # Start the Flask app
+        start_background_services()
+        app.run(host="0.0.0.0", port=port, debug=False)
\ No newline at end of file
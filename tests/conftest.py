@@ -0,0 +1,15 @@
+# Shared test setup: the repo root on sys.path and no network access
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def offline_token_counts(monkeypatch):
+    """tiktoken downloads its tables on first use; estimate from length instead"""
+    from agents import catalog_search
+    monkeypatch.setattr(catalog_search, "_encoding", False)
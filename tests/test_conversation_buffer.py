@@ -0,0 +1,63 @@
+from agents import conversation_buffer
+from agents.conversation_buffer import _trim
+
+
+def _turn(message, tokens, response=None):
+    turn = {"message": message, "tokens": tokens}
+    if response is not None:
+        turn["response"] = response
+    return turn
+
+
+def test_keeps_history_within_budget(monkeypatch):
+    monkeypatch.setattr(conversation_buffer, "CONVERSATION_TOKEN_BUDGET", 100)
+    state = {"history": [_turn(f"q{i}", 40) for i in range(4)]}
+    _trim(state)
+    assert [t["message"] for t in state["history"]] == ["q2", "q3"]
+
+
+def test_keeps_at_most_session_history_turns(monkeypatch):
+    monkeypatch.setattr(conversation_buffer, "SESSION_HISTORY_TURNS", 3)
+    state = {"history": [_turn(f"q{i}", 1) for i in range(5)]}
+    _trim(state)
+    assert [t["message"] for t in state["history"]] == ["q2", "q3", "q4"]
+
+
+def test_last_turn_is_kept_even_over_budget(monkeypatch):
+    monkeypatch.setattr(conversation_buffer, "CONVERSATION_TOKEN_BUDGET", 10)
+    state = {"history": [_turn("old", 5), _turn("huge", 50)]}
+    _trim(state)
+    assert [t["message"] for t in state["history"]] == ["huge"]
+
+
+def test_dropped_turns_are_summarized(monkeypatch):
+    monkeypatch.setattr(conversation_buffer, "CONVERSATION_TOKEN_BUDGET", 50)
+    monkeypatch.setattr(conversation_buffer, "CONVERSATION_SUMMARY", True)
+    state = {
+        "history_summary": "- User: earlier question",
+        "history": [
+            _turn("OCR for invoices", 40, "Model Name: Azure Document Intelligence\nPrice: $1"),
+            _turn("and for receipts?", 40),
+        ],
+    }
+    _trim(state)
+    assert state["history_summary"].splitlines() == [
+        "- User: earlier question",
+        "- User: OCR for invoices → recommended Azure Document Intelligence",
+    ]
+
+
+def test_summary_keeps_most_recent_lines(monkeypatch):
+    monkeypatch.setattr(conversation_buffer, "SESSION_HISTORY_TURNS", 1)
+    monkeypatch.setattr(conversation_buffer, "CONVERSATION_SUMMARY_TOKENS", 10)
+    state = {"history": [_turn(f"question number {i}", 1) for i in range(6)]}
+    _trim(state)
+    lines = state["history_summary"].splitlines()
+    assert lines[-1] == "- User: question number 4"
+    assert len(lines) < 5
+
+
+def test_counts_tokens_of_turns_stored_without_them():
+    state = {"history": [{"message": "hello", "response": "hi there"}]}
+    _trim(state)
+    assert state["history"][0]["tokens"] > 0
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from agents.dedup_store import DedupStore  # noqa: E402
+from agents.job_queue import JobQueue  # noqa: E402
+
+
+@pytest.fixture
+def store():
+    return DedupStore(collection=mongomock.MongoClient().db.webhook_dedup)
+
+
+def test_redelivery_is_a_duplicate_until_completed(store):
+    assert store.claim("telegram:1") == (True, None)
+    assert store.claim("telegram:1") == (False, None)
+    store.complete("telegram:1", "reply")
+    assert store.claim("telegram:1") == (False, "reply")
+    assert store.response("telegram:1") == "reply"
+
+
+def test_completion_restarts_the_ttl(store):
+    store.claim("telegram:1")
+    claimed_at = datetime.utcnow() - timedelta(days=2)
+    store.collection.update_one({"_id": "telegram:1"}, {"$set": {"created_at": claimed_at}})
+    store.complete("telegram:1", "reply")
+    assert store.collection.find_one({"_id": "telegram:1"})["created_at"] > claimed_at
+
+
+def test_redelivery_goes_through_after_the_queued_turn_fails(store, tmp_path):
+    queue = JobQueue(path=str(tmp_path / "jobs.db"), workers=0, max_attempts=1)
+    queue.register("chat_turn", lambda payload: None,
+                   on_failure=lambda payload, error: store.release(payload["message_key"]))
+
+    assert store.claim("telegram:7")[0]
+    queue.enqueue("chat_turn", "alice", {"message_key": "telegram:7"})
+    # A redelivery while the turn is queued is dropped
+    assert store.claim("telegram:7") == (False, None)
+
+    queue._finish(queue._claim(), "RuntimeError('turn failed')")
+    assert queue.stats()["failed"] == 1
+    # Fresh process memory or not, the platform's redelivery is processed again
+    assert store.claim("telegram:7") == (True, None)
+    assert DedupStore(collection=store.collection).claim("telegram:7") == (False, None)
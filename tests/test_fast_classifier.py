@@ -0,0 +1,46 @@
+import pytest
+
+from agents.fast_classifier import FastClassifier
+
+FOLLOW_UPS = [
+    "I need to know the price of this model for 1M tokens",
+    "what is the best way to deploy this model for production",
+    "suggest how to fine tune this model for my data",
+    "I need this model to work for Hindi, can it?",
+]
+
+
+@pytest.fixture
+def classifier():
+    return FastClassifier(use_model=False)
+
+
+@pytest.mark.parametrize("message", FOLLOW_UPS)
+def test_follow_ups_about_the_current_model_go_to_the_llm(classifier, message):
+    label, _, _ = classifier.classify(message, current_model="Azure Document Intelligence")
+    assert label is None
+
+
+@pytest.mark.parametrize("message", FOLLOW_UPS)
+def test_back_references_go_to_the_llm_without_a_current_model(classifier, message):
+    assert classifier.classify(message)[0] is None
+
+
+def test_clear_new_requirement_without_a_current_model(classifier):
+    label, confidence, tier = classifier.classify("I need an AI model for extracting tables from invoices")
+    assert (label, tier) == ("NewRequirement", "rule") and confidence >= 0.9
+
+
+def test_new_requirement_rule_is_skipped_once_a_model_is_recommended(classifier):
+    message = "I need an AI model for extracting tables from invoices"
+    assert classifier.classify(message, current_model="GPT-4o")[0] is None
+
+
+def test_short_rejection_needs_a_current_model(classifier):
+    assert classifier.classify("another one please", current_model="GPT-4o")[0] == "ModelRejection"
+    assert classifier.classify("another one please")[0] is None
+
+
+def test_greetings_and_goodbyes(classifier):
+    assert classifier.classify("hi there!")[0] == "Greeting"
+    assert classifier.classify("thanks, bye", current_model="GPT-4o")[0] == "Goodbye"
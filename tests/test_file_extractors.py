@@ -0,0 +1,51 @@
+from agents import file_extractors
+from agents.file_extractors import _iter_table
+
+
+def _table(rows, **kwargs):
+    return "".join(_iter_table(rows, **kwargs))
+
+
+def test_small_table_is_returned_row_by_row(monkeypatch):
+    monkeypatch.setattr(file_extractors, "FILE_TABLE_SAMPLE_ROWS", 5)
+    rows = [("name", "score"), ("a", 1), ("b", None)]
+    assert _table(rows) == "name, score\na, 1\nb, "
+
+
+def test_empty_table():
+    assert _table([]) == ""
+
+
+def test_large_table_is_summarized(monkeypatch):
+    monkeypatch.setattr(file_extractors, "FILE_TABLE_SAMPLE_ROWS", 2)
+    rows = [("id", "city", None)] + [(i, "Paris" if i % 2 else "Oslo", "") for i in range(1, 11)]
+    text = _table(rows, title="Sheet1 ")
+
+    assert text.startswith("Sheet1 Table: 10 rows x 3 columns\n")
+    assert "- id: numeric, min 1, max 10, mean 5.5" in text
+    assert "- city: text, 2 distinct, e.g. Paris, Oslo" in text
+    assert "- column 3: text, 0 distinct, e.g.  (10 empty)" in text
+    assert text.endswith("First 2 rows:\nid, city, \n1, Paris, \n2, Oslo, ")
+
+
+def test_high_cardinality_column_is_free_text(monkeypatch):
+    monkeypatch.setattr(file_extractors, "FILE_TABLE_SAMPLE_ROWS", 1)
+    rows = [("comment",)] + [(f"note {i}",) for i in range(30)]
+    assert "- comment: text, more than 20 distinct values" in _table(rows)
+
+
+def test_scan_limit_reads_no_further(monkeypatch):
+    monkeypatch.setattr(file_extractors, "FILE_TABLE_SAMPLE_ROWS", 2)
+    monkeypatch.setattr(file_extractors, "FILE_TABLE_SCAN_ROWS", 5)
+    consumed = []
+
+    def rows():
+        yield ("n",)
+        for i in range(1000):
+            consumed.append(i)
+            yield (i,)
+
+    text = _table(rows())
+    assert text.startswith("Table: more than 5 rows x 1 columns (statistics from the first 5 rows)")
+    assert "- n: numeric, min 0, max 4, mean 2" in text
+    assert len(consumed) <= 6
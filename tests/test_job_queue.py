@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from agents import job_queue
+from agents.job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    # No worker threads: the tests claim jobs themselves
+    return JobQueue(path=str(tmp_path / "jobs.db"), workers=0, max_attempts=2)
+
+
+def test_claims_oldest_first_across_users(queue):
+    first = queue.enqueue("chat", "alice", {"n": 1})
+    second = queue.enqueue("chat", "bob", {"n": 2})
+    assert queue._claim()["id"] == first
+    assert queue._claim()["id"] == second
+    assert queue._claim() is None
+
+
+def test_one_running_job_per_user(queue):
+    first = queue.enqueue("chat", "alice", {"n": 1})
+    queue.enqueue("chat", "alice", {"n": 2})
+    other = queue.enqueue("chat", "bob", {"n": 3})
+
+    job = queue._claim()
+    assert job["id"] == first and job["payload"] == {"n": 1} and job["attempts"] == 1
+    # alice's second job waits for the first; bob's can run
+    assert queue._claim()["id"] == other
+    assert queue._claim() is None
+
+    queue._finish(job)
+    assert queue._claim()["payload"] == {"n": 2}
+
+
+def test_retrying_job_blocks_later_jobs_of_its_user(queue):
+    first = queue.enqueue("chat", "alice", {"n": 1})
+    queue.enqueue("chat", "alice", {"n": 2})
+
+    queue._finish(queue._claim(), "boom")
+    # Backing off, but still ahead of the user's next job
+    assert queue._claim() is None
+
+    queue._conn().execute("UPDATE jobs SET available_at = ? WHERE id = ?", (time.time() - 1, first))
+    job = queue._claim()
+    assert job["id"] == first and job["attempts"] == 2
+
+
+def test_failed_job_releases_the_user(queue):
+    queue.enqueue("chat", "alice", {"n": 1})
+    queue.max_attempts = 1
+    queue._finish(queue._claim(), "boom")
+    queue.enqueue("chat", "alice", {"n": 2})
+    assert queue._claim()["payload"] == {"n": 2}
+    assert queue.stats()["failed"] == 1
+
+
+def test_expired_lease_is_claimed_again(queue):
+    job_id = queue.enqueue("chat", "alice", {"n": 1})
+    queue._claim()
+    assert queue._claim() is None
+
+    queue._conn().execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() - 1, job_id))
+    job = queue._claim()
+    assert job["id"] == job_id and job["attempts"] == 2
+
+
+def test_delayed_job_is_not_claimed_early(queue):
+    queue.enqueue("chat", "alice", {"n": 1}, delay=60)
+    assert queue._claim() is None
+
+
+def test_failure_handler_runs_once_after_the_last_attempt(queue):
+    failures = []
+    queue.register("chat", lambda payload: None, on_failure=lambda payload, error: failures.append((payload, error)))
+    job_id = queue.enqueue("chat", "alice", {"n": 1})
+
+    queue._finish(queue._claim(), "first")
+    assert failures == []
+    queue._conn().execute("UPDATE jobs SET available_at = ? WHERE id = ?", (time.time() - 1, job_id))
+    queue._finish(queue._claim(), "second")
+    assert failures == [({"n": 1}, "second")]
+
+
+def test_running_job_keeps_its_lease(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_LEASE_SECONDS", 0.3)
+    path = str(tmp_path / "jobs.db")
+    worker = JobQueue(path=path, workers=1)
+    other = JobQueue(path=path, workers=0)
+    started, release, runs = threading.Event(), threading.Event(), []
+
+    def slow(payload):
+        runs.append(payload)
+        started.set()
+        release.wait(5)
+
+    worker.register("chat", slow)
+    try:
+        worker.enqueue("chat", "alice", {"n": 1})
+        assert started.wait(5)
+        # Well past the original lease, the job is still not claimable
+        deadline = time.time() + 1.0
+        while time.time() < deadline:
+            assert other._claim() is None
+            time.sleep(0.05)
+    finally:
+        release.set()
+        worker.stop()
+    assert runs == [{"n": 1}]
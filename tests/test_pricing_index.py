@@ -0,0 +1,51 @@
+import time
+
+from agents.pricing_index import PricingIndex
+
+
+def test_lookup_normalizes_names_and_providers():
+    index = PricingIndex()
+    index.put("**GPT-4o (Azure)**", "$5", provider="Azure OpenAI")
+    assert index.lookup("gpt-4o", "azure")["price"] == "$5"
+    assert index.lookup("GPT-4o", "Microsoft Azure")["price"] == "$5"
+
+
+def test_lookup_never_returns_another_providers_price():
+    index = PricingIndex()
+    index.put("Llama 3", "$1", provider="AWS")
+    assert index.lookup("llama 3", "gcp") is None
+    assert index.lookup("llama 3", "aws")["price"] == "$1"
+
+
+def test_lookup_falls_back_to_a_price_without_provider():
+    index = PricingIndex()
+    index.put("Whisper", "$0.006")
+    assert index.lookup("whisper", "azure")["price"] == "$0.006"
+
+
+def test_lookup_without_provider_takes_any_provider():
+    index = PricingIndex()
+    index.put("Claude", "$3", provider="AWS")
+    assert index.lookup("claude")["provider"] == "AWS"
+    assert index.lookup("unknown model") is None
+
+
+def test_expired_entry_is_removed_and_name_repointed():
+    index = PricingIndex()
+    index.put("Gemini", "$2", provider="GCP")
+    index.put("Gemini", "$9", provider="AWS", source="assistant", ttl=60)
+    index._by_key[("gemini", "aws")]["expires_at"] = time.time() - 1
+
+    assert index.lookup("gemini", "aws") is None
+    assert ("gemini", "aws") not in index._by_key
+    # The name alone now finds the entry that is still valid
+    assert index.lookup("gemini")["price"] == "$2"
+    assert len(index) == 1
+
+
+def test_expired_only_entry_drops_the_name():
+    index = PricingIndex()
+    index.put("Phi", "$1", provider="Azure", ttl=60)
+    index._by_key[("phi", "azure")]["expires_at"] = time.time() - 1
+    assert index.lookup("phi") is None
+    assert "phi" not in index._by_name
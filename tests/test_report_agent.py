@@ -0,0 +1,84 @@
+import json
+import sys
+import types
+
+from agents import report_agent
+from agents.report_agent import ReportAgent
+
+RECOMMENDED = types.SimpleNamespace(models=[
+    types.SimpleNamespace(name="Azure OCR Read", type="OCR", accuracy="0.96", speed="200 ms per page",
+                          cloud="Azure", region="eastus", reason="fits"),
+])
+PRICING = types.SimpleNamespace(
+    note="",
+    quote_for=lambda name: types.SimpleNamespace(price="$1.50", unit="per 1K pages") if name == "Azure OCR Read" else None,
+)
+STREAMED = (
+    "Final Best Model Recommended:\n"
+    "1. Model Name      : **azure ocr read**\n"
+    "2. Price           : \n"
+    "3. Speed           : 200 ms per page\n"
+    "4. Accuracy        : 0.96\n"
+    "5. Cloud           : Azure\n"
+    "6. Region          : eastus\n"
+    "7. Reason for Selection : Best accuracy on scanned invoices"
+)
+BLOCKING = {
+    "model_name": "azure ocr read", "price": "", "speed": "200 ms per page", "accuracy": "0.96",
+    "cloud": "Azure", "region": "eastus", "reason": "Best accuracy on scanned invoices",
+}
+
+
+def _chunk(text):
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    def create(self, stream=False, **kwargs):
+        if stream:
+            # Split mid-line, as the API does
+            return iter(_chunk(STREAMED[i:i + 7]) for i in range(0, len(STREAMED), 7))
+        message = types.SimpleNamespace(content=json.dumps(BLOCKING))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def _agent(monkeypatch):
+    monkeypatch.setattr(ReportAgent, "save_final_model", lambda self, *args: None)
+    monkeypatch.setattr(report_agent, "print", lambda *args: None, raising=False)
+    return ReportAgent(types.SimpleNamespace(chat=types.SimpleNamespace(completions=FakeCompletions())))
+
+
+def test_stream_matches_the_blocking_report(monkeypatch):
+    agent = _agent(monkeypatch)
+    completed = []
+    streamed = "".join(agent.stream_report("a@b.c", "OCR", RECOMMENDED, PRICING,
+                                           on_complete=lambda text, model: completed.append((text, model))))
+    blocking = agent.generate_report("a@b.c", "OCR", RECOMMENDED, PRICING).to_text()
+
+    assert streamed == blocking
+    assert completed == [(blocking, "Azure OCR Read")]
+    assert "1. Model Name      : Azure OCR Read" in streamed
+    assert "2. Price           : $1.50 per 1K pages" in streamed
+    assert "4. Accuracy        : 96 %" in streamed
+
+
+def test_missing_fields_are_completed_in_order(monkeypatch):
+    # Fields out of order and some left out, still laid out as in to_text()
+    monkeypatch.setattr(sys.modules[__name__], "STREAMED", "4. Accuracy : 0.96\n1. Model Name : Azure OCR Read")
+    lines = "".join(_agent(monkeypatch).stream_report("a@b.c", "OCR", RECOMMENDED, PRICING)).splitlines()
+    assert lines == [
+        "Final Best Model Recommended:",
+        "1. Model Name      : Azure OCR Read",
+        "2. Price           : $1.50 per 1K pages",
+        "3. Speed           : 200 ms per page",
+        "4. Accuracy        : 96 %",
+        "5. Cloud           : Azure",
+        "6. Region          : eastus",
+        "7. Reason for Selection : Not available",
+    ]
+
+
+def test_unformatted_stream_is_an_error(monkeypatch):
+    monkeypatch.setattr(sys.modules[__name__], "STREAMED", "Sorry, I can't help with that.")
+    text = "".join(_agent(monkeypatch).stream_report("a@b.c", "OCR", RECOMMENDED, PRICING))
+    assert text.startswith("Error generating report")
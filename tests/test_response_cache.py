@@ -0,0 +1,67 @@
+import numpy as np
+
+from agents.response_cache import RequirementCache, minhash, normalize_requirement
+
+RESULT = {"recommended": ["Azure OCR Read"], "report": "report", "final_model": "Azure OCR Read"}
+
+
+def test_drops_case_punctuation_and_filler_words():
+    assert normalize_requirement("Please recommend the BEST model for OCR!") == "ocr"
+
+
+def test_singularizes_plurals_but_not_double_s():
+    assert normalize_requirement("invoices and receipts") == "invoice receipt"
+    assert normalize_requirement("process business documents") == "process business document"
+
+
+def test_keeps_direction_words_and_order():
+    assert normalize_requirement("speech to text") == "speech to text"
+    assert normalize_requirement("text to speech") == "text to speech"
+
+
+def test_empty_and_non_string_input():
+    assert normalize_requirement(None) == ""
+    assert normalize_requirement("") == ""
+    assert normalize_requirement(42) == "42"
+
+
+def _similarity(a, b):
+    return float(np.mean(minhash(normalize_requirement(a)) == minhash(normalize_requirement(b))))
+
+
+def test_near_duplicate_hits():
+    cache = RequirementCache()
+    cache.put("OCR model for invoices with accuracy above 95%", RESULT)
+    assert cache.get("OCR models for invoice with accuracy above 95 %") == RESULT
+
+
+def test_different_accuracy_threshold_misses():
+    cache = RequirementCache()
+    stored, asked = "OCR model for invoices with accuracy above 95%", "OCR model for invoices with accuracy above 90%"
+    assert _similarity(stored, asked) >= cache.threshold
+    cache.put(stored, RESULT)
+    assert cache.get(asked) is None
+
+
+def test_different_price_limit_misses():
+    # A low threshold, so only the price limit can keep these apart
+    cache = RequirementCache(threshold=0.5)
+    stored, asked = "speech to text transcription under $5 per hour", "speech to text transcription under $50 per hour"
+    assert _similarity(stored, asked) >= cache.threshold
+    cache.put(stored, RESULT)
+    assert cache.get(asked) is None
+    assert cache.get("speech to text transcriptions under $5 per hour please") == RESULT
+
+
+def test_same_key_with_different_currency_misses():
+    cache = RequirementCache()
+    cache.put("translation under $5", RESULT)
+    assert normalize_requirement("translation under 5") == normalize_requirement("translation under $5")
+    assert cache.get("translation under 5") is None
+    assert cache.get("translation under $5") == RESULT
+
+
+def test_reordered_requirement_misses():
+    cache = RequirementCache(threshold=0.5)
+    cache.put("translate english to french", RESULT)
+    assert cache.get("translate french to english") is None
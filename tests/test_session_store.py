@@ -0,0 +1,60 @@
+import pytest
+
+from agents import session_store
+from agents.session_store import MemorySessionStore, SessionConflict, _appended
+
+
+def _turn(n):
+    return {"message": f"q{n}", "response": f"a{n}", "tokens": 2}
+
+
+def test_appended_handles_trimmed_fronts():
+    assert _appended([], [_turn(1)]) == [_turn(1)]
+    assert _appended([_turn(1), _turn(2)], [_turn(1), _turn(2), _turn(3)]) == [_turn(3)]
+    # The oldest turn was trimmed while appending
+    assert _appended([_turn(1), _turn(2)], [_turn(2), _turn(3)]) == [_turn(3)]
+    # A repeated identical turn still counts as new
+    assert _appended([_turn(1)], [_turn(1), _turn(1)]) == [_turn(1)]
+
+
+def test_concurrent_turns_keep_both_histories():
+    store = MemorySessionStore()
+    store.save("a@b.c", {"history": [_turn(1)], "current_model": None})
+
+    first, second = store.load("a@b.c"), store.load("a@b.c")
+    base = dict(second, history=list(second["history"]))
+    first["history"].append(_turn(2))
+    store.save("a@b.c", first)
+
+    second["history"].append(_turn(3))
+    second["current_model"] = "GPT-4o"
+    store.save("a@b.c", second, base)
+
+    saved = store.load("a@b.c")
+    assert saved["history"] == [_turn(1), _turn(2), _turn(3)]
+    assert saved["current_model"] == "GPT-4o"
+    assert store.stats()["conflicts"] == 1
+
+
+def test_merged_history_is_capped(monkeypatch):
+    monkeypatch.setattr(session_store, "SESSION_HISTORY_TURNS", 3)
+    store = MemorySessionStore()
+    store.save("a@b.c", {"history": [_turn(1), _turn(2)]})
+
+    first, second = store.load("a@b.c"), store.load("a@b.c")
+    base = dict(second, history=list(second["history"]))
+    first["history"] += [_turn(3)]
+    store.save("a@b.c", first)
+    second["history"] = second["history"][1:] + [_turn(4)]
+    store.save("a@b.c", second, base)
+
+    assert store.load("a@b.c")["history"] == [_turn(2), _turn(3), _turn(4)]
+
+
+def test_conflict_without_base_raises():
+    store = MemorySessionStore()
+    store.save("a@b.c", {"history": []})
+    first, second = store.load("a@b.c"), store.load("a@b.c")
+    store.save("a@b.c", first)
+    with pytest.raises(SessionConflict):
+        store.save("a@b.c", second)
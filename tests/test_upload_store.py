@@ -0,0 +1,122 @@
+import hashlib
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from agents import extraction_cache, upload_store  # noqa: E402
+from agents.upload_store import UploadError, create_upload, write_chunk  # noqa: E402
+
+DATA = b"a,b\n" + b"1,2\n" * 100
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    collection = mongomock.MongoClient().db.uploads
+    scheduled = []
+    monkeypatch.setattr(upload_store, "uploads_col", collection)
+    monkeypatch.setattr(upload_store, "UPLOAD_PARTIAL_DIR", str(tmp_path / ".partial"))
+    monkeypatch.setattr(extraction_cache, "UPLOAD_OBJECTS_DIR", str(tmp_path / ".objects"))
+    monkeypatch.setattr(upload_store, "_schedule_extraction", lambda upload_id, email: scheduled.append(upload_id))
+    monkeypatch.setattr(upload_store, "UPLOAD_CHUNK_BYTES", 128)
+    upload_store._hashers.clear()
+    collection.scheduled = scheduled
+    return collection
+
+
+def _send(doc, offset, data):
+    return write_chunk(doc["_id"], "a@example.com", offset, io.BytesIO(data), len(data))
+
+
+def _upload_all(doc):
+    for offset in range(0, len(DATA), 128):
+        result = _send(doc, offset, DATA[offset:offset + 128])
+    return result
+
+
+def test_chunks_complete_the_upload(uploads):
+    doc = create_upload("a@example.com", "table.csv", len(DATA))
+    result = _upload_all(doc)
+
+    assert result["status"] == "processing"
+    assert result["received"] == len(DATA)
+    assert result["sha256"] == hashlib.sha256(DATA).hexdigest()
+    assert result["lease_until"] is None
+    with open(result["path"], "rb") as f:
+        assert f.read() == DATA
+    assert uploads.scheduled == [doc["_id"]]
+
+
+def test_wrong_offset_reports_the_bytes_received(uploads):
+    doc = create_upload("a@example.com", "table.csv", len(DATA))
+    _send(doc, 0, DATA[:128])
+    with pytest.raises(UploadError) as error:
+        _send(doc, 64, DATA[64:192])
+    assert error.value.status == 409
+    assert error.value.details["received"] == 128
+
+
+def test_hash_survives_a_lost_hasher(uploads):
+    doc = create_upload("a@example.com", "table.csv", len(DATA))
+    _send(doc, 0, DATA[:128])
+    # Another process wrote the first chunk: the hash is rebuilt from the partial file
+    upload_store._hashers.clear()
+    for offset in range(128, len(DATA), 128):
+        result = _send(doc, offset, DATA[offset:offset + 128])
+    assert result["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_held_lease_blocks_a_concurrent_chunk(uploads):
+    doc = create_upload("a@example.com", "table.csv", len(DATA))
+    uploads.update_one({"_id": doc["_id"]}, {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=60)}})
+    with pytest.raises(UploadError) as error:
+        _send(doc, 0, DATA[:128])
+    assert error.value.status == 409
+
+    # A crashed writer's lease lapses
+    uploads.update_one({"_id": doc["_id"]}, {"$set": {"lease_until": datetime.utcnow() - timedelta(seconds=1)}})
+    assert _send(doc, 0, DATA[:128])["received"] == 128
+
+
+def test_oversized_chunk_is_rejected_and_releases_the_lease(uploads):
+    doc = create_upload("a@example.com", "table.csv", 100)
+    with pytest.raises(UploadError) as error:
+        write_chunk(doc["_id"], "a@example.com", 0, io.BytesIO(DATA[:128]))
+    assert error.value.status == 413
+    stored = uploads.find_one({"_id": doc["_id"]})
+    assert stored["lease_until"] is None and stored["received"] == 0
+    # The failed attempt's bytes are overwritten by the retry
+    assert _send(doc, 0, DATA[:100])["status"] == "processing"
+
+
+def test_retried_last_chunk_returns_the_completed_upload(uploads):
+    doc = create_upload("a@example.com", "table.csv", len(DATA))
+    done = _upload_all(doc)
+    last = (len(DATA) - 1) // 128 * 128
+    again = _send(doc, last, DATA[last:])
+    assert again["status"] == "processing" and again["path"] == done["path"]
+    assert uploads.scheduled == [doc["_id"]]
+
+
+def test_interrupted_completion_is_finished_by_a_retry(uploads, monkeypatch):
+    doc = create_upload("a@example.com", "table.csv", len(DATA))
+    complete = upload_store._complete
+
+    def crash(stored):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(upload_store, "_complete", crash)
+    with pytest.raises(OSError):
+        _upload_all(doc)
+    stored = uploads.find_one({"_id": doc["_id"]})
+    assert stored["status"] == "storing" and stored["sha256"] == hashlib.sha256(DATA).hexdigest()
+
+    monkeypatch.setattr(upload_store, "_complete", complete)
+    # The crashed attempt still holds the lease until it lapses
+    uploads.update_one({"_id": doc["_id"]}, {"$set": {"lease_until": datetime.utcnow() - timedelta(seconds=1)}})
+    last = (len(DATA) - 1) // 128 * 128
+    result = _send(doc, last, DATA[last:])
+    assert result["status"] == "processing"
+    assert uploads.scheduled == [doc["_id"]]